@@ -0,0 +1,141 @@
+"""
+NumPy arrays in shared memory, readable without copying. a block holds
+magic bytes, the length of a JSON header giving the array's dtype and
+shape, the header, and then -- starting at a 64-byte-aligned offset -- the
+array's data in C order. readers get an np.ndarray backed directly by the
+block, so a large array (e.g. a matrix of filter responsivities) can be
+published once and used by every worker process.
+
+views are read-only, and made from a separate mapping of the block (see
+memutilz.map_block()) that stays mapped until every view of it is gone,
+so they can't outlive their memory. replacing or deleting an array doesn't
+disturb existing views either: they keep the old, unlinked, block until
+they're dropped.
+"""
+import json
+from multiprocessing.shared_memory import SharedMemory
+from random import randint
+import struct
+from typing import Optional
+
+import numpy as np
+
+from notetaking.memutilz import attach_block, create_block, map_block
+
+MAGIC = b"NPAR"
+PREAMBLE = struct.Struct("<4sI")
+ALIGNMENT = 64
+
+
+def _header(array: np.ndarray) -> bytes:
+    header = json.dumps(
+        {"dtype": array.dtype.str, "shape": list(array.shape)}
+    ).encode()
+    padding = -(PREAMBLE.size + len(header)) % ALIGNMENT
+    return header + b" " * padding
+
+
+def array_size(array: np.ndarray) -> int:
+    """size of a block holding array"""
+    return PREAMBLE.size + len(_header(array)) + array.nbytes
+
+
+def is_array(buf) -> bool:
+    return bytes(buf[:len(MAGIC)]) == MAGIC
+
+
+def write_array(buf, array: np.ndarray):
+    """write array, with its header, into buf (e.g. a SharedMemory's)"""
+    if array.dtype.hasobject:
+        raise TypeError("arrays of Python objects can't be shared")
+    header = _header(array)
+    PREAMBLE.pack_into(buf, 0, MAGIC, len(header))
+    start = PREAMBLE.size + len(header)
+    buf[PREAMBLE.size:start] = header
+    target = np.ndarray(
+        array.shape, dtype=array.dtype, buffer=buf, offset=start
+    )
+    target[...] = array
+
+
+def array_view(buf) -> np.ndarray:
+    """read-only array backed by buf, which write_array() wrote"""
+    magic, header_length = PREAMBLE.unpack_from(buf)
+    if magic != MAGIC:
+        raise TypeError("this block doesn't hold an array")
+    header = json.loads(
+        bytes(buf[PREAMBLE.size:PREAMBLE.size + header_length])
+    )
+    view = np.ndarray(
+        tuple(header["shape"]),
+        dtype=np.dtype(header["dtype"]),
+        buffer=buf,
+        offset=PREAMBLE.size + header_length,
+    )
+    view.flags.writeable = False
+    return view
+
+
+def shared_array(address: str) -> np.ndarray:
+    """
+    read-only view of the array in the block at address. raises
+    FileNotFoundError if there's no block there, and TypeError if it
+    doesn't hold an array.
+    """
+    return array_view(map_block(address))
+
+
+def slice_into_shared_memory(
+    array: np.ndarray, address: str, exists_ok: bool = True
+) -> SharedMemory:
+    """copy array into a new block at address, and return the block"""
+    array = np.ascontiguousarray(array)
+    block = create_block(address, array_size(array), exists_ok)
+    write_array(block.buf, array)
+    return block
+
+
+class ArrayNote:
+    """
+    an array published once to shared memory, like a Sticky. other
+    processes make an ArrayNote with the same address and read .array.
+    """
+
+    def __init__(self, address: str):
+        self.address = address
+        self._array: Optional[np.ndarray] = None
+
+    @classmethod
+    def note(
+        cls,
+        array: np.ndarray,
+        address: Optional[str] = None,
+        exists_ok: bool = False,
+    ) -> "ArrayNote":
+        if address is None:
+            address = f"array_{randint(100000, 999999)}"
+        slice_into_shared_memory(array, address, exists_ok).close()
+        return cls(address)
+
+    @property
+    def array(self) -> Optional[np.ndarray]:
+        """view of the array, or None if nothing is published here"""
+        if self._array is None:
+            try:
+                self._array = shared_array(self.address)
+            except FileNotFoundError:
+                return None
+        return self._array
+
+    def close(self):
+        """remove the array from shared memory. existing views stay valid."""
+        self._array = None
+        block = attach_block(self.address)
+        block.unlink()
+        block.close()
+
+    def __repr__(self):
+        array = self.array
+        if array is None:
+            return f"ArrayNote at {self.address} (empty)"
+        return f"ArrayNote at {self.address}: {array.dtype} {array.shape}"
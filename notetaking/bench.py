@@ -0,0 +1,144 @@
+"""
+microbenchmark of Notepad index operations: the hash-table index
+(notetaking.hashindex) against the ShareableList index it replaced, which
+walked the whole list on every lookup. times lookups of present keys,
+lookups of missing keys, and adding then removing a key, in an index
+already holding n keys. "growable" is the index Notepads actually use,
+grown to n keys from a small start. run with:
+
+python -m notetaking.bench [n ...]
+"""
+from multiprocessing.shared_memory import ShareableList
+from random import randint, sample
+import sys
+import time
+
+from notetaking.hashindex import GrowableIndex, HashIndex
+
+SIZES = (256, 4096, 65536)
+MAX_KEY_CHARACTERS = 128
+
+
+class ListIndex:
+    """the old ShareableList index, as Notepad used it"""
+
+    def __init__(self, keys, capacity):
+        # as Notepad.open() made it
+        self.memory = ShareableList(
+            [b"\x00" * MAX_KEY_CHARACTERS for _ in range(capacity)]
+        )
+        for ix, key in enumerate(keys):
+            self.memory[ix] = key
+
+    def index(self):
+        keys = []
+        for key in self.memory:
+            if key == b"":
+                break
+            keys.append(key)
+        return keys
+
+    def __contains__(self, key):
+        return key in self.index()
+
+    def add(self, key):
+        index = self.index()
+        if key not in index:
+            self.memory[len(index)] = key
+
+    def remove(self, key):
+        index = self.index()
+        ix = index.index(key)
+        self.memory[ix] = self.memory[len(index) - 1]
+        self.memory[len(index) - 1] = b""
+
+    def close(self):
+        self.memory.shm.close()
+        self.memory.shm.unlink()
+
+
+class HashTableIndex:
+    def __init__(self, keys, capacity):
+        self.table = HashIndex.create(
+            f"bench_{randint(100000, 999999)}_index",
+            capacity,
+            MAX_KEY_CHARACTERS,
+        )
+        for key in keys:
+            self.table.add(key)
+
+    def __contains__(self, key):
+        return key in self.table
+
+    def add(self, key):
+        self.table.add(key)
+
+    def remove(self, key):
+        self.table.remove(key)
+
+    def close(self):
+        block = self.table.block
+        self.table.close()
+        block.unlink()
+
+
+class GrowingIndex(HashTableIndex):
+    def __init__(self, keys, capacity):
+        # grows through several generations on the way to capacity
+        self.table = GrowableIndex.create(
+            f"bench_{randint(100000, 999999)}_index", 16, MAX_KEY_CHARACTERS
+        )
+        for key in keys:
+            self.table.add(key)
+        # room for the key add+remove adds, so that the timed ops don't
+        # include a final growth
+        if self.table.capacity < capacity:
+            self.table.grow(max_keys=capacity)
+
+    def close(self):
+        self.table.unlink()
+        self.table.close()
+
+
+def time_per_op(func, args):
+    start = time.perf_counter()
+    for arg in args:
+        func(arg)
+    return (time.perf_counter() - start) / len(args) * 1e6
+
+
+def bench(index_class, n, ops):
+    keys = [f"key_{ix}" for ix in range(n)]
+    index = index_class(keys, n + 1)
+    present = sample(keys, min(ops, n))
+    missing = [f"missing_{ix}" for ix in range(ops)]
+
+    def add_remove(key):
+        index.add(key)
+        index.remove(key)
+
+    try:
+        return {
+            "hit": time_per_op(index.__contains__, present),
+            "miss": time_per_op(index.__contains__, missing),
+            "add+remove": time_per_op(add_remove, missing),
+        }
+    finally:
+        index.close()
+
+
+def main(sizes=SIZES):
+    print(f"{'keys':>7} {'index':>10} {'op':>11} {'us/op':>12}")
+    for n in sizes:
+        # the list index walks every key per op, so time fewer of them
+        for name, index_class, ops in (
+            ("list", ListIndex, max(10, 200000 // n)),
+            ("hash", HashTableIndex, 2000),
+            ("growable", GrowingIndex, 2000),
+        ):
+            for op, microseconds in bench(index_class, n, ops).items():
+                print(f"{n:>7} {name:>10} {op:>11} {microseconds:>12.2f}")
+
+
+if __name__ == "__main__":
+    main([int(arg) for arg in sys.argv[1:]] or SIZES)
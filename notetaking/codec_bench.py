@@ -0,0 +1,93 @@
+"""
+benchmark of notetaking.codecs against the legacy JSON-then-pickle codec,
+on payloads like those VISOR keeps in notepads: a session's inventory
+state (see visor/inventory.py), a reflectance spectrum as an array and as
+the wavelength-keyed dict the graph view sends, and a sample with its
+spectrum and simulated spectra as a mixed object. run with:
+
+python -m notetaking.codec_bench
+"""
+import random
+import time
+
+import numpy as np
+
+from notetaking.codecs import (
+    CODECS, decode, encode, json_pickle_decoder, json_pickle_encoder
+)
+
+
+def brief(pk):
+    return {
+        "id": pk,
+        "wavelength_range": "350-2500",
+        "sample_id": f"SAMPLE-{pk:06d}",
+        "sample_name": f"basalt {pk}",
+        "grain_size": "<45 um",
+        "origin": "RELAB",
+        "sample_type": ["Rock", "Igneous"],
+    }
+
+
+def payloads():
+    briefs = [brief(pk) for pk in random.sample(range(100000), 500)]
+    wavelengths = np.arange(350, 2500.5, 1.0)
+    reflectance = 0.3 + 0.1 * np.sin(wavelengths / 200)
+    spectrum = np.column_stack([wavelengths, reflectance])
+    return {
+        "inventory state (500 samples)": {
+            "inventory": [b["id"] for b in briefs],
+            "inventory_json": __import__("json").dumps(briefs),
+            "inventory_version": 12,
+        },
+        "reflectance array (2151 x 2)": spectrum,
+        "reflectance dict (2151 keys)": {
+            str(w): r for w, r in spectrum.tolist()
+        },
+        "sample with spectra (mixed)": {
+            "brief": brief(1),
+            "reflectance": spectrum,
+            "simulated": {"MCAM": (np.linspace(400, 1000, 12), np.ones(12))},
+        },
+    }
+
+
+def time_call(func, arg, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = func(arg)
+    return (time.perf_counter() - start) / repeat * 1e6, result
+
+
+def schemes():
+    yield "legacy json/pickle", json_pickle_encoder, json_pickle_decoder
+    yield "auto", encode, decode
+    yield "json", lambda value: encode(value, "json"), decode
+    for name, codec in CODECS.items():
+        if codec.compressor is True:
+            yield (
+                f"auto + {name}",
+                lambda value, name=name: encode(value, compression=name),
+                decode,
+            )
+
+
+def main(repeat=200):
+    print(f"{'payload':<31} {'codec':<19} {'bytes':>9} {'enc us':>9} "
+          f"{'dec us':>9}")
+    for payload_name, payload in payloads().items():
+        for name, encoder, decoder in schemes():
+            try:
+                encode_us, encoded = time_call(encoder, payload, repeat)
+                decode_us, _ = time_call(decoder, encoded, repeat)
+            except TypeError as ex:
+                print(f"{payload_name:<31} {name:<19} failed: {ex}")
+                continue
+            print(
+                f"{payload_name:<31} {name:<19} {len(encoded):>9} "
+                f"{encode_us:>9.1f} {decode_us:>9.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,346 @@
+"""
+open-addressing hash table of Notepad keys, laid out in a single
+shared-memory block so that any process can look keys up in O(1) by
+opening one address.
+
+layout (little-endian): a header of magic bytes, slot count, maximum number
+of keys, live key count, tombstone count, maximum key length in bytes, the
+table's generation, and the latest generation (see below); then `slots`
+slots, each a state byte (empty, used, or deleted), a uint16 key length,
+and the UTF-8 key, NUL-padded to the maximum key length. slot count is a
+power of two at least twice the maximum number of keys, so probe sequences
+(linear, from the key's CRC32) stay short.
+
+a HashIndex has a fixed capacity. GrowableIndex lifts it: when a key won't
+fit, it copies the keys into a new, larger, table at `{address}@{n}` and
+records n as the latest generation in the header of the original (root)
+table, which never moves. every operation checks the root's latest
+generation first and moves to the newest table if it has changed, so
+processes that attached an older table just follow along.
+
+neither class does locking of its own: callers must hold the Notepad's
+index lock while adding or removing keys, and so while an index grows.
+lookups are safe without it, although they may miss a key that is being
+added concurrently, or any key while remove() compacts the table or add()
+grows the index.
+"""
+from multiprocessing.shared_memory import SharedMemory
+import struct
+from typing import Iterator, Optional
+import zlib
+
+from notetaking.memutilz import attach_block, create_block
+
+MAGIC = b"NPH2"
+HEADER = struct.Struct("<4sIIIIIII")
+# offset of the latest generation in HEADER
+LATEST = struct.Struct("<I")
+LATEST_OFFSET = 28
+SLOT_HEADER = struct.Struct("<BH")
+EMPTY, USED, DELETED = 0, 1, 2
+
+
+def slot_count(max_keys: int) -> int:
+    slots = 8
+    while slots < 2 * max_keys:
+        slots *= 2
+    return slots
+
+
+def index_size(max_keys: int, max_key_bytes: int) -> int:
+    """size in bytes of a HashIndex block for max_keys keys"""
+    return (
+        HEADER.size
+        + slot_count(max_keys) * (SLOT_HEADER.size + max_key_bytes)
+    )
+
+
+class HashIndex:
+    """hash table of keys in a shared memory block"""
+
+    def __init__(self, block: SharedMemory):
+        self.block = block
+        self.buf = block.buf
+        (
+            magic, slots, max_keys, _, _, max_key_bytes, generation, _
+        ) = HEADER.unpack_from(self.buf)
+        if magic != MAGIC:
+            raise ValueError(f"{block.name} does not hold a Notepad index")
+        self.slots, self.max_keys = slots, max_keys
+        self.max_key_bytes, self.generation = max_key_bytes, generation
+        self.slot_size = SLOT_HEADER.size + max_key_bytes
+        self._mask = slots - 1
+
+    @classmethod
+    def create(
+        cls,
+        address: str,
+        max_keys: int,
+        max_key_bytes: int,
+        generation: int = 0,
+    ) -> "HashIndex":
+        """
+        create a new, empty index at address. like SharedMemory, raises
+        FileExistsError if there's already a block there.
+        """
+        block = create_block(
+            address, index_size(max_keys, max_key_bytes), exists_ok=False
+        )
+        # new blocks are zero-filled, i.e. all slots are empty
+        HEADER.pack_into(
+            block.buf,
+            0,
+            MAGIC,
+            slot_count(max_keys),
+            max_keys,
+            0,
+            0,
+            max_key_bytes,
+            generation,
+            generation,
+        )
+        return cls(block)
+
+    @property
+    def count(self) -> int:
+        return HEADER.unpack_from(self.buf)[3]
+
+    @property
+    def tombstones(self) -> int:
+        return HEADER.unpack_from(self.buf)[4]
+
+    @property
+    def latest(self) -> int:
+        """latest generation of the index this is the root table of"""
+        return LATEST.unpack_from(self.buf, LATEST_OFFSET)[0]
+
+    @latest.setter
+    def latest(self, generation: int):
+        LATEST.pack_into(self.buf, LATEST_OFFSET, generation)
+
+    def _set_counts(self, count: int, tombstones: int):
+        struct.pack_into("<II", self.buf, 12, count, tombstones)
+
+    def _encode(self, key: str) -> bytes:
+        encoded = key.encode()
+        if len(encoded) > self.max_key_bytes:
+            raise KeyError(
+                f"{key} is longer than this index's maximum key length "
+                f"({self.max_key_bytes} bytes)"
+            )
+        return encoded
+
+    def _offset(self, slot: int) -> int:
+        return HEADER.size + slot * self.slot_size
+
+    def _probe(self, encoded: bytes) -> tuple[Optional[int], Optional[int]]:
+        """
+        returns the slot holding encoded, if any, and the first slot it
+        could be inserted into
+        """
+        buf, slot, free = self.buf, zlib.crc32(encoded) & self._mask, None
+        for _ in range(self.slots):
+            offset = self._offset(slot)
+            state, length = SLOT_HEADER.unpack_from(buf, offset)
+            if state == EMPTY:
+                return None, slot if free is None else free
+            start = offset + SLOT_HEADER.size
+            if state == DELETED:
+                if free is None:
+                    free = slot
+            elif buf[start:start + length] == encoded:
+                return slot, None
+            slot = (slot + 1) & self._mask
+        return None, free
+
+    def __contains__(self, key: str) -> bool:
+        return self._probe(self._encode(key))[0] is not None
+
+    def add(self, key: str) -> bool:
+        """add key; returns False if it was already present"""
+        encoded = self._encode(key)
+        found, free = self._probe(encoded)
+        if found is not None:
+            return False
+        count, tombstones = self.count, self.tombstones
+        if count >= self.max_keys:
+            raise IndexError(
+                f"index is full ({self.max_keys} keys)"
+            )
+        offset = self._offset(free)
+        if SLOT_HEADER.unpack_from(self.buf, offset)[0] == DELETED:
+            tombstones -= 1
+        start = offset + SLOT_HEADER.size
+        self.buf[start:start + len(encoded)] = encoded
+        # write the state last, so that concurrent readers never see a
+        # half-written key
+        SLOT_HEADER.pack_into(self.buf, offset, USED, len(encoded))
+        self._set_counts(count + 1, tombstones)
+        return True
+
+    def remove(self, key: str):
+        """remove key; raises KeyError if it isn't present"""
+        found, _ = self._probe(self._encode(key))
+        if found is None:
+            raise KeyError(f"{key} not found in this Notepad's index.")
+        SLOT_HEADER.pack_into(self.buf, self._offset(found), DELETED, 0)
+        self._set_counts(self.count - 1, self.tombstones + 1)
+        # deleted slots lengthen probes for missing keys; compact once they
+        # make up a quarter of the table
+        if self.tombstones > self.slots // 4:
+            self._rehash()
+
+    def _rehash(self):
+        keys = list(self)
+        self.buf[HEADER.size:] = bytes(len(self.buf) - HEADER.size)
+        self._set_counts(0, 0)
+        for key in keys:
+            self.add(key)
+
+    def __iter__(self) -> Iterator[str]:
+        buf = self.buf
+        for slot in range(self.slots):
+            offset = self._offset(slot)
+            state, length = SLOT_HEADER.unpack_from(buf, offset)
+            if state == USED:
+                start = offset + SLOT_HEADER.size
+                yield bytes(buf[start:start + length]).decode()
+
+    def __len__(self) -> int:
+        return self.count
+
+    def close(self):
+        self.buf = None
+        self.block.close()
+
+
+def table_address(address: str, generation: int) -> str:
+    """address of generation `generation` of the index rooted at address"""
+    if generation == 0:
+        return address
+    return f"{address}@{generation}"
+
+
+class GrowableIndex:
+    """
+    hash table of keys in shared memory that grows as needed: a root
+    HashIndex at address, and the latest table it points to.
+    """
+
+    def __init__(self, address: str):
+        self.address = address
+        self.root = HashIndex(attach_block(address))
+        self.table = self.root
+        self.follow()
+
+    @classmethod
+    def create(
+        cls, address: str, max_keys: int, max_key_bytes: int
+    ) -> "GrowableIndex":
+        """
+        create a new, empty index at address, initially sized for max_keys
+        keys of up to max_key_bytes bytes. raises FileExistsError if
+        there's already a block there.
+        """
+        HashIndex.create(address, max_keys, max_key_bytes).close()
+        return cls(address)
+
+    def follow(self) -> HashIndex:
+        """the latest table, attaching it if the index has grown"""
+        latest = self.root.latest
+        if latest != self.table.generation:
+            table = HashIndex(
+                attach_block(table_address(self.address, latest))
+            )
+            if self.table is not self.root:
+                self.table.close()
+            self.table = table
+        return self.table
+
+    def grow(
+        self,
+        max_keys: Optional[int] = None,
+        max_key_bytes: Optional[int] = None,
+    ) -> HashIndex:
+        """
+        copy the keys into a new table with room for at least max_keys keys
+        of up to max_key_bytes bytes, make it the latest, and return it. the
+        table it replaces is unlinked, unless it's the root; processes that
+        still have it attached move on at their next operation.
+        """
+        old = self.follow()
+        max_keys = max(max_keys or 0, old.max_keys)
+        max_key_bytes = max(max_key_bytes or 0, old.max_key_bytes)
+        address = table_address(self.address, old.generation + 1)
+        try:
+            table = HashIndex.create(
+                address, max_keys, max_key_bytes, old.generation + 1
+            )
+        except FileExistsError:
+            # left behind by a process that died while growing this index
+            attach_block(address).unlink()
+            table = HashIndex.create(
+                address, max_keys, max_key_bytes, old.generation + 1
+            )
+        for key in old:
+            table.add(key)
+        # publish the new table only once it holds every key
+        self.root.latest = table.generation
+        self.table = table
+        if old is not self.root:
+            old.block.unlink()
+            old.close()
+        return table
+
+    def __contains__(self, key: str) -> bool:
+        table = self.follow()
+        if len(key.encode()) > table.max_key_bytes:
+            return False
+        return key in table
+
+    def add(self, key: str) -> bool:
+        """add key, growing the index if needed; False if already present"""
+        table = self.follow()
+        length = len(key.encode())
+        if length > table.max_key_bytes:
+            table = self.grow(
+                max_key_bytes=max(length, 2 * table.max_key_bytes)
+            )
+        try:
+            return table.add(key)
+        except IndexError:
+            return self.grow(max_keys=2 * table.max_keys).add(key)
+
+    def remove(self, key: str):
+        """remove key; raises KeyError if it isn't present"""
+        self.follow().remove(key)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.follow())
+
+    def __len__(self) -> int:
+        return len(self.follow())
+
+    @property
+    def capacity(self) -> int:
+        return self.follow().max_keys
+
+    @property
+    def nbytes(self) -> int:
+        """size of the blocks making up the index"""
+        table = self.follow()
+        if table is self.root:
+            return self.root.block.size
+        return self.root.block.size + table.block.size
+
+    def close(self):
+        if self.table is not self.root:
+            self.table.close()
+        self.root.close()
+
+    def unlink(self):
+        """unlink every block of the index; call close() afterwards"""
+        table = self.follow()
+        if table is not self.root:
+            table.block.unlink()
+        self.root.block.unlink()
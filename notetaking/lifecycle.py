@@ -0,0 +1,157 @@
+"""
+lifecycle management for Notepad segments. every Notepad leaves an index
+block, a lock file and a block per key in shared memory until something
+closes it, and the processes that make per-session notepads rarely get to.
+this module finds them by their lock files, whose modification time is
+each notepad's last access time (see Paper._touch()), and removes those
+idle past a TTL, then the least recently used until the rest fit a byte
+budget. sweep() runs once; Sweeper runs it periodically in a background
+thread.
+"""
+from dataclasses import dataclass
+import logging
+from pathlib import Path
+import threading
+import time
+from typing import Callable, Collection, Optional
+
+from notetaking.hashindex import GrowableIndex
+from notetaking.locking import LOCK_DIR
+from notetaking.memutilz import attach_block
+from notetaking.notepad import Notepad
+
+logger = logging.getLogger(__name__)
+
+LOCK_SUFFIX = "_index.lock"
+
+
+@dataclass
+class Segment:
+    """a notepad in shared memory"""
+
+    prefix: str
+    keys: int
+    bytes: int
+    last_access: float
+
+    def idle(self, now: float) -> float:
+        return now - self.last_access
+
+
+def _block_size(address: str) -> int:
+    try:
+        block = attach_block(address)
+    except FileNotFoundError:
+        return 0
+    size = block.size
+    block.close()
+    return size
+
+
+def segments(directory: Path = LOCK_DIR) -> list[Segment]:
+    """every notepad with a lock file in directory"""
+    found = []
+    for path in directory.glob(f"*{LOCK_SUFFIX}"):
+        prefix = path.name[:-len(LOCK_SUFFIX)]
+        # read the index directly: going through a Notepad would count as
+        # an access
+        try:
+            last_access = path.stat().st_mtime
+            index = GrowableIndex(f"{prefix}_index")
+            keys = list(index)
+        except (FileNotFoundError, ValueError):
+            # closed (or grown) since we listed it, still being opened, or
+            # not a notepad at all
+            continue
+        size = index.nbytes + sum(
+            _block_size(f"{prefix}_{key}") for key in keys
+        )
+        index.close()
+        found.append(Segment(prefix, len(keys), size, last_access))
+    return found
+
+
+def usage(directory: Path = LOCK_DIR) -> dict:
+    """totals over every notepad in directory, for monitoring"""
+    found, now = segments(directory), time.time()
+    return {
+        "notepads": len(found),
+        "keys": sum(segment.keys for segment in found),
+        "bytes": sum(segment.bytes for segment in found),
+        "max_idle": max((segment.idle(now) for segment in found), default=0),
+    }
+
+
+def _remove(prefix: str) -> bool:
+    try:
+        Notepad(prefix).close()
+        return True
+    except (FileNotFoundError, KeyError, TimeoutError):
+        # someone else closed it first, or it's busy: leave it for the
+        # next sweep
+        return False
+
+
+def sweep(
+    max_bytes: Optional[int] = None,
+    ttl: Optional[float] = None,
+    directory: Path = LOCK_DIR,
+    dry_run: bool = False,
+    keep: Collection[str] = (),
+) -> list[Segment]:
+    """
+    remove notepads idle for more than ttl seconds, then least recently
+    used notepads until the rest total at most max_bytes. notepads whose
+    prefixes are in keep are never removed. returns the notepads removed
+    (or, if dry_run is True, that would have been).
+    """
+    now, removed = time.time(), []
+    live = sorted(segments(directory), key=lambda s: s.last_access)
+    live = [segment for segment in live if segment.prefix not in keep]
+    total = sum(segment.bytes for segment in live)
+    for segment in live:
+        expired = ttl is not None and segment.idle(now) > ttl
+        if not expired and (max_bytes is None or total <= max_bytes):
+            # sorted by last access, so nothing later is expired either
+            break
+        if dry_run is True or _remove(segment.prefix):
+            total -= segment.bytes
+            removed.append(segment)
+    return removed
+
+
+class Sweeper(threading.Thread):
+    """
+    daemon thread that calls sweep() every interval seconds, never removing
+    the notepads in keep. on_sweep, if given, is called with the removed
+    notepads and usage() afterwards.
+    """
+
+    def __init__(
+        self,
+        interval: float,
+        max_bytes: Optional[int] = None,
+        ttl: Optional[float] = None,
+        directory: Path = LOCK_DIR,
+        on_sweep: Optional[Callable[[list[Segment], dict], None]] = None,
+        keep: Collection[str] = (),
+    ):
+        super().__init__(daemon=True, name="notepad-sweeper")
+        self.interval, self.max_bytes, self.ttl = interval, max_bytes, ttl
+        self.directory, self.on_sweep = directory, on_sweep
+        self.keep = tuple(keep)
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                removed = sweep(
+                    self.max_bytes, self.ttl, self.directory, keep=self.keep
+                )
+                if self.on_sweep is not None:
+                    self.on_sweep(removed, usage(self.directory))
+            except Exception as ex:
+                logger.exception(f"notepad sweep failed: {ex}")
+
+    def stop(self):
+        self._stopped.set()
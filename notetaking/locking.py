@@ -0,0 +1,132 @@
+"""
+inter-process locks for notetaking objects: fcntl.flock() on a lock file
+kept alongside the shared memory blocks (in /dev/shm where it exists). the
+kernel arbitrates flock(), so two processes can never both hold the lock,
+and releases it if its holder dies. waits are bounded: acquiring polls with
+a short exponential backoff and raises TimeoutError after `timeout` seconds.
+"""
+from contextlib import contextmanager
+import os
+from pathlib import Path
+import tempfile
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows; Notepads aren't used there
+    fcntl = None
+
+LOCK_DIR = Path("/dev/shm") if Path("/dev/shm").is_dir() else Path(
+    tempfile.gettempdir()
+)
+# backoff between attempts to take a contended lock, in seconds
+MIN_BACKOFF, MAX_BACKOFF = 0.00005, 0.005
+
+
+def lock_path(address: str) -> Path:
+    return LOCK_DIR / f"{address}.lock"
+
+
+class FileLock:
+    """
+    shared / exclusive lock on the file at path. instances are safe to share
+    between threads; each holds its own file descriptor, so separate
+    instances in one process exclude one another like separate processes.
+    """
+
+    def __init__(self, path: Path, timeout: float = 1):
+        if fcntl is None:
+            raise OSError("notetaking locks require fcntl (i.e., POSIX)")
+        self.path, self.timeout = Path(path), timeout
+        self._fd, self._identity = None, None
+        # flock() locks belong to the open file, so threads sharing this
+        # instance's descriptor must also exclude one another
+        self._thread_lock = threading.Lock()
+
+    def create(self):
+        os.close(os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600))
+
+    def exists(self) -> bool:
+        return self.path.exists()
+
+    def touch(self):
+        """
+        record an access. the lock file's modification time is its
+        notepad's last access time (see notetaking.lifecycle).
+        """
+        try:
+            os.utime(self.path)
+        except FileNotFoundError:
+            pass
+
+    def _descriptor(self) -> int:
+        if self._fd is None:
+            # flock() doesn't care whether the file is open for writing
+            self._fd = os.open(self.path, os.O_RDONLY)
+            opened = os.fstat(self._fd)
+            self._identity = (opened.st_dev, opened.st_ino)
+        return self._fd
+
+    def open(self):
+        """open the lock file now, rather than on first acquire()"""
+        self._descriptor()
+
+    def stale(self) -> bool:
+        """
+        whether the file this instance opened has since been unlinked or
+        replaced by another at the same path. a descriptor still locks an
+        unlinked file, so holding the lock guarantees nothing about what's
+        at the path unless this is False.
+        """
+        if self._fd is None:
+            return False
+        try:
+            current = os.stat(self.path)
+        except FileNotFoundError:
+            return True
+        return (current.st_dev, current.st_ino) != self._identity
+
+    def acquire(self, shared: bool = False, timeout: float = None):
+        timeout = self.timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        if not self._thread_lock.acquire(timeout=timeout):
+            raise TimeoutError(f"timed out waiting for lock on {self.path}")
+        operation = (fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        backoff = MIN_BACKOFF
+        try:
+            while True:
+                try:
+                    fcntl.flock(self._descriptor(), operation | fcntl.LOCK_NB)
+                    return
+                except BlockingIOError:
+                    if time.monotonic() + backoff > deadline:
+                        raise TimeoutError(
+                            f"timed out waiting for lock on {self.path}"
+                        )
+                    time.sleep(backoff)
+                    backoff = min(backoff * 2, MAX_BACKOFF)
+        except BaseException:
+            self._thread_lock.release()
+            raise
+
+    def release(self):
+        fcntl.flock(self._descriptor(), fcntl.LOCK_UN)
+        self._thread_lock.release()
+
+    @contextmanager
+    def held(self, shared: bool = False, timeout: float = None):
+        self.acquire(shared, timeout)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def unlink(self):
+        self.close()
+        self.path.unlink(missing_ok=True)
@@ -0,0 +1,167 @@
+"""
+read-through memoization of pure functions across processes. the first
+process to call a memoized function with some arguments computes the value
+and writes it to a Notepad; every other process that makes the same call
+reads it from shared memory instead.
+
+an entry's key is a digest of the function's module and qualified name, its
+arguments (or whatever the key function makes of them), and the function's
+current generation, a random stamp stored in the notepad. invalidate()
+deletes the function's entries and replaces the stamp, so values computed
+from stale data while it ran are written under a key no one reads. entries
+older than `timeout` seconds are recomputed too, which catches changes
+nothing invalidated.
+
+the notepad is a cache: if it's swept away (see notetaking.lifecycle) or
+can't be locked in time, calls just compute their values, and the notepad
+is reopened on the next one.
+"""
+from functools import update_wrapper
+import hashlib
+import logging
+from random import getrandbits
+import time
+from typing import Any, Callable, Optional, Union
+
+from notetaking.notepad import Notepad
+
+logger = logging.getLogger(__name__)
+
+Setting = Union[Any, Callable[[], Any]]
+
+
+def _resolve(setting: Setting) -> Any:
+    # prefix and timeout may be given as functions, e.g. to read settings
+    # at call time rather than import time
+    return setting() if callable(setting) else setting
+
+
+class Memoized:
+    """
+    func, memoized in the notepad at prefix. if prefix is (or returns)
+    None, calls go straight to func.
+    """
+
+    def __init__(
+        self,
+        func: Callable,
+        prefix: Setting,
+        name: Optional[str] = None,
+        key: Optional[Callable] = None,
+        timeout: Setting = None,
+    ):
+        self.func, self.prefix, self.timeout = func, prefix, timeout
+        self.name = func.__name__ if name is None else name
+        self.key = key
+        self.hits, self.misses = 0, 0
+        self._notepad: Optional[Notepad] = None
+        update_wrapper(self, func)
+
+    def notepad(self) -> Optional[Notepad]:
+        prefix = _resolve(self.prefix)
+        if prefix is None:
+            return None
+        if self._notepad is None or self._notepad.prefix != prefix:
+            try:
+                self._notepad = Notepad(prefix)
+            except FileNotFoundError:
+                self._notepad = Notepad.open(prefix, cleanup_on_exit=False)
+        return self._notepad
+
+    def _generation_key(self) -> str:
+        return f"{self.name}:generation"
+
+    def _entry_key(self, notepad: Notepad, args, kwargs) -> str:
+        generation = notepad.get(self._generation_key()) or 0
+        if self.key is not None:
+            material = self.key(*args, **kwargs)
+        else:
+            material = (args, sorted(kwargs.items()))
+        func = self.func
+        description = repr(
+            (func.__module__, func.__qualname__, generation, material)
+        )
+        digest = hashlib.sha1(description.encode()).hexdigest()[:24]
+        return f"{self.name}:{digest}"
+
+    def __call__(self, *args, **kwargs):
+        try:
+            notepad = self.notepad()
+            if notepad is None:
+                return self.func(*args, **kwargs)
+            key = self._entry_key(notepad, args, kwargs)
+            entry = notepad.get(key)
+        except OSError as ex:
+            # swept away, or too busy to lock: skip the cache this time
+            logger.debug(f"can't read memoized {self.name}: {ex}")
+            self._notepad = None
+            return self.func(*args, **kwargs)
+        timeout = _resolve(self.timeout)
+        if entry is not None:
+            written, value = entry
+            if timeout is None or time.time() - written <= timeout:
+                self.hits += 1
+                return value
+        self.misses += 1
+        value = self.func(*args, **kwargs)
+        try:
+            try:
+                notepad[key] = (time.time(), value)
+            except FileNotFoundError:
+                # swept away since we read it; start a new one
+                self._notepad = None
+                self.notepad()[key] = (time.time(), value)
+        except OSError as ex:
+            logger.debug(f"can't write memoized {self.name}: {ex}")
+            self._notepad = None
+        return value
+
+    def invalidate(self):
+        """drop every memoized value of this function, in every process"""
+        try:
+            notepad = self.notepad()
+            if notepad is None:
+                return
+            notepad[self._generation_key()] = getrandbits(64)
+            stale = f"{self.name}:"
+            for key in notepad.index():
+                if key.startswith(stale) and key != self._generation_key():
+                    try:
+                        del notepad[key]
+                    except KeyError:
+                        # another process got there first
+                        pass
+        except OSError as ex:
+            # entries will still expire after the timeout
+            logger.warning(f"couldn't invalidate memoized {self.name}: {ex}")
+            self._notepad = None
+
+    def stats(self) -> dict:
+        """this process's hits and misses"""
+        return {"name": self.name, "hits": self.hits, "misses": self.misses}
+
+    def __repr__(self):
+        return (
+            f"Memoized({self.name}, {self.hits} hits, {self.misses} misses)"
+        )
+
+
+def memoize(
+    prefix: Setting,
+    name: Optional[str] = None,
+    key: Optional[Callable] = None,
+    timeout: Setting = None,
+) -> Callable[[Callable], Memoized]:
+    """
+    decorator: memoize a pure function in the notepad at prefix. name
+    (default the function's name) prefixes its entries' keys. key, if
+    given, is called with the function's arguments and returns what
+    identifies them, e.g. (pk, content_hash) for a model instance, whose
+    repr() doesn't reflect its contents; otherwise the arguments' repr()s
+    do. both prefix and timeout may be callables returning them.
+    """
+
+    def decorator(func: Callable) -> Memoized:
+        return Memoized(func, prefix, name, key, timeout)
+
+    return decorator
@@ -1,13 +1,99 @@
+import mmap
+import os
 from multiprocessing.shared_memory import SharedMemory
 
+try:
+    from _posixshmem import shm_open, shm_unlink
+except ImportError:  # Windows
+    shm_open, shm_unlink = None, None
+
+
+class PosixBlock:
+    """
+    the parts of SharedMemory that notetaking uses, minus resource
+    tracking. before python 3.13, every process that opens a SharedMemory
+    -- not just the one that creates it -- registers it with a resource
+    tracker, which unlinks it when that process exits, even if other
+    processes are still using it. notetaking blocks are meant to outlive
+    the processes that write and read them (Notepads are closed explicitly,
+    or swept away by notetaking.lifecycle), so they're never tracked.
+    """
+
+    def __init__(self, name, create=False, size=0):
+        self.name, self._name = name, f"/{name}"
+        flags = os.O_RDWR
+        if create is True:
+            if size <= 0:
+                raise ValueError("'size' must be a positive number")
+            flags |= os.O_CREAT | os.O_EXCL
+        descriptor = shm_open(self._name, flags, mode=0o600)
+        try:
+            if create is True:
+                os.ftruncate(descriptor, size)
+            self.size = os.fstat(descriptor).st_size
+            self._mmap = mmap.mmap(descriptor, self.size)
+        except OSError:
+            if create is True:
+                shm_unlink(self._name)
+            raise
+        finally:
+            os.close(descriptor)
+        self.buf = memoryview(self._mmap)
+
+    def close(self):
+        if self.buf is not None:
+            self.buf.release()
+            self.buf = None
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+
+    def unlink(self):
+        shm_unlink(self._name)
+
+
+def _block(address, **kwargs):
+    if shm_open is None:
+        return SharedMemory(address, **kwargs)
+    return PosixBlock(address, **kwargs)
+
+
+def attach_block(address):
+    """open an existing block"""
+    return _block(address)
+
+
+# blocks mapped by map_block() on platforms without POSIX shared memory
+_KEPT = []
+
+
+def map_block(address):
+    """
+    read-only mapping of an existing block, independent of any block
+    object: it stays mapped as long as anything (e.g. an array made from
+    it) references it, and no longer.
+    """
+    if shm_open is None:
+        # no way to map it separately; keep it attached for good
+        block = attach_block(address)
+        _KEPT.append(block)
+        return block.buf.toreadonly()
+    descriptor = shm_open(f"/{address}", os.O_RDONLY, mode=0o600)
+    try:
+        return mmap.mmap(
+            descriptor, os.fstat(descriptor).st_size, prot=mmap.PROT_READ
+        )
+    finally:
+        os.close(descriptor)
+
 
 def create_block(address, size, exists_ok = True):
     try:
-        return SharedMemory(address, size=size, create=True)
+        return _block(address, size=size, create=True)
     except FileExistsError:
         if exists_ok is False:
             raise
-        old_block = SharedMemory(address)
+        old_block = attach_block(address)
         old_block.unlink()
         old_block.close()
-        return SharedMemory(address, create=True, size=size)
+        return _block(address, create=True, size=size)
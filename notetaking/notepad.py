@@ -1,11 +1,29 @@
 import atexit
+from contextlib import contextmanager
+from random import randint
 import time
-from multiprocessing.shared_memory import ShareableList, SharedMemory
-from random import randint, randbytes
 from typing import Any
 
-from notetaking.codecs import json_pickle_encoder, json_pickle_decoder
-from notetaking.memutilz import create_block
+import numpy as np
+
+from notetaking.arrays import (
+    array_size, array_view, is_array, shared_array, write_array
+)
+from notetaking.codecs import decode, encoder as make_encoder
+from notetaking.hashindex import GrowableIndex
+from notetaking.locking import FileLock, lock_path
+from notetaking.memutilz import attach_block, create_block
+
+# how often, in seconds, a Paper records accesses to its notepad
+TOUCH_INTERVAL = 1
+
+
+def _check_key(key):
+    # the index's own blocks live at these addresses
+    if key in ("index", "index_lock") or key.startswith("index@"):
+        raise KeyError(
+            "'index', 'index_lock' and 'index@...' are reserved key names"
+        )
 
 
 # TODO: we could have the index stored at some other randomized address, but
@@ -14,31 +32,110 @@ from notetaking.memutilz import create_block
 class Paper:
     """parent class for notes. defines only index methods."""
 
-    def __init__(self, prefix):
+    def __init__(self, prefix, lock_timeout=1):
         super().__init__()
         self.prefix = prefix
         self._index_cache = []
         self._index_length = 0
+        self._hash_index = None
+        self._lock = None
+        self.lock_timeout = lock_timeout
+        self._touched = None
 
     def _address(self, key):
         return f"{self.prefix}_{key}"
 
-    def _index_memory(self):
-        return ShareableList(name=self._address("index"))
+    def _index_table(self):
+        # attached once, rather than reopened on every access; it follows
+        # the index to new blocks as it grows
+        if self._hash_index is None:
+            # open the lock file first: if the notepad is then closed and
+            # recreated, the lock goes stale and _locked() drops both
+            try:
+                self._index_lock().open()
+            except FileNotFoundError:
+                pass
+            self._hash_index = GrowableIndex(self._address("index"))
+        return self._hash_index
+
+    def _index_lock(self):
+        # writers hold it exclusively, readers shared. notepads made before
+        # there was a lock file are read without it.
+        if self._lock is None:
+            self._lock = FileLock(
+                lock_path(self._address("index")), self.lock_timeout
+            )
+        return self._lock
+
+    def _touch(self):
+        # at most once a second, not on every access
+        now = time.monotonic()
+        if self._touched is None or now - self._touched > TOUCH_INTERVAL:
+            self._index_lock().touch()
+            self._touched = now
+
+    def _detach(self):
+        # let go of a closed notepad's lock file and index, so that the
+        # next access attaches to whatever is at their addresses now
+        if self._lock is not None:
+            self._lock.close()
+            self._lock = None
+        if self._hash_index is not None:
+            self._hash_index.close()
+            self._hash_index = None
+
+    def _acquire(self, shared):
+        # a handle opened before the notepad was swept (see
+        # notetaking.lifecycle) still locks the unlinked file, and writing
+        # to its orphaned index would leak the blocks; reattach instead
+        while True:
+            lock = self._index_lock()
+            lock.acquire(shared=shared)
+            if not lock.stale():
+                return lock
+            lock.release()
+            self._detach()
+
+    @contextmanager
+    def _reading(self):
+        try:
+            lock = self._acquire(shared=True)
+        except FileNotFoundError:
+            yield
+            return
+        try:
+            self._touch()
+            yield
+        finally:
+            lock.release()
+
+    @contextmanager
+    def _writing(self):
+        try:
+            lock = self._acquire(shared=False)
+        except FileNotFoundError:
+            raise FileNotFoundError(f"notepad {self.prefix} was closed")
+        try:
+            self._touch()
+            yield
+        finally:
+            lock.release()
+
+    def _capacity(self):
+        with self._reading():
+            return self._index_table().capacity
 
     def index(self, sync=True):
         if sync is True:
-            # TODO: optimize all this stuff with lookahead and lookbehind
-            #  for speed, etc.
-            self._index_cache = []
-            ix = 0
-            for ix, key in enumerate(self._index_memory()):
-                if key == b"":
-                    break
-                self._index_cache.append(key)
-            self._index_length = ix
+            with self._reading():
+                self._index_cache = list(self._index_table())
+            self._index_length = len(self._index_cache)
         return self._index_cache
 
+    def __contains__(self, key):
+        with self._reading():
+            return key in self._index_table()
+
     def __str__(self):
         return f"{self.__class__.__name__} with keys {self.index()}"
 
@@ -52,25 +149,46 @@ class Paper:
 class NoteViewer(Paper):
     """read-only notepad"""
 
-    def __init__(self, prefix, decoder=json_pickle_decoder):
-        super().__init__(prefix)
+    def __init__(self, prefix, decoder=decode, lock_timeout=1):
+        super().__init__(prefix, lock_timeout)
         self.decoder = decoder
 
     def get_raw(self, key):
-        try:
-            block = SharedMemory(self._address(key))
-        except FileNotFoundError:
-            return None
-        stream = block.buf.tobytes()
+        # under the lock, so that a block is never read half-written
+        with self._reading():
+            try:
+                block = attach_block(self._address(key))
+            except FileNotFoundError:
+                return None
+            stream = block.buf.tobytes()
+            block.close()
         return stream
 
     # TODO: should I raise errors instead of returning none for missing keys
     #  when accessed with slice notation? that is more 'standard'
-    def __getitem__(self, key, decoder=json_pickle_decoder):
+    def __getitem__(self, key):
         stream = self.get_raw(key)
         if stream is None:
             return stream
-        return json_pickle_decoder(stream)
+        if is_array(stream):
+            # a copy, like every other value
+            return array_view(stream).copy()
+        return self.decoder(stream)
+
+    def get_array(self, key, copy=False):
+        """
+        array stored with Notepad.set_array(), as a read-only view of its
+        shared memory block (see notetaking.arrays) unless copy is True.
+        returns None for missing keys and raises TypeError for non-arrays.
+        """
+        with self._reading():
+            try:
+                array = shared_array(self._address(key))
+            except FileNotFoundError:
+                return None
+        if copy is True:
+            return array.copy()
+        return array
 
     def get(self, key):
         return self.__getitem__(key)
@@ -106,116 +224,116 @@ class Notepad(NoteViewer):
     def __init__(
         self,
         prefix,
-        encoder=json_pickle_encoder,
-        decoder=json_pickle_decoder,
+        encoder=None,
+        decoder=decode,
+        lock_timeout=1,
+        codec="auto",
+        compression=None,
     ):
-        super().__init__(prefix, decoder)
+        """
+        values are encoded with encoder if given, otherwise with
+        notetaking.codecs.encode() using codec and compression
+        """
+        super().__init__(prefix, decoder, lock_timeout)
         try:
-            self.index()
+            self._index_table()
         except FileNotFoundError:
             raise FileNotFoundError(
                 "the memory space for this Notepad has not been initialized "
                 "(or has been deleted). Try constructing it with "
                 "Notepad.open()."
             )
+        if encoder is None:
+            encoder = make_encoder(codec, compression)
         self.encoder = encoder
-        self._lock_key = randbytes(4)
 
     def __setitem__(self, key: str, value: Any, exists_ok: bool = True):
-        if key in (["index", "index_lock"]):
-            raise KeyError("'index' and 'index_lock' are reserved key names")
+        _check_key(key)
         encoded = self.encoder(value)
         size = len(encoded)
-        try:
-            block = create_block(self._address(key), size, exists_ok)
-        except FileExistsError:
-            raise KeyError(
-                f"{key} already exists in this object's cache. pass "
-                f"exists_ok=True to overwrite it."
-            )
-        block.buf[:] = encoded
-        block.close()
-        if key not in self.index():
-            self._add_index_key(key)
+        with self._writing():
+            try:
+                block = create_block(self._address(key), size, exists_ok)
+            except FileExistsError:
+                raise KeyError(
+                    f"{key} already exists in this object's cache. pass "
+                    f"exists_ok=True to overwrite it."
+                )
+            block.buf[:] = encoded
+            try:
+                self._index_table().add(key)
+            except Exception:
+                # e.g. no memory left to grow the index: don't leave the
+                # block orphaned
+                block.unlink()
+                block.close()
+                raise
+            block.close()
+
+    def set_array(self, key: str, array: np.ndarray, exists_ok: bool = True):
+        """
+        store array so that get_array() can read it without copying. its
+        dtype must not be object.
+        """
+        _check_key(key)
+        array = np.ascontiguousarray(array)
+        with self._writing():
+            try:
+                block = create_block(
+                    self._address(key), array_size(array), exists_ok
+                )
+            except FileExistsError:
+                raise KeyError(
+                    f"{key} already exists in this object's cache. pass "
+                    f"exists_ok=True to overwrite it."
+                )
+            try:
+                write_array(block.buf, array)
+                self._index_table().add(key)
+            except Exception:
+                block.unlink()
+                block.close()
+                raise
+            block.close()
 
     def __delitem__(self, key):
-        if key in (["index", "index_lock"]):
-            raise KeyError("'index' and 'index_lock' are reserved key names")
-        try:
-            block = SharedMemory(self._address(key))
+        _check_key(key)
+        with self._writing():
+            try:
+                block = attach_block(self._address(key))
+            except FileNotFoundError:
+                raise KeyError(f"{key} not apparently assigned")
             block.unlink()
             block.close()
-            self._remove_index_key(key)
-        except FileNotFoundError:
-            raise KeyError(f"{key} not apparently assigned")
+            self._index_table().remove(key)
 
     def set(self, key, value):
         return self.__setitem__(key, value)
 
     def close(self, dump=False):
-        for key in self.index():
+        # reattach, in case this notepad was closed and its index unlinked
+        self._hash_index = None
+        try:
+            keys = self.index()
+        except FileNotFoundError:
+            # already closed, e.g. by notetaking.lifecycle.sweep()
+            atexit.unregister(self.close)
+            return
+        for key in keys:
             if dump is True:
                 self.dump(key)
             del self[key]
-        for block in self._lock_memory(), self._index_memory().shm:
-            block.unlink()
-            block.close()
+        index = self._index_table()
+        index.unlink()
+        index.close()
+        self._hash_index = None
+        self._index_lock().unlink()
         atexit.unregister(self.close)
 
     def clear(self):
         for key in self.index():
             del self[key]
 
-    def _lock_memory(self):
-        return SharedMemory(self._address("index_lock"))
-
-    def _acquire_index_lock(self, timeout=0.1, increment=0.0001):
-        acquired = False
-        time_waiting = 0
-        while acquired is False:
-            lock_memory = self._lock_memory()
-            current_key = lock_memory.buf.tobytes()
-            if current_key == self._lock_key:
-                acquired = True
-            elif current_key == b"\x00\x00\x00\x00":
-                lock_memory.buf[:] = self._lock_key
-            # the extra loop here is for a possibly-unnecessary double check
-            # that someone else didn't write their key to the lock at the
-            # exact same time.
-            else:
-                time_waiting += increment
-                if increment > timeout:
-                    raise TimeoutError("timed out waiting for index lock")
-                time.sleep(increment)
-
-    def _release_index_lock(self, release_only_mine=True):
-        lock_memory = self._lock_memory()
-        current_key = lock_memory.buf.tobytes()
-        if (current_key != self._lock_key) and (release_only_mine is True):
-            raise ConnectionRefusedError
-        lock_memory.buf[:] = b"\x00\x00\x00\x00"
-
-    def _add_index_key(self, key):
-        self._acquire_index_lock()
-        self.index()
-        self._index_memory()[self._index_length] = key
-        self._release_index_lock()
-
-    def _remove_index_key(self, key):
-        self._acquire_index_lock()
-        index = self.index()
-        index_memory = self._index_memory()
-        iterator = enumerate(index)
-        ix, item = None, None
-        while item != key:
-            try:
-                ix, item = next(iterator)
-            except StopIteration:
-                raise KeyError(f"{key} not found in this Notepad's index.")
-        index_memory[ix] = index_memory[len(index) - 1]
-        index_memory[len(index) - 1] = b""
-        self._release_index_lock()
-
     @classmethod
     def open(
         cls,
@@ -226,23 +344,34 @@ class Notepad(NoteViewer):
         cleanup_on_exit=True,
         **init_kwargs,
     ):
+        """
+        create a Notepad in shared memory. its index starts with room for
+        index_length keys of up to max_key_characters bytes, and grows when
+        they run out. if there's already a Notepad at prefix, open it if
+        exists_ok is True (growing it to index_length keys if it's
+        smaller), otherwise raise FileExistsError. cleanup_on_exit only
+        applies to the process that creates the Notepad.
+        """
         if prefix is None:
             prefix = randint(100000, 999999)
-        _index_lock = create_block(
-            f"{prefix}_index_lock", exists_ok=exists_ok, size=4
-        )
-        # TODO: handle exists_ok for ShareableList
-        _index_block = ShareableList(
-            [b"\x00" * max_key_characters for _ in range(index_length)],
-            name=f"{prefix}_index",
-        )
-
+        FileLock(lock_path(f"{prefix}_index")).create()
+        try:
+            GrowableIndex.create(
+                f"{prefix}_index", index_length, max_key_characters
+            ).close()
+            created = True
+        except FileExistsError:
+            if exists_ok is not True:
+                raise
+            created = False
         notepad = Notepad(prefix, **init_kwargs)
-        if cleanup_on_exit is True:
-            # if SharedMemory objects are instantiated in __main__,
-            # multiprocessing.util._exit_function() generally does a good job
-            # of cleaning them up. however, blocks created in child processes
-            # will often not be cleanly and automatically unlinked.
+        if created is False and notepad._capacity() < index_length:
+            with notepad._writing():
+                notepad._index_table().grow(max_keys=index_length)
+        if cleanup_on_exit is True and created is True:
+            # notetaking blocks aren't registered with multiprocessing's
+            # resource tracker (see notetaking.memutilz), so nothing else
+            # will unlink them when this process exits.
             atexit.register(notepad.close)
         return notepad
 
@@ -251,7 +380,7 @@ class Sticky:
     def __init__(
         self,
         address,
-        decoder=json_pickle_decoder,
+        decoder=decode,
     ):
         self._address = address
         self.decoder = decoder
@@ -263,9 +392,11 @@ class Sticky:
         cls,
         obj,
         address=None,
-        encoder=json_pickle_encoder,
-        decoder=json_pickle_decoder,
-        exists_ok=False
+        encoder=None,
+        decoder=decode,
+        exists_ok=False,
+        codec="auto",
+        compression=None,
     ):
         if address is None:
             addr = randint(100000, 999999)
@@ -273,10 +404,13 @@ class Sticky:
                 address = f"{obj.__name__}_{addr}"
             else:
                 address = str(addr)
+        if encoder is None:
+            encoder = make_encoder(codec, compression)
         encoded = encoder(obj)
         size = len(encoded)
         block = create_block(address, size, exists_ok=exists_ok)
         block.buf[:] = encoded
+        block.close()
         return Sticky(address, decoder)
 
     @property
@@ -284,19 +418,17 @@ class Sticky:
         if self.stuck is True:
             return self._value
         try:
-            block = SharedMemory(self._address)
+            block = attach_block(self._address)
         except FileNotFoundError:
             return None
         stream = block.buf.tobytes()
-        if stream is None:
-            decoded = stream
-        else:
-            decoded = self.decoder(stream)
+        block.close()
+        self._value = self.decoder(stream)
         self.stuck = True
-        return decoded
+        return self._value
 
     def close(self):
-        block = SharedMemory(self._address)
+        block = attach_block(self._address)
         block.unlink()
         block.close()
 
@@ -0,0 +1,120 @@
+"""
+multi-process stress test of Notepad: worker processes hammer one notepad
+with concurrent sets, gets and deletes of a shared pool of keys, then the
+index is checked against the value blocks that actually exist. exits with
+status 1 if any worker saw a torn value or an error, or if the index and
+the blocks disagree. the notepad's index starts with room for 16 keys, so
+a pool of more than that also exercises the index growing under load. run
+with:
+
+python -m notetaking.stress [workers] [seconds] [keys]
+"""
+from multiprocessing import get_context
+from random import choice, random
+import sys
+import time
+
+from notetaking.memutilz import attach_block
+from notetaking.notepad import Notepad
+
+INITIAL_INDEX_LENGTH = 16
+
+
+def pool(keys):
+    return [f"key_{ix}" for ix in range(keys)]
+
+
+def work(prefix, worker, seconds, keys, results):
+    notepad = Notepad(prefix)
+    counts, errors = {"set": 0, "get": 0, "del": 0}, []
+    deadline, keys = time.monotonic() + seconds, pool(keys)
+    while time.monotonic() < deadline:
+        key, roll = choice(keys), random()
+        try:
+            if roll < 0.4:
+                # values vary in size, so that blocks are reallocated
+                notepad[key] = {
+                    "key": key,
+                    "worker": worker,
+                    "payload": "x" * int(random() * 4096),
+                }
+                counts["set"] += 1
+            elif roll < 0.8:
+                value = notepad.get(key)
+                if value is not None and value["key"] != key:
+                    errors.append(f"read {value['key']} from {key}")
+                counts["get"] += 1
+            else:
+                try:
+                    del notepad[key]
+                except KeyError:
+                    pass
+                counts["del"] += 1
+        except Exception as ex:
+            errors.append(f"{type(ex).__name__}: {ex}")
+    results.put((counts, errors))
+
+
+def check_index(notepad, keys):
+    problems = []
+    index = set(notepad.index())
+    if len(index) != len(notepad._index_table()):
+        problems.append("index count doesn't match its keys")
+    for key in pool(keys):
+        try:
+            attach_block(notepad._address(key)).close()
+            exists = True
+        except FileNotFoundError:
+            exists = False
+        if exists != (key in index):
+            problems.append(f"{key}: block exists {exists}, indexed "
+                            f"{key in index}")
+    return problems
+
+
+def main(workers=8, seconds=5.0, keys=32):
+    notepad = Notepad.open(
+        f"stress_{int(time.time())}", index_length=INITIAL_INDEX_LENGTH
+    )
+    context = get_context("spawn")
+    results = context.Queue()
+    processes = [
+        context.Process(
+            target=work,
+            args=(notepad.prefix, worker, seconds, keys, results),
+        )
+        for worker in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    totals, errors = {"set": 0, "get": 0, "del": 0}, []
+    for _ in processes:
+        counts, worker_errors = results.get()
+        for op, count in counts.items():
+            totals[op] += count
+        errors += worker_errors
+    for process in processes:
+        process.join()
+    errors += check_index(notepad, keys)
+    capacity = notepad._capacity()
+    notepad.close()
+    ops = sum(totals.values())
+    print(
+        f"{workers} workers, {seconds} s: {ops} ops ({ops / seconds:.0f}/s; "
+        + ", ".join(f"{count} {op}" for op, count in totals.items())
+        + f"), index capacity {capacity}, {len(errors)} errors"
+    )
+    for error in errors[:20]:
+        print(error)
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    sys.exit(
+        main(
+            int(args[0]) if len(args) > 0 else 8,
+            float(args[1]) if len(args) > 1 else 5.0,
+            int(args[2]) if len(args) > 2 else 32,
+        )
+    )
@@ -6,6 +6,7 @@ from functools import partial
 
 from visor.dj_utils import djget, eta, fields
 from visor.models import Sample
+from visor.similarity import similar_spectra
 
 # define partially-evaluated convenience function
 get_contains = partial(
@@ -35,3 +36,18 @@ def make_getter(model):
         querytype='icontains'
     )
     return eta(getter, "value", "field")
+
+
+def similar(sample, metric="angle", k=10, **search_kwargs):
+    """
+    the k library spectra most similar to sample (a Sample, pk, or
+    (wavelength, reflectance) array), as (Sample, score) tuples. keyword
+    arguments are passed to Sample.objects.filter to restrict candidates,
+    e.g. similar(sample, released=True, origin__name="RELAB").
+    """
+    candidates = None
+    if search_kwargs:
+        candidates = Sample.objects.filter(**search_kwargs)
+    matches = similar_spectra(sample, candidates, metric, k)
+    found = Sample.objects.in_bulk([match["id"] for match in matches])
+    return [(found[match["id"]], match["score"]) for match in matches]
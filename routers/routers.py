@@ -9,6 +9,7 @@ def visor_splitter(model):
         visor.models.SampleType,
         visor.models.Database,
         visor.models.Sample,
+        visor.models.SimulatedSpectrum,
     ]:
         return "spectra"
 
@@ -0,0 +1,77 @@
+// decoder for the binary spectra format written by
+// visor.serializers.graph_buffer: a little-endian uint32 header length,
+// a UTF-8 JSON header padded with spaces to a multiple of 4 bytes, and
+// then float32 data -- each spectrum's wavelengths followed by its
+// reflectance.
+
+const SPECTRA_FORMAT_VERSION = 1
+
+const wavelengthKey = function (wavelength) {
+    // match the keys of the JSON reflectance objects the server used to
+    // send (Python float reprs, e.g. "600.0"): float32 values are rounded
+    // to the precision they carry, and whole numbers keep their ".0", so
+    // that they aren't treated as array indices, which would reorder them.
+    const rounded = parseFloat(wavelength.toPrecision(7))
+    return Number.isInteger(rounded) ? rounded.toFixed(1) : String(rounded)
+}
+
+const decodeSpectra = function (buffer) {
+    const view = new DataView(buffer)
+    const headerLength = view.getUint32(0, true)
+    const header = JSON.parse(
+        new TextDecoder().decode(new Uint8Array(buffer, 4, headerLength))
+    )
+    if (header.version !== SPECTRA_FORMAT_VERSION) {
+        throw new Error("unsupported spectra format version " + header.version)
+    }
+    const dataStart = 4 + headerLength
+    const values = new Float32Array(
+        buffer, dataStart, (buffer.byteLength - dataStart) / 4
+    )
+    const reflectance = {}
+    header.spectra.forEach(function (spectrum) {
+        const waves = values.subarray(
+            spectrum.offset, spectrum.offset + spectrum.length
+        )
+        const refs = values.subarray(
+            spectrum.offset + spectrum.length,
+            spectrum.offset + 2 * spectrum.length
+        )
+        const spectrumKV = {}
+        for (let i = 0; i < spectrum.length; i++) {
+            spectrumKV[wavelengthKey(waves[i])] = refs[i]
+        }
+        reflectance[spectrum.id] = spectrumKV
+    })
+    return {samples: header.samples, reflectance: reflectance}
+}
+
+const loadSpectra = function (url, samples, callback) {
+    // fill in reflectance and simulated spectra of the sample objects in
+    // samples, dropping any the server sent no spectrum for, then call
+    // callback
+    const spectraCall = new XMLHttpRequest()
+    spectraCall.open("GET", url)
+    spectraCall.responseType = "arraybuffer"
+    spectraCall.onload = function () {
+        if (spectraCall.status !== 200) {
+            console.error("couldn't load spectra: " + spectraCall.status)
+            return
+        }
+        const decoded = decodeSpectra(spectraCall.response)
+        decoded.samples.forEach(function (data) {
+            const sample = samples.find(item => item["id"] === data["id"])
+            if (sample !== undefined) {
+                Object.assign(sample, data)
+                sample["reflectance"] = decoded.reflectance[data["id"]]
+            }
+        })
+        for (let i = samples.length - 1; i >= 0; i--) {
+            if (samples[i]["reflectance"] === undefined) {
+                samples.splice(i, 1)
+            }
+        }
+        callback()
+    }
+    spectraCall.send()
+}
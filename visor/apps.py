@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class visorConfig(AppConfig):
     name = 'visor'
     default_auto_field = 'django.db.models.AutoField'
+
+    def ready(self):
+        # noinspection PyUnresolvedReferences
+        import visor.signals
@@ -0,0 +1,165 @@
+"""
+process-wide registry of compiled FilterSets. a compiled filterset holds
+the filterset's filter order, wavelength grid, centers and responsivity
+matrix as contiguous numpy arrays, so that the FilterSet's JSON/text fields
+are parsed once per process rather than once per queryset.
+"""
+import logging
+from threading import RLock
+from typing import Optional
+
+from django.db import DatabaseError
+import numpy as np
+import pandas as pd
+
+import visor.models
+from visor.memo import shared_memo
+from visor.spectral import filter_layout, simulate_spectra
+
+logger = logging.getLogger("django")
+
+
+@shared_memo(key=lambda filterset: (filterset.pk, filterset.content_hash))
+def shared_filter_layout(filterset: "visor.models.FilterSet") -> dict:
+    """
+    filter_layout(filterset), computed by the first process to compile
+    this version of the filterset and read from shared memory by the rest
+    """
+    return filter_layout(filterset)
+
+
+class CompiledFilterSet:
+    """parsed, simulation-ready representation of a FilterSet"""
+
+    def __init__(self, filterset: "visor.models.FilterSet"):
+        self.pk = filterset.pk
+        self.short_name = filterset.short_name
+        self.name = filterset.name
+        self.display_order = filterset.display_order
+        self.content_hash = filterset.content_hash
+        self.layout = shared_filter_layout(filterset)
+        # output frame template, with centers exactly as stored, in the
+        # order simulate_spectrum produces
+        self._frame = pd.DataFrame(
+            filterset.filter_centers, columns=["filter", "wavelength"]
+        ).sort_values(["wavelength"]).reset_index(drop=True)
+        for array in self.layout.values():
+            if isinstance(array, np.ndarray):
+                array.flags.writeable = False
+
+    @property
+    def key(self) -> tuple[int, str]:
+        return self.pk, self.content_hash
+
+    @property
+    def names(self) -> list[str]:
+        return self.layout["names"]
+
+    @property
+    def centers(self) -> np.ndarray:
+        return self.layout["centers"]
+
+    @property
+    def wavelengths(self) -> np.ndarray:
+        return self.layout["bins"]
+
+    @property
+    def matrix(self) -> Optional[np.ndarray]:
+        """(filters x bins) responsivity; None for resample-only sets"""
+        return self.layout["responsivity"]
+
+    @property
+    def resample_only(self) -> bool:
+        return self.layout["resample_only"]
+
+    def simulate(self, samples) -> np.ndarray:
+        return simulate_spectra(samples, self.layout)
+
+    @property
+    def frame_wavelengths(self) -> np.ndarray:
+        """
+        filter center wavelengths as floats, in the row order of
+        simulation_frame()
+        """
+        return self._frame["wavelength"].to_numpy(dtype=float)
+
+    def simulation_frame(self, responses: np.ndarray) -> pd.DataFrame:
+        """
+        wrap one row of simulate() output in the DataFrame format returned
+        by simulate_spectrum()
+        """
+        frame = self._frame.copy()
+        frame["response"] = responses
+        return frame
+
+    def __repr__(self):
+        return (
+            f"CompiledFilterSet({self.short_name}, pk={self.pk}, "
+            f"{len(self.names)} filters)"
+        )
+
+
+_REGISTRY: dict[tuple[int, str], CompiledFilterSet] = {}
+_REGISTRY_LOCK = RLock()
+
+
+def compile_filterset(
+    filterset: "visor.models.FilterSet",
+) -> CompiledFilterSet:
+    """get the compiled version of filterset, compiling it if necessary"""
+    with _REGISTRY_LOCK:
+        key = (filterset.pk, filterset.content_hash)
+        if key not in _REGISTRY:
+            invalidate(filterset.pk)
+            _REGISTRY[key] = CompiledFilterSet(filterset)
+        return _REGISTRY[key]
+
+
+def compiled_filtersets(sync: bool = True) -> list[CompiledFilterSet]:
+    """
+    all compiled filtersets, in pk order (the order simulated spectra have
+    always been generated in). if sync is True, check the registry against
+    the filtersets table -- a small pk/hash query, not a fetch of the
+    filter data -- and (re)compile only new or changed filtersets. this
+    catches changes made by other processes, which the invalidation
+    signals can't see.
+    """
+    with _REGISTRY_LOCK:
+        if sync is True:
+            current = set(
+                visor.models.FilterSet.objects.values_list(
+                    "id", "content_hash"
+                )
+            )
+            for key in set(_REGISTRY).difference(current):
+                del _REGISTRY[key]
+            missing = [pk for pk, _ in current.difference(_REGISTRY)]
+            if missing:
+                for filterset in visor.models.FilterSet.objects.filter(
+                    id__in=missing
+                ):
+                    compile_filterset(filterset)
+        return sorted(_REGISTRY.values(), key=lambda c: c.pk)
+
+
+def invalidate(pk: Optional[int] = None) -> None:
+    """drop one filterset (or, if pk is None, all of them) from the registry"""
+    with _REGISTRY_LOCK:
+        for key in tuple(_REGISTRY):
+            if pk is None or key[0] == pk:
+                del _REGISTRY[key]
+
+
+def load_registry() -> list[CompiledFilterSet]:
+    """
+    compile every filterset, e.g. from a server's worker start hook, so
+    that the first request doesn't have to. compiled_filtersets() compiles
+    them on demand anyway, so if the filtersets table can't be read yet
+    (say, before migrating), leave that to it.
+    """
+    invalidate()
+    try:
+        return compiled_filtersets()
+    except DatabaseError as ex:
+        logger.warning(f"couldn't compile filtersets: {ex}")
+        return []
@@ -9,4 +9,8 @@ WAVELENGTH_RANGES = {
     "VIS": [400, 749],
     "NIR": [750, 2500],
     "MIR": [2501, 10000000],
-}
\ No newline at end of file
+}
+
+# FilterSet short names of the instruments whose ROI files we ingest, keyed
+# by marslab INSTRUMENT code
+XCAM_FILTERSETS = {"MCAM": "Mastcam", "ZCAM": "Mastcam-Z"}
@@ -0,0 +1,409 @@
+"""
+memory-mapped "cube" of every Sample's reflectance resampled onto one shared
+wavelength grid, for bulk operations (similarity search, aggregate
+statistics, batch simulation) that would otherwise have to load every
+spectrum through the ORM.
+
+the cube lives in a directory (settings.VISOR_CUBE_PATH, by default
+data/cube, next to spectra.sqlite3):
+
+    header.json             grid, row count, current generation
+    <generation>/values.npy (capacity x bins) float32 reflectance, 0 where
+                            the spectrum has no coverage
+    <generation>/coverage.npy (capacity x bins) bool coverage mask
+    <generation>/ids.npy    (capacity,) int64 Sample pks; 0 marks a free row
+    <generation>/released.npy (capacity,) bool copy of Sample.released
+
+readers open the arrays with np.load(mmap_mode="r"), so every process
+(e.g. every gunicorn worker) shares one copy of the data through the OS
+page cache. single-row updates are written in place; rebuilds and growth
+write a new generation directory and then swap header.json, so readers
+holding the old arrays are never pulled out from under.
+"""
+import json
+import os
+from pathlib import Path
+import shutil
+from threading import RLock
+from typing import Iterable, Iterator, Optional, Sequence, Union
+
+from django.conf import settings
+import numpy as np
+
+import visor.models
+
+try:
+    import fcntl
+except ImportError:  # windows; local single-process use only
+    fcntl = None
+
+FORMAT_VERSION = 1
+# start, stop (inclusive), step, in nm
+DEFAULT_GRID = (300, 2600, 5)
+ARRAYS = ("values", "coverage", "ids", "released")
+
+
+def cube_path() -> Path:
+    return Path(
+        getattr(
+            settings,
+            "VISOR_CUBE_PATH",
+            Path(getattr(settings, "BASE_DIR", "."), "data", "cube"),
+        )
+    )
+
+
+def make_grid(grid: Sequence[float] = None) -> np.ndarray:
+    if grid is None:
+        grid = getattr(settings, "VISOR_CUBE_GRID", DEFAULT_GRID)
+    start, stop, step = grid
+    return np.arange(start, stop + step / 2, step, dtype=np.float64)
+
+
+def resample(
+    array: np.ndarray, grid: np.ndarray
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    resample a (wavelength, reflectance) array onto grid. returns
+    reflectance on the grid (0 outside the spectrum's range) and the boolean
+    coverage mask.
+    """
+    wavelengths, reflectance = array[:, 0], array[:, 1]
+    coverage = (grid >= wavelengths[0]) & (grid <= wavelengths[-1])
+    values = np.interp(grid, wavelengths, reflectance, left=0, right=0)
+    values[~coverage] = 0
+    return values.astype(np.float32), coverage
+
+
+class _Lock:
+    """exclusive advisory lock on the cube directory, held by writers"""
+
+    def __init__(self, path: Path):
+        self.path = path / "cube.lock"
+
+    def __enter__(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.file = open(self.path, "a")
+        if fcntl is not None:
+            fcntl.flock(self.file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        if fcntl is not None:
+            fcntl.flock(self.file, fcntl.LOCK_UN)
+        self.file.close()
+
+
+class SpectralCube:
+    """
+    read-only view of a built cube. arrays are trimmed to the cube's
+    occupied rows; rows whose id is 0 have been deleted and are empty.
+    """
+
+    def __init__(self, path: Optional[Path] = None):
+        self.path = cube_path() if path is None else Path(path)
+        header_path = self.path / "header.json"
+        self.stamp = _stamp(header_path)
+        self.header = json.loads(header_path.read_text())
+        if self.header["format"] != FORMAT_VERSION:
+            raise ValueError(
+                f"cube at {self.path} is format {self.header['format']}; "
+                f"rebuild it"
+            )
+        self.grid = make_grid(self.header["grid"])
+        arrays = self.path / self.header["generation"]
+        rows = self.header["rows"]
+        for name in ARRAYS:
+            array = np.load(arrays / f"{name}.npy", mmap_mode="r")
+            setattr(self, name, array[:rows])
+        self._index = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __repr__(self):
+        return (
+            f"SpectralCube({self.path}, {len(self)} rows, "
+            f"{len(self.grid)} bins)"
+        )
+
+    @property
+    def index(self) -> dict[int, int]:
+        """mapping from Sample pk to row"""
+        if self._index is None:
+            occupied = np.flatnonzero(self.ids)
+            self._index = dict(zip(self.ids[occupied].tolist(), occupied))
+        return self._index
+
+    def rows_for(self, pks: Iterable[int]) -> np.ndarray:
+        """rows of the given pks, in order, skipping any not in the cube"""
+        index = self.index
+        return np.array(
+            [index[pk] for pk in pks if pk in index], dtype=np.int64
+        )
+
+    def spectrum(self, pk: int) -> np.ndarray:
+        """(wavelength, reflectance) array of one Sample's covered bins"""
+        row = self.index[pk]
+        mask = self.coverage[row]
+        return np.column_stack([self.grid[mask], self.values[row][mask]])
+
+    def chunks(
+        self, rows: Optional[np.ndarray] = None, chunk_size: int = 8192
+    ) -> Iterator[tuple[np.ndarray, np.ndarray, np.ndarray]]:
+        """
+        iterate over (rows, values, coverage) in chunks, optionally
+        restricted to an array of rows. deleted rows are skipped.
+        """
+        if rows is None:
+            rows = np.flatnonzero(self.ids)
+        for start in range(0, len(rows), chunk_size):
+            chunk = rows[start:start + chunk_size]
+            if len(chunk) == 1 or np.all(np.diff(chunk) == 1):
+                # contiguous, ascending rows: slice the memmap rather than
+                # copying them out with fancy indexing
+                selection = slice(chunk[0], chunk[-1] + 1)
+            else:
+                selection = chunk
+            yield chunk, self.values[selection], self.coverage[selection]
+
+
+def _stamp(header_path: Path) -> tuple[int, int]:
+    # header.json is always replaced, never rewritten, so its inode changes
+    # on every write even where mtime resolution is coarse
+    stat = header_path.stat()
+    return stat.st_ino, stat.st_mtime_ns
+
+
+_CUBE: Optional[SpectralCube] = None
+_CUBE_LOCK = RLock()
+
+
+def get_cube() -> SpectralCube:
+    """
+    this process's view of the cube, reopened if another process has
+    written to it since it was last opened. raises FileNotFoundError if the
+    cube has not been built (see the build_cube management command).
+    """
+    global _CUBE
+    with _CUBE_LOCK:
+        path = cube_path()
+        stamp = _stamp(path / "header.json")
+        if _CUBE is None or _CUBE.path != path or _CUBE.stamp != stamp:
+            _CUBE = SpectralCube(path)
+        return _CUBE
+
+
+def cube_exists() -> bool:
+    return (cube_path() / "header.json").exists()
+
+
+def _write_header(path: Path, header: dict):
+    header["version"] = header.get("version", 0) + 1
+    temp = path / "header.json.tmp"
+    temp.write_text(json.dumps(header))
+    os.replace(temp, path / "header.json")
+
+
+def _allocate(path: Path, generation: str, capacity: int, bins: int):
+    directory = path / generation
+    directory.mkdir(parents=True, exist_ok=True)
+    shapes = {
+        "values": ((capacity, bins), np.float32),
+        "coverage": ((capacity, bins), np.bool_),
+        "ids": ((capacity,), np.int64),
+        "released": ((capacity,), np.bool_),
+    }
+    return {
+        name: np.lib.format.open_memmap(
+            directory / f"{name}.npy", mode="w+", dtype=dtype, shape=shape
+        )
+        for name, (shape, dtype) in shapes.items()
+    }
+
+
+def _open_for_write(path: Path, header: dict) -> dict[str, np.ndarray]:
+    directory = path / header["generation"]
+    return {
+        name: np.load(directory / f"{name}.npy", mmap_mode="r+")
+        for name in ARRAYS
+    }
+
+
+def _next_generation(header: Optional[dict]) -> str:
+    if header is None:
+        return "g000001"
+    return f"g{int(header['generation'][1:]) + 1:06d}"
+
+
+def _swap_generation(path: Path, header: dict, old: Optional[str]):
+    _write_header(path, header)
+    if old is not None and old != header["generation"]:
+        # processes that still map the old arrays keep them until they
+        # notice the new header; unlinking doesn't invalidate their maps
+        shutil.rmtree(path / old, ignore_errors=True)
+
+
+def _read_header(path: Path) -> Optional[dict]:
+    try:
+        return json.loads((path / "header.json").read_text())
+    except FileNotFoundError:
+        return None
+
+
+def build_cube(
+    grid: Optional[Sequence[float]] = None,
+    chunk_size: int = 1000,
+    path: Optional[Path] = None,
+    log=None,
+) -> SpectralCube:
+    """
+    (re)build the cube from every Sample, in pk order, reading Samples in
+    chunks so that the whole library is never held in memory.
+    """
+    path = cube_path() if path is None else Path(path)
+    if grid is None:
+        grid = getattr(settings, "VISOR_CUBE_GRID", DEFAULT_GRID)
+    grid = [float(g) for g in grid]
+    bins = len(make_grid(grid))
+    queryset = visor.models.Sample.objects.order_by("pk").only(
+        "id", "released", "reflectance_packed", "reflectance"
+    )
+    with _Lock(path):
+        old = _read_header(path)
+        total = queryset.count()
+        header = {
+            "format": FORMAT_VERSION,
+            "grid": grid,
+            "generation": _next_generation(old),
+            "capacity": max(total, 1),
+            "rows": 0,
+            "version": 0 if old is None else old["version"],
+        }
+        arrays = _allocate(
+            path, header["generation"], header["capacity"], bins
+        )
+        row, last_pk = 0, 0
+        while True:
+            chunk = list(queryset.filter(pk__gt=last_pk)[:chunk_size])
+            # samples added since the count was taken
+            if row + len(chunk) > header["capacity"]:
+                chunk = chunk[:header["capacity"] - row]
+            if len(chunk) == 0:
+                break
+            _write_rows(arrays, range(row, row + len(chunk)), chunk, grid)
+            row += len(chunk)
+            last_pk = chunk[-1].pk
+            if log is not None:
+                log(f"resampled {row}/{total} samples")
+        for array in arrays.values():
+            array.flush()
+        header["rows"] = row
+        _swap_generation(
+            path, header, None if old is None else old["generation"]
+        )
+    return SpectralCube(path)
+
+
+def _write_rows(
+    arrays: dict[str, np.ndarray],
+    rows: Iterable[int],
+    samples: Sequence["visor.models.Sample"],
+    grid: Sequence[float],
+):
+    grid = make_grid(grid)
+    for row, sample in zip(rows, samples):
+        values, coverage = resample(sample.data_array, grid)
+        arrays["values"][row] = values
+        arrays["coverage"][row] = coverage
+        arrays["released"][row] = sample.released
+        # written last, so a concurrent reader never indexes a row whose
+        # data isn't there yet
+        arrays["ids"][row] = sample.pk
+
+
+def update_cube(
+    samples: Sequence["visor.models.Sample"], path: Optional[Path] = None
+):
+    """
+    add or overwrite rows for samples. grows the cube into a new generation
+    when it runs out of space. does nothing if the cube hasn't been built.
+    """
+    path = cube_path() if path is None else Path(path)
+    with _Lock(path):
+        if (header := _read_header(path)) is None:
+            return
+        arrays = _open_for_write(path, header)
+        ids = arrays["ids"][:header["rows"]]
+        index = {pk: row for row, pk in enumerate(ids.tolist()) if pk != 0}
+        free = iter(np.flatnonzero(ids == 0).tolist())
+        targets, appended = [], 0
+        for sample in samples:
+            if (row := index.get(sample.pk)) is None:
+                row = next(free, None)
+            if row is None:
+                row = header["rows"] + appended
+                appended += 1
+            targets.append(row)
+        if header["rows"] + appended > header["capacity"]:
+            arrays, header = _grow(
+                path, header, arrays, header["rows"] + appended
+            )
+        _write_rows(arrays, targets, samples, header["grid"])
+        for array in arrays.values():
+            array.flush()
+        header["rows"] += appended
+        _write_header(path, header)
+
+
+def _grow(
+    path: Path, header: dict, arrays: dict[str, np.ndarray], needed: int
+) -> tuple[dict[str, np.ndarray], dict]:
+    old = header["generation"]
+    header = header | {
+        "generation": _next_generation(header),
+        "capacity": max(needed, int(header["capacity"] * 1.5)),
+    }
+    bins = len(make_grid(header["grid"]))
+    grown = _allocate(path, header["generation"], header["capacity"], bins)
+    rows = header["rows"]
+    for name in ARRAYS:
+        grown[name][:rows] = arrays[name][:rows]
+    for array in grown.values():
+        array.flush()
+    _swap_generation(path, header, old)
+    return grown, header
+
+
+def remove_from_cube(pks: Iterable[int], path: Optional[Path] = None):
+    """free the rows of the given pks. does nothing if there is no cube."""
+    path = cube_path() if path is None else Path(path)
+    pks = set(pks)
+    with _Lock(path):
+        if (header := _read_header(path)) is None:
+            return
+        arrays = _open_for_write(path, header)
+        ids = arrays["ids"][:header["rows"]]
+        rows = np.flatnonzero(np.isin(ids, list(pks)))
+        if len(rows) == 0:
+            return
+        # clear the id first, so readers stop indexing the row
+        arrays["ids"][rows] = 0
+        arrays["coverage"][rows] = False
+        arrays["values"][rows] = 0
+        arrays["released"][rows] = False
+        for array in arrays.values():
+            array.flush()
+        _write_header(path, header)
+
+
+def cube_samples(
+    pks: Union[Iterable[int], np.ndarray, None] = None
+) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    convenience accessor: (pks, grid, values, coverage) for the given pks
+    (or every sample), copied out of the cube.
+    """
+    cube = get_cube()
+    rows = np.flatnonzero(cube.ids) if pks is None else cube.rows_for(pks)
+    return cube.ids[rows], cube.grid, cube.values[rows], cube.coverage[rows]
@@ -5,6 +5,8 @@ from typing import Iterable, Callable, Any, Sequence, Union
 
 from django.db import models
 
+from visor.memo import shared_memo
+
 
 # query abstractions
 
@@ -40,12 +42,14 @@ def fields(model: Any) -> list[str]:
 
 
 # utilities for making lists to render in html
+@shared_memo()
 def make_choice_list(
     model: models.Model, field: str, conceal_unreleased=False
 ) -> list[tuple]:
     """
     format data to feed to html selection fields.
-    used by forms.SearchForm
+    used by forms.SearchForm. memoized across processes (see visor/memo.py)
+    and invalidated when a Database or SampleType changes.
     """
     queryset: models.query.QuerySet  # just a type hint, for secret reasons
     if conceal_unreleased and ("released" in fields(model)):
@@ -0,0 +1,174 @@
+"""
+full-text index for the 'search all fields' box. on SQLite, a trigram FTS5
+table in the spectra database holds one document per Sample: the values of
+every field search_all_samples() looks at, joined with a separator no
+search term can contain. a trigram phrase query for a term then matches
+exactly the Samples with the term as a case-insensitive substring of one of
+those fields -- the same Samples the __icontains lookups match, without
+scanning every text column of the Sample table.
+
+trigrams can't match terms shorter than three characters, so those still go
+through __icontains; so does everything on databases without FTS5.
+"""
+from collections import defaultdict
+from typing import Iterable, Iterator, Optional
+
+from django.db import connections, models, router
+from django.db.models.expressions import RawSQL
+
+from visor.models import Sample
+
+TABLE = "visor_sample_fts"
+SEPARATOR = "\x1f"
+# trigram queries can't match anything shorter
+MIN_TERM_LENGTH = 3
+# Sample fields search_all_samples() never looks at, beyond the model's
+# unprintable_fields
+UNSEARCHED_FIELDS = (
+    "origin", "sample_type", "min_wavelength", "max_wavelength", "date_added"
+)
+RELATED_NAME_FIELDS = ("origin", "sample_type")
+
+_AVAILABLE: dict[str, bool] = {}
+
+
+def searched_fields(
+    model: type[models.Model], unprintable_fields: Iterable[str]
+) -> list[str]:
+    """names of model's own fields searched by 'search all fields'"""
+    skip = set(unprintable_fields).union(UNSEARCHED_FIELDS)
+    return [
+        field.name for field in model._meta.fields if field.name not in skip
+    ]
+
+
+def documents(
+    queryset: models.QuerySet, fields: list[str]
+) -> Iterator[tuple[int, str]]:
+    """(pk, document text) for each Sample in queryset"""
+    model = queryset.model
+    rows = queryset.values_list("id", "origin__name", *fields)
+    types = defaultdict(list)
+    through = model.sample_type.through.objects.using(queryset.db)
+    for sample_id, name in through.filter(
+        sample__in=queryset.values("id")
+    ).values_list("sample_id", "sampletype__name"):
+        types[sample_id].append(name)
+    for pk, origin, *values in rows.iterator(chunk_size=2000):
+        yield pk, document(values + [origin] + types[pk])
+
+
+def document(values: Iterable[Optional[str]]) -> str:
+    return SEPARATOR.join(
+        "" if value is None else str(value) for value in values
+    )
+
+
+def _connection(using: Optional[str] = None):
+    if using is None:
+        using = router.db_for_write(Sample)
+    return connections[using]
+
+
+def create_index(connection) -> bool:
+    """create the FTS table, if this database supports it"""
+    if connection.vendor != "sqlite":
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {TABLE} USING "
+            f"fts5(document, tokenize='trigram')"
+        )
+    _AVAILABLE.pop(connection.alias, None)
+    return True
+
+
+def drop_index(connection):
+    if connection.vendor != "sqlite":
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f"DROP TABLE IF EXISTS {TABLE}")
+    _AVAILABLE.pop(connection.alias, None)
+
+
+def index_available(using: Optional[str] = None) -> bool:
+    connection = _connection(using)
+    if connection.alias not in _AVAILABLE:
+        _AVAILABLE[connection.alias] = (
+            connection.vendor == "sqlite"
+            and TABLE in connection.introspection.table_names()
+        )
+    return _AVAILABLE[connection.alias]
+
+
+def write_documents(
+    rows: Iterable[tuple[int, str]], connection=None, batch_size: int = 2000
+) -> int:
+    connection = _connection() if connection is None else connection
+    written, batch = 0, []
+    with connection.cursor() as cursor:
+        for row in rows:
+            batch.append(row)
+            if len(batch) == batch_size:
+                _replace(cursor, batch)
+                written, batch = written + len(batch), []
+        _replace(cursor, batch)
+    return written + len(batch)
+
+
+def _replace(cursor, batch: list[tuple[int, str]]):
+    if len(batch) == 0:
+        return
+    cursor.executemany(
+        f"DELETE FROM {TABLE} WHERE rowid = %s", [(pk,) for pk, _ in batch]
+    )
+    cursor.executemany(
+        f"INSERT INTO {TABLE} (rowid, document) VALUES (%s, %s)", batch
+    )
+
+
+def rebuild_index(using: Optional[str] = None) -> int:
+    """recreate the index from every Sample. returns the number indexed."""
+    connection = _connection(using)
+    if not create_index(connection):
+        return 0
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {TABLE}")
+    fields = searched_fields(Sample, Sample.unprintable_fields)
+    queryset = Sample.objects.using(connection.alias).order_by("id")
+    return write_documents(documents(queryset, fields), connection)
+
+
+def index_samples(pks: Iterable[int]):
+    """(re)index some Samples, e.g. after they or related rows change"""
+    if not index_available():
+        return
+    pks = list(pks)
+    fields = searched_fields(Sample, Sample.unprintable_fields)
+    # Samples that no longer exist are simply dropped
+    unindex_samples(pks)
+    write_documents(documents(Sample.objects.filter(id__in=pks), fields))
+
+
+def unindex_samples(pks: Iterable[int]):
+    if not index_available():
+        return
+    with _connection().cursor() as cursor:
+        cursor.executemany(
+            f"DELETE FROM {TABLE} WHERE rowid = %s", [(pk,) for pk in pks]
+        )
+
+
+def match_expression(terms: Iterable[str]) -> str:
+    """FTS5 query matching documents containing every term"""
+    return " AND ".join(
+        '"' + term.replace('"', '""') + '"' for term in terms
+    )
+
+
+def matching_ids(terms: Iterable[str]) -> RawSQL:
+    """subquery selecting the pks of Samples containing every term"""
+    return RawSQL(
+        f"SELECT rowid FROM {TABLE} WHERE {TABLE} MATCH %s",
+        (match_expression(terms),),
+    )
@@ -0,0 +1,97 @@
+"""
+HTTP caching of sample data responses (graph_data and graph_binary). their
+content is determined by the Samples requested, the filtersets their
+simulated spectra come from, and the request parameters, so a version
+string derived from those -- pks, save times, and Database and SampleType
+names of the Samples, content hashes of the FilterSets -- serves as an
+ETag. it depends only on the requested rows, so changes to other Samples
+don't invalidate it. pages that link to these
+responses add the version to the URL as 'v'; a response to a URL whose
+'v' is current is cacheable for a long time, since any change to its
+content would change the URL. other responses must be revalidated on every
+use, which is cheap with the ETag.
+"""
+from collections import defaultdict
+import datetime as dt
+import hashlib
+from typing import Collection, Optional
+
+from django.db import models
+from django.http import HttpResponse
+from django.utils.cache import patch_cache_control
+
+from visor.models import FilterSet, Sample
+
+# max-age for responses to versioned URLs
+VERSIONED_MAX_AGE = 365 * 24 * 60 * 60
+
+
+def data_state(
+    samples: models.QuerySet,
+    filtersets: Optional[Collection[str]] = None,
+    params: tuple = (),
+) -> tuple[str, Optional[dt.datetime]]:
+    """
+    version of data about samples and their simulations for filtersets
+    (default all), in a response also depending on params, and the latest
+    time one of samples was saved. the version also changes when the names
+    of samples' Databases and SampleTypes, which Sample.date_added doesn't
+    record, do.
+    """
+    rows = list(
+        samples.order_by("id").values_list(
+            "id", "date_added", "origin__name"
+        )
+    )
+    types = defaultdict(list)
+    through = Sample.sample_type.through.objects.using(samples.db)
+    for sample_id, name in through.filter(
+        sample_id__in=[row[0] for row in rows]
+    ).order_by("sample_id", "sampletype__name").values_list(
+        "sample_id", "sampletype__name"
+    ):
+        types[sample_id].append(name)
+    content = hashlib.sha256()
+    for pk, date_added, origin in rows:
+        content.update(
+            f"{pk}:{date_added.isoformat()}:{origin}:{types[pk]};".encode()
+        )
+    hashes = FilterSet.objects.order_by("short_name").values_list(
+        "short_name", "content_hash"
+    )
+    for short_name, content_hash in hashes:
+        if filtersets is None or short_name in filtersets:
+            content.update(f"{short_name}:{content_hash};".encode())
+    content.update(f"{params}".encode())
+    latest = max((row[1] for row in rows), default=None)
+    return content.hexdigest()[:32], latest
+
+
+def data_version(
+    samples: models.QuerySet,
+    filtersets: Optional[Collection[str]] = None,
+    params: tuple = (),
+) -> str:
+    """just the version from data_state()"""
+    return data_state(samples, filtersets, params)[0]
+
+
+def patch_data_cache_control(
+    request, response: HttpResponse, version: str
+) -> HttpResponse:
+    """
+    long-lived caching if request's URL names the current version;
+    revalidation on every use otherwise. responses that might include
+    unreleased samples are never cached by shared caches.
+    """
+    if request.user.is_superuser:
+        scope = {"private": True}
+    else:
+        scope = {"public": True}
+    if request.GET.get("v") == version:
+        patch_cache_control(
+            response, max_age=VERSIONED_MAX_AGE, immutable=True, **scope
+        )
+    else:
+        patch_cache_control(response, no_cache=True, **scope)
+    return response
@@ -0,0 +1,358 @@
+"""
+per-session sample inventories. each session's inventory -- a list of
+Sample pks -- is kept in an inventory store, along with the brief JSON of
+its Samples that every page embeds. that payload is updated incrementally
+when the inventory changes, serializing only the Samples added, and rebuilt
+only when the library changes (see visor.result_cache.version_counter()).
+
+settings.VISOR_INVENTORY_BACKEND picks the store:
+  "notepad": a notetaking.Notepad shared-memory segment per session. fast,
+    but visible only to processes on the same host. idle segments are
+    swept away (see visor/notepads.py).
+  "file": a single local JSON file, for single-user installations on
+    platforms without POSIX shared memory.
+  "session": the Django session, so inventories live wherever
+    settings.SESSION_ENGINE puts sessions (by default, the database) and any
+    node can serve any request.
+  "cookie": the inventory's pks in a signed cookie, with the payload kept in
+    the result cache (see visor.result_cache.result_cache()), keyed by the
+    pks. needs no server-side session state at all.
+by default, "file" on Windows and MacOS and "notepad" elsewhere. each store
+holds a session's state as one record, read once and written once per
+request; settings.VISOR_INVENTORY_MAX_SAMPLES bounds its size.
+"""
+from abc import ABC, abstractmethod
+import hashlib
+import json
+import logging
+from pathlib import Path
+import random
+import sys
+from typing import Optional
+
+from django.conf import settings
+from django.core import signing
+from django.http import HttpResponse
+
+from notetaking.notepad import Notepad
+from visor.models import Sample
+from visor.notepads import ensure_sweeper
+from visor.result_cache import result_cache, version_counter
+from visor.serializers import brief_dicts, dumps
+
+logger = logging.getLogger("django")
+
+LOCAL_INVENTORY_PATH = Path("local_user_inventory.json")
+INVENTORY_COOKIE = "visor_inventory"
+# browsers reliably store cookies of up to about 4 KB, name included
+MAX_COOKIE_BYTES = 4000
+
+
+def ip(request):
+    # forwarded ip from server layer -- this specific property may only
+    # be populated by nginx
+    forwarded_ip = request.META.get('HTTP_X_REAL_IP')
+    if forwarded_ip is not None:
+        return forwarded_ip
+    return request.META.get('REMOTE_ADDR')
+
+
+def session_id(request):
+    address = ip(request)
+    if request.session.get('identifier') is None:
+        request.session[
+            'identifier'
+        ] = f"{address}_{random.randint(1000000, 9999999)}"
+        logger.warning(
+            f"started session with identifier "
+            f"{request.session['identifier']}"
+        )
+    return request.session['identifier']
+
+
+def max_samples() -> int:
+    return getattr(settings, "VISOR_INVENTORY_MAX_SAMPLES", 5000)
+
+
+class InventoryStore(ABC):
+    """
+    where a session's inventory state lives: a dict with the keys
+    "inventory" (its pks), "inventory_json" (their brief JSON) and
+    "inventory_version" (the library version counter the JSON was built
+    at). subclasses read and write the whole dict at once.
+    """
+
+    @abstractmethod
+    def read(self) -> dict:
+        pass
+
+    @abstractmethod
+    def write(self, state: dict):
+        pass
+
+    def commit(self, response: HttpResponse):
+        """attach anything the store keeps client-side to response"""
+        pass
+
+
+class NotepadStore(InventoryStore):
+    """a Notepad shared-memory segment named after the session"""
+
+    key = "inventory_state"
+
+    def __init__(self, request):
+        ensure_sweeper()
+        self.prefix = session_id(request)
+        self.notepad = self._open()
+
+    def _open(self) -> Notepad:
+        try:
+            return Notepad(self.prefix)
+        except FileNotFoundError:
+            return Notepad.open(self.prefix)
+
+    def read(self) -> dict:
+        try:
+            state = self.notepad.get(self.key)
+            if state is not None:
+                return state
+            # older versions kept just the id list, as JSON, in its own block
+            legacy = self.notepad.get("inventory")
+        except FileNotFoundError:
+            # swept away (see visor/notepads.py) since we opened it, and
+            # its state with it
+            self.notepad = self._open()
+            return {}
+        if legacy is None:
+            return {}
+        return {"inventory": json.loads(legacy)}
+
+    def write(self, state: dict):
+        try:
+            self.notepad[self.key] = state
+        except FileNotFoundError:
+            # swept away since we opened it: start a new one
+            self.notepad = self._open()
+            self.notepad[self.key] = state
+
+
+class LocalFileStore(InventoryStore):
+    """
+    stand-in for a Notepad on platforms without POSIX shared memory: a
+    JSON file, for local single-user installations
+    """
+
+    def __init__(self, request=None, path: Path = LOCAL_INVENTORY_PATH):
+        self.path = path
+
+    def read(self) -> dict:
+        if not self.path.exists():
+            return {}
+        content = json.loads(self.path.read_text())
+        # older versions wrote just the inventory id list
+        if isinstance(content, list):
+            return {"inventory": content}
+        if isinstance(content.get("inventory"), str):
+            content["inventory"] = json.loads(content["inventory"])
+        return content
+
+    def write(self, state: dict):
+        self.path.write_text(json.dumps(state))
+
+
+class SessionStore(InventoryStore):
+    """
+    the Django session. SessionMiddleware saves the session once, after the
+    response is built, however many times the state changes.
+    """
+
+    key = "visor_inventory"
+
+    def __init__(self, request):
+        self.session = request.session
+
+    def read(self) -> dict:
+        return self.session.get(self.key, {})
+
+    def write(self, state: dict):
+        self.session[self.key] = state
+
+
+class CookieStore(InventoryStore):
+    """
+    the inventory's pks in a signed, compressed cookie. the rest of the
+    state is derived from them, so it goes in the result cache, keyed by
+    their hash, and is simply rebuilt if it's been evicted.
+    """
+
+    salt = "visor.inventory"
+
+    def __init__(self, request):
+        self.cookie = request.COOKIES.get(INVENTORY_COOKIE)
+        self.pending = None
+
+    @staticmethod
+    def _cache_key(pks: list[int]) -> str:
+        digest = hashlib.sha256(json.dumps(pks).encode()).hexdigest()
+        return f"visor-inventory-{digest[:32]}"
+
+    def read(self) -> dict:
+        if self.cookie is None:
+            return {}
+        try:
+            pks = signing.loads(self.cookie, salt=self.salt)
+        except signing.BadSignature:
+            logger.warning("discarding inventory cookie with bad signature")
+            return {}
+        derived = result_cache().get(self._cache_key(pks), {})
+        return derived | {"inventory": pks}
+
+    def write(self, state: dict):
+        pks = state["inventory"]
+        cookie = signing.dumps(pks, salt=self.salt, compress=True)
+        if len(INVENTORY_COOKIE) + len(cookie) > MAX_COOKIE_BYTES:
+            raise ValueError(
+                "inventory is too large to store in a cookie; use a "
+                "server-side VISOR_INVENTORY_BACKEND"
+            )
+        if cookie != self.cookie:
+            self.cookie, self.pending = cookie, cookie
+        derived = {k: v for k, v in state.items() if k != "inventory"}
+        result_cache().set(self._cache_key(pks), derived)
+
+    def commit(self, response: HttpResponse):
+        if self.pending is None:
+            return
+        response.set_cookie(
+            INVENTORY_COOKIE,
+            self.pending,
+            max_age=settings.SESSION_COOKIE_AGE,
+            secure=settings.SESSION_COOKIE_SECURE,
+            httponly=True,
+            samesite="Lax",
+        )
+        self.pending = None
+
+
+BACKENDS = {
+    "notepad": NotepadStore,
+    "file": LocalFileStore,
+    "session": SessionStore,
+    "cookie": CookieStore,
+}
+
+
+def backend_name() -> str:
+    name = getattr(settings, "VISOR_INVENTORY_BACKEND", None)
+    if name is None:
+        # TODO: this is a hack and I don't like it. come up with a
+        #  better solution, maybe.
+        if sys.platform in ('win32', 'cygwin', 'darwin'):
+            return "file"
+        return "notepad"
+    if name not in BACKENDS:
+        raise ValueError(
+            f"unknown VISOR_INVENTORY_BACKEND {name}; options are "
+            f"{', '.join(BACKENDS)}"
+        )
+    return name
+
+
+def _store(request) -> InventoryStore:
+    # one per request, so that the cookie store's pending cookie survives
+    # until commit_inventory()
+    if not hasattr(request, "_visor_inventory_store"):
+        request._visor_inventory_store = BACKENDS[backend_name()](request)
+    return request._visor_inventory_store
+
+
+def parse_ids(inventory_ids: Optional[str]) -> list[int]:
+    """
+    the pks in a JSON list sent by the browser. raises ValueError if it
+    isn't one.
+    """
+    if inventory_ids is None:
+        return []
+    try:
+        ids = json.loads(inventory_ids)
+    except json.JSONDecodeError:
+        raise ValueError("inventory must be a JSON list of ids")
+    if not isinstance(ids, list):
+        raise ValueError("inventory must be a JSON list of ids")
+    return [int(pk) for pk in ids]
+
+
+def inventory_ids(request) -> list[int]:
+    return _store(request).read().get("inventory", [])
+
+
+def _briefs(pks) -> list[dict]:
+    # in Sample's default ordering, as when the inventory was serialized
+    # straight from a queryset
+    return brief_dicts(Sample.objects.filter(id__in=pks))
+
+
+def _default_order(brief: dict) -> str:
+    # Sample.Meta.ordering
+    return brief.get("sample_id", "")
+
+
+def _state(pks: list[int], briefs: list[dict], version: int) -> dict:
+    return {
+        "inventory": pks,
+        "inventory_json": dumps(briefs),
+        "inventory_version": version,
+    }
+
+
+def set_inventory(request, pks: list[int]):
+    """
+    replace a session's inventory, serializing only newly added Samples if
+    the stored payload is still current. raises ValueError if pks is longer
+    than settings.VISOR_INVENTORY_MAX_SAMPLES.
+    """
+    if len(pks) > max_samples():
+        raise ValueError(f"inventory is limited to {max_samples()} samples")
+    store = _store(request)
+    state = store.read()
+    version = version_counter()
+    if (
+        state.get("inventory_json") is None
+        or state.get("inventory_version") != version
+    ):
+        store.write(_state(pks, _briefs(pks), version))
+        return
+    if state.get("inventory") == pks:
+        return
+    wanted = set(pks)
+    kept = [
+        brief for brief in json.loads(state["inventory_json"])
+        if brief["id"] in wanted
+    ]
+    added = wanted.difference(brief["id"] for brief in kept)
+    if added:
+        kept = sorted(kept + _briefs(added), key=_default_order)
+    store.write(_state(pks, kept, version))
+
+
+def inventory_json(request) -> str:
+    """brief JSON of a session's inventory, as embedded in pages"""
+    store = _store(request)
+    state = store.read()
+    version = version_counter()
+    payload = state.get("inventory_json")
+    if payload is not None and state.get("inventory_version") == version:
+        return payload
+    pks = state.get("inventory", [])
+    state = _state(pks, _briefs(pks), version)
+    store.write(state)
+    return state["inventory_json"]
+
+
+def commit_inventory(request, response: HttpResponse) -> HttpResponse:
+    """
+    add anything the inventory store keeps client-side (i.e., the cookie
+    store's cookie) to response
+    """
+    _store(request).commit(response)
+    return response
@@ -179,6 +179,8 @@ def write_samples_into_buffer(
     export_sim, buffer, selections, simulated_instrument
 ):
     samples = Sample.objects.filter(id__in=selections)
+    if export_sim:
+        samples = samples.prefetch_related("simulations")
     # write each sample line-by-line into text buffer,
     # also splitting reflectance dictionary into lines
     for sample in samples:
@@ -314,10 +316,11 @@ def write_simulated_spectra_to_zipfile(
     writes simulated spectra into an in-memory ZipFile object as multiple
     distinct marslab-format CSV files
     """
-    sims = sample.sim_csv_blocks()
     if simulated_instrument == "all":
+        sims = sample.sim_csv_blocks()
         simulated_instruments = sims.keys()
     else:
+        sims = sample.sim_csv_blocks([simulated_instrument])
         simulated_instruments = [simulated_instrument]
     metadict = {
         k.upper().replace(" ", "_"): v
@@ -3,6 +3,7 @@ functions to ingest observational data -- right now just including
 XCAM ROI files
 """
 from itertools import chain
+from typing import IO, Optional, Union
 
 from marslab.compat.xcam import DERIVED_CAM_DICT, polish_xcam_spectrum
 import numpy as np
@@ -31,19 +32,24 @@ def make_cam_db_entry(instrument: str):
     return database
 
 
-def make_xcam_reflectance_array(instrument: str, spectrum: dict) -> np.ndarray:
+def xcam_scale_pair(
+    instrument: str, spectrum: dict
+) -> Optional[tuple[str, str]]:
+    """the filter pair we scale the eyes of an XCAM spectrum to"""
     # scale to the first present pair we find
-    scale_to = None
     for pair in DERIVED_CAM_DICT[instrument][
         "virtual_filter_mapping"
     ].values():
         if all(filt in spectrum.keys() for filt in pair):
-            scale_to = pair
-            break
+            return pair
+    return None
+
+
+def make_xcam_reflectance_array(instrument: str, spectrum: dict) -> np.ndarray:
     polished_spectrum = polish_xcam_spectrum(
         spectrum,
         DERIVED_CAM_DICT[instrument],
-        scale_to=scale_to,
+        scale_to=xcam_scale_pair(instrument, spectrum),
         average_filters=True,
     )
     return np.vstack(
@@ -88,15 +94,15 @@ def roi_to_sample(
     return spectrum_entry
 
 
-def ingest_xcam_roi_file(filename: str) -> None:
+def read_xcam_roi_file(
+    roi_file: Union[str, IO]
+) -> tuple[str, list[tuple[dict, dict]]]:
     """
-    ingest all spectra from a marslab file into VISOR.
+    read a marslab file into its instrument code and a list of (metadata,
+    spectrum) dicts, one per ROI.
     """
-    if not filename.startswith("marslab_"):
-        raise ValueError("This function only takes marslab files.")
-    spectra = pd.read_csv(filename)
+    spectra = pd.read_csv(roi_file)
     instrument = spectra["INSTRUMENT"].iloc[0]
-    database = make_cam_db_entry(instrument)
     data_columns = [
         col for col in spectra.columns
         if col in DERIVED_CAM_DICT[instrument]['filters']
@@ -108,7 +114,21 @@ def ingest_xcam_roi_file(filename: str) -> None:
             map(lambda s: f"{s}_ERR", DERIVED_CAM_DICT[instrument]['filters'])
         ])
     ]
+    rois = []
     for _, line in spectra.iterrows():
         metadata = line[metadata_columns].dropna().to_dict()
         spectrum = line[data_columns].dropna().to_dict()
+        rois.append((metadata, spectrum))
+    return instrument, rois
+
+
+def ingest_xcam_roi_file(filename: str) -> None:
+    """
+    ingest all spectra from a marslab file into VISOR.
+    """
+    if not filename.startswith("marslab_"):
+        raise ValueError("This function only takes marslab files.")
+    instrument, rois = read_xcam_roi_file(filename)
+    database = make_cam_db_entry(instrument)
+    for metadata, spectrum in rois:
         roi_to_sample(instrument, database, metadata, spectrum, filename)
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from visor.cube import build_cube, cube_path
+
+
+class Command(BaseCommand):
+    help = (
+        "(re)build the memory-mapped spectral cube: every Sample's "
+        "reflectance resampled onto one shared wavelength grid. once built, "
+        "the cube is kept up to date as Samples are saved and deleted."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=1000)
+        parser.add_argument(
+            "--grid",
+            type=float,
+            nargs=3,
+            metavar=("START", "STOP", "STEP"),
+            default=None,
+            help="wavelength grid in nm (default: settings.VISOR_CUBE_GRID)",
+        )
+
+    def handle(self, *args, chunk_size=1000, grid=None, **_):
+        cube = build_cube(grid, chunk_size, log=self.stdout.write)
+        self.stdout.write(f"wrote {cube} to {cube_path()}")
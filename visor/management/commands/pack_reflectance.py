@@ -0,0 +1,59 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import router, transaction
+import numpy as np
+
+from visor.models import Sample
+from visor.packing import pack_reflectance
+
+
+class Command(BaseCommand):
+    help = (
+        "convert legacy Sample.reflectance text into packed binary arrays. "
+        "works in small pk-ordered chunks, each in its own transaction, so "
+        "it can run against a live site and be safely interrupted/rerun."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=500)
+        parser.add_argument(
+            "--pause",
+            type=float,
+            default=0,
+            help="seconds to sleep between chunks to yield to the site",
+        )
+        parser.add_argument(
+            "--repack",
+            action="store_true",
+            help="also repack rows that already have packed reflectance "
+            "(e.g. after changing VISOR_REFLECTANCE_DTYPE)",
+        )
+
+    def handle(self, *args, chunk_size=500, pause=0, repack=False, **_):
+        queryset = Sample.objects.only("id", "reflectance")
+        if repack is False:
+            queryset = queryset.filter(reflectance_packed__isnull=True)
+        database = router.db_for_write(Sample)
+        last_pk, converted = 0, 0
+        while True:
+            chunk = list(
+                queryset.filter(pk__gt=last_pk).order_by("pk")[:chunk_size]
+            )
+            if len(chunk) == 0:
+                break
+            for sample in chunk:
+                sample.reflectance_packed = pack_reflectance(
+                    np.array(json.loads(sample.reflectance))
+                )
+            # bulk_update does not call save(), so this leaves date_added
+            # and the simulated spectra alone
+            with transaction.atomic(using=database):
+                Sample.objects.bulk_update(chunk, ["reflectance_packed"])
+            last_pk = chunk[-1].pk
+            converted += len(chunk)
+            self.stdout.write(f"packed {converted} (through pk {last_pk})")
+            if pause > 0:
+                time.sleep(pause)
+        self.stdout.write(f"done; packed reflectance for {converted} samples")
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from visor.fulltext import rebuild_index
+
+
+class Command(BaseCommand):
+    help = (
+        "rebuild the full-text index used by the 'search all fields' box "
+        "from scratch. the index is kept up to date as Samples change, so "
+        "this is only needed if it has been damaged or bypassed (e.g. by "
+        "raw SQL or QuerySet.update() on Sample text fields)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--database",
+            default=None,
+            help="database alias (default: the one Samples live in)",
+        )
+
+    def handle(self, *args, database=None, **_):
+        indexed = rebuild_index(database)
+        if indexed == 0:
+            self.stdout.write(
+                "no samples indexed (this database may not support FTS5)"
+            )
+        else:
+            self.stdout.write(f"indexed {indexed} samples")
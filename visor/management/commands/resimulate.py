@@ -0,0 +1,158 @@
+from collections import deque
+import json
+from multiprocessing import Pool
+import os
+from pathlib import Path
+import time
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import router, transaction
+
+from visor.compiled import compiled_filtersets
+from visor.models import Sample, SimulatedSpectrum
+from visor.packing import reflectance_array
+
+# filtersets being simulated in a worker process; set by _init_worker
+_WORKER_FILTERSETS = ()
+
+
+def _init_worker(filtersets):
+    global _WORKER_FILTERSETS
+    # needed under the 'spawn' start method; harmless after a fork
+    django.setup()
+    _WORKER_FILTERSETS = filtersets
+
+
+def _simulate_chunk(rows):
+    """
+    worker function. rows are (pk, packed reflectance, reflectance text)
+    tuples; returns pks and, for each filterset, a (pks x filters) array of
+    responses.
+    """
+    arrays = [reflectance_array(packed, text) for _, packed, text in rows]
+    responses = {
+        compiled.short_name: compiled.simulate(arrays)
+        for compiled in _WORKER_FILTERSETS
+    }
+    return [pk for pk, _, _ in rows], responses
+
+
+class Command(BaseCommand):
+    help = (
+        "recompute simulated spectra of every Sample for some or all "
+        "FilterSets, in parallel, without re-running Sample.save(). "
+        "progress is checkpointed, so an interrupted run picks up where it "
+        "left off when rerun with the same filtersets."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "filtersets",
+            nargs="*",
+            help="short names of filtersets to resimulate (default: all)",
+        )
+        parser.add_argument(
+            "--processes", type=int, default=os.cpu_count() or 1
+        )
+        parser.add_argument("--chunk-size", type=int, default=500)
+        parser.add_argument(
+            "--checkpoint",
+            default=None,
+            help="path of checkpoint file (default: "
+            "data/resimulate_checkpoint.json)",
+        )
+        parser.add_argument(
+            "--restart",
+            action="store_true",
+            help="ignore any existing checkpoint",
+        )
+
+    def handle(
+        self,
+        *args,
+        filtersets=(),
+        processes=1,
+        chunk_size=500,
+        checkpoint=None,
+        restart=False,
+        **_,
+    ):
+        selected = compiled_filtersets()
+        if filtersets:
+            unknown = set(filtersets).difference(c.short_name for c in selected)
+            if unknown:
+                raise CommandError(f"unknown filtersets: {sorted(unknown)}")
+            selected = [c for c in selected if c.short_name in filtersets]
+        if checkpoint is None:
+            checkpoint = Path(
+                getattr(settings, "BASE_DIR", "."),
+                "data",
+                "resimulate_checkpoint.json",
+            )
+        checkpoint = Path(checkpoint)
+        hashes = {c.short_name: c.content_hash for c in selected}
+        last_pk = 0
+        if checkpoint.exists() and restart is False:
+            state = json.loads(checkpoint.read_text())
+            if state["filtersets"] == hashes:
+                last_pk = state["last_pk"]
+                self.stdout.write(f"resuming after pk {last_pk}")
+            else:
+                self.stdout.write(
+                    "filtersets changed since checkpoint was written; "
+                    "starting over"
+                )
+        total = Sample.objects.filter(pk__gt=last_pk).count()
+        self.stdout.write(
+            f"resimulating {total} samples for "
+            f"{', '.join(hashes)} with {processes} processes"
+        )
+        rows = Sample.objects.filter(pk__gt=last_pk).order_by("pk")
+        rows = rows.values_list("id", "reflectance_packed", "reflectance")
+        database = router.db_for_write(Sample)
+        pool = Pool(processes, _init_worker, (selected,))
+        # keep a bounded number of chunks in flight, and write results back
+        # strictly in pk order so that the checkpoint is always safe
+        in_flight, done, start = deque(), 0, time.time()
+        cursor = last_pk
+        try:
+            while True:
+                while len(in_flight) < processes * 2:
+                    chunk = list(rows.filter(pk__gt=cursor)[:chunk_size])
+                    if len(chunk) == 0:
+                        break
+                    cursor = chunk[-1][0]
+                    in_flight.append(
+                        pool.apply_async(_simulate_chunk, (chunk,))
+                    )
+                if len(in_flight) == 0:
+                    break
+                pks, responses = in_flight.popleft().get()
+                self._write_chunk(pks, responses, selected, database)
+                checkpoint.parent.mkdir(parents=True, exist_ok=True)
+                checkpoint.write_text(
+                    json.dumps({"filtersets": hashes, "last_pk": pks[-1]})
+                )
+                done += len(pks)
+                rate = done / (time.time() - start)
+                self.stdout.write(
+                    f"{done}/{total} samples ({rate:.1f} samples/s)"
+                )
+        finally:
+            pool.terminate()
+        checkpoint.unlink(missing_ok=True)
+        self.stdout.write(f"done; resimulated {done} samples")
+
+    @staticmethod
+    def _write_chunk(pks, responses, filtersets, database):
+        simulations = [
+            SimulatedSpectrum.from_responses(compiled, row, sample_id=pk)
+            for compiled in filtersets
+            for pk, row in zip(pks, responses[compiled.short_name])
+        ]
+        # this never calls Sample.save(), so it leaves date_added and the
+        # cleaning/duplicate checks alone
+        with transaction.atomic(using=database):
+            SimulatedSpectrum.upsert(simulations, batch_size=250)
@@ -0,0 +1,48 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from notetaking.lifecycle import sweep, usage
+from visor.notepads import kept, max_bytes, ttl
+
+
+class Command(BaseCommand):
+    help = (
+        "remove shared-memory notepads (which hold per-session "
+        "inventories) idle for longer than settings.VISOR_NOTEPAD_TTL, "
+        "then the least recently used until the rest fit "
+        "settings.VISOR_NOTEPAD_MAX_BYTES, and print notepad usage as JSON."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--ttl", type=float, default=None, help="seconds (default: setting)"
+        )
+        parser.add_argument(
+            "--max-bytes", type=int, default=None, help="(default: setting)"
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="list notepads that would be removed, but keep them",
+        )
+        parser.add_argument(
+            "--usage-only", action="store_true", help="just print usage"
+        )
+
+    def handle(self, *args, **options):
+        if options["usage_only"] is False:
+            removed = sweep(
+                max_bytes() if options["max_bytes"] is None
+                else options["max_bytes"],
+                ttl() if options["ttl"] is None else options["ttl"],
+                dry_run=options["dry_run"],
+                keep=kept(),
+            )
+            verb = "would remove" if options["dry_run"] else "removed"
+            for segment in removed:
+                self.stdout.write(
+                    f"{verb} {segment.prefix} ({segment.keys} keys, "
+                    f"{segment.bytes} bytes)"
+                )
+        self.stdout.write(json.dumps(usage()))
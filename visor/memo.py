@@ -0,0 +1,46 @@
+"""
+values every serving process would otherwise compute for itself -- search
+form choice lists, filterset layouts -- memoized once per host in the
+notetaking.Notepad named by settings.VISOR_MEMO_NOTEPAD (see
+notetaking/memo.py). entries expire after settings.VISOR_MEMO_TIMEOUT
+seconds; receivers in visor/signals.py invalidate them sooner when the
+models they're computed from change.
+"""
+from typing import Callable, Optional
+
+from django.conf import settings
+
+from notetaking.memo import Memoized, memoize
+
+MEMOIZED: list[Memoized] = []
+
+
+def notepad_prefix() -> Optional[str]:
+    return getattr(settings, "VISOR_MEMO_NOTEPAD", "visor_memo")
+
+
+def timeout() -> Optional[float]:
+    return getattr(settings, "VISOR_MEMO_TIMEOUT", 300)
+
+
+def shared_memo(
+    name: Optional[str] = None, key: Optional[Callable] = None
+) -> Callable[[Callable], Memoized]:
+    """decorator: memoize a pure function in the VISOR memo notepad"""
+
+    def decorator(func: Callable) -> Memoized:
+        memoized = memoize(notepad_prefix, name, key, timeout)(func)
+        MEMOIZED.append(memoized)
+        return memoized
+
+    return decorator
+
+
+def stats() -> list[dict]:
+    """this process's hits and misses for each memoized function"""
+    return [memoized.stats() for memoized in MEMOIZED]
+
+
+def invalidate_all():
+    for memoized in MEMOIZED:
+        memoized.invalidate()
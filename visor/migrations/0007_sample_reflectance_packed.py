@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 18:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('visor', '0006_alter_sample_material_class'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='sample',
+            name='reflectance_packed',
+            field=models.BinaryField(blank=True, null=True, verbose_name='Packed Reflectance'),
+        ),
+    ]
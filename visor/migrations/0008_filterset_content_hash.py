@@ -0,0 +1,43 @@
+# Generated by Django 5.2.18 on 2026-10-17 18:07
+
+import hashlib
+import json
+
+from django.db import migrations, models
+
+
+# visor.spectral.filterset_hash as of this migration
+def filterset_hash(filters, wavelengths, filter_wavelengths, resample_only):
+    content = json.dumps(
+        [filters, wavelengths, filter_wavelengths, bool(resample_only)]
+    )
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+def hash_filtersets(apps, schema_editor):
+    FilterSet = apps.get_model('visor', 'FilterSet')
+    database = schema_editor.connection.alias
+    for filterset in FilterSet.objects.using(database).all():
+        filterset.content_hash = filterset_hash(
+            filterset.filters,
+            filterset.wavelengths,
+            filterset.filter_wavelengths,
+            filterset.resample_only,
+        )
+        filterset.save(update_fields=['content_hash'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('visor', '0007_sample_reflectance_packed'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='filterset',
+            name='content_hash',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=64),
+        ),
+        migrations.RunPython(hash_filtersets, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,128 @@
+# Generated by Django 5.2.18 on 2026-10-17 18:10
+
+import hashlib
+import json
+import struct
+
+import django.db.models.deletion
+from django.db import connections, migrations, models
+import numpy as np
+
+
+# visor.spectral.filterset_hash as of this migration
+def filterset_hash(filters, wavelengths, filter_wavelengths, resample_only):
+    content = json.dumps(
+        [filters, wavelengths, filter_wavelengths, bool(resample_only)]
+    )
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+# visor.packing's format as of this migration: magic, dtype character,
+# compression flag, 2 pad bytes, rows, columns, then the array's buffer
+PACK_HEADER = struct.Struct("<4scB2xII")
+
+
+# visor.packing.pack_array as of this migration, for uncompressed float64
+def pack_array(array):
+    array = np.ascontiguousarray(array, dtype=np.dtype('<f8'))
+    if array.ndim == 1:
+        array = array.reshape(-1, 1)
+    header = PACK_HEADER.pack(b'VSPK', b'd', 0, *array.shape)
+    return header + array.tobytes()
+
+
+def filterset_hashes(FilterSet, database):
+    """
+    content hashes of FilterSets by short name. FilterSets are usually
+    routed to a database of their own, which may not have been migrated
+    yet, so look in every database with a FilterSet table, this one first,
+    and hash the fields that have existed since 0001.
+    """
+    hashes = {}
+    aliases = [database] + [
+        alias for alias in connections if alias != database
+    ]
+    for alias in aliases:
+        connection = connections[alias]
+        table = FilterSet._meta.db_table
+        if table not in connection.introspection.table_names():
+            continue
+        rows = FilterSet.objects.using(alias).values_list(
+            'short_name',
+            'filters',
+            'wavelengths',
+            'filter_wavelengths',
+            'resample_only',
+        )
+        for short_name, *fields in rows:
+            hashes.setdefault(short_name, filterset_hash(*fields))
+    return hashes
+
+
+def move_simulated_spectra(apps, schema_editor):
+    """
+    copy each Sample's JSON dict of simulated spectra into SimulatedSpectrum
+    rows. the stored frames are already sorted by filter wavelength, which
+    is the order SimulatedSpectrum responses are in. each row records the
+    content hash of the FilterSet it simulates, as FilterSet.save() would,
+    since the stored simulations are what the site has been serving for
+    those filtersets.
+    """
+    Sample = apps.get_model('visor', 'Sample')
+    FilterSet = apps.get_model('visor', 'FilterSet')
+    SimulatedSpectrum = apps.get_model('visor', 'SimulatedSpectrum')
+    database = schema_editor.connection.alias
+    hashes = filterset_hashes(FilterSet, database)
+    samples = Sample.objects.using(database).only('id', 'simulated_spectra')
+    simulations = []
+    for sample in samples.iterator(chunk_size=500):
+        for filterset, frame in json.loads(sample.simulated_spectra).items():
+            try:
+                responses = json.loads(frame)['response']
+            except (ValueError, KeyError, TypeError):
+                print(
+                    f"skipping malformed {filterset} simulation for sample "
+                    f"{sample.id}; rerun the resimulate command to replace it"
+                )
+                continue
+            responses = [responses[ix] for ix in sorted(responses, key=int)]
+            simulations.append(
+                SimulatedSpectrum(
+                    sample_id=sample.id,
+                    filterset=filterset,
+                    filterset_hash=hashes.get(filterset, ''),
+                    responses=pack_array(np.array(responses, dtype=float)),
+                )
+            )
+        if len(simulations) >= 5000:
+            SimulatedSpectrum.objects.using(database).bulk_create(simulations)
+            simulations = []
+    SimulatedSpectrum.objects.using(database).bulk_create(simulations)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('visor', '0008_filterset_content_hash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SimulatedSpectrum',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('filterset', models.CharField(db_index=True, max_length=45, verbose_name='FilterSet Short Name')),
+                ('filterset_hash', models.CharField(blank=True, max_length=64)),
+                ('responses', models.BinaryField(verbose_name='Responses')),
+                ('sample', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='simulations', to='visor.sample')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('sample', 'filterset'), name='unique_sample_filterset_simulation')],
+            },
+        ),
+        migrations.RunPython(move_simulated_spectra, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='sample',
+            name='simulated_spectra',
+        ),
+    ]
@@ -0,0 +1,93 @@
+# Generated by Django 5.2.18 on 2026-10-17 19:02
+
+from collections import defaultdict
+
+from django.db import migrations
+
+# the index as visor.fulltext defined it at this migration, frozen here so
+# that later changes to that module don't change what this migration does
+TABLE = 'visor_sample_fts'
+SEPARATOR = '\x1f'
+# Sample.unprintable_fields as of this migration
+UNPRINTABLE_FIELDS = (
+    'image',
+    'id',
+    'reflectance',
+    'reflectance_packed',
+    'filename',
+    'import_notes',
+    'flagged',
+    'released',
+)
+UNSEARCHED_FIELDS = (
+    'origin', 'sample_type', 'min_wavelength', 'max_wavelength', 'date_added'
+)
+
+
+def documents(queryset):
+    """(pk, document text) for each Sample in queryset"""
+    skip = set(UNPRINTABLE_FIELDS).union(UNSEARCHED_FIELDS)
+    fields = [
+        field.name
+        for field in queryset.model._meta.fields
+        if field.name not in skip
+    ]
+    types = defaultdict(list)
+    through = queryset.model.sample_type.through.objects.using(queryset.db)
+    for sample_id, name in through.values_list(
+        'sample_id', 'sampletype__name'
+    ):
+        types[sample_id].append(name)
+    rows = queryset.values_list('id', 'origin__name', *fields)
+    for pk, origin, *values in rows.iterator(chunk_size=2000):
+        yield pk, SEPARATOR.join(
+            '' if value is None else str(value)
+            for value in values + [origin] + types[pk]
+        )
+
+
+def create_fulltext_index(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor != 'sqlite':
+        return
+    Sample = apps.get_model('visor', 'Sample')
+    database = connection.alias
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {TABLE} USING "
+            f"fts5(document, tokenize='trigram')"
+        )
+        cursor.execute(f"DELETE FROM {TABLE}")
+        batch = []
+        for row in documents(Sample.objects.using(database).order_by('id')):
+            batch.append(row)
+            if len(batch) == 2000:
+                cursor.executemany(
+                    f"INSERT INTO {TABLE} (rowid, document) VALUES (%s, %s)",
+                    batch,
+                )
+                batch = []
+        if len(batch) > 0:
+            cursor.executemany(
+                f"INSERT INTO {TABLE} (rowid, document) VALUES (%s, %s)",
+                batch,
+            )
+
+
+def drop_fulltext_index(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f"DROP TABLE IF EXISTS {TABLE}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('visor', '0009_simulatedspectrum'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_fulltext_index, drop_fulltext_index),
+    ]
@@ -0,0 +1,89 @@
+# Generated by Django 5.2.18 on 2026-10-17 18:22
+
+import re
+
+from django.db import migrations, models
+
+# visor.models.UNKNOWN_GRAIN_SIZES and parse_grain_size as of this
+# migration, frozen here so that later changes to the model module don't
+# change what this migration does
+UNKNOWN_GRAIN_SIZES = ('Unknown', 'Unspecified Particulate', '')
+
+
+def parse_grain_size(grain_size):
+    """(minimum size, maximum size, category) of a grain_size string"""
+    grain_size = '' if grain_size is None else str(grain_size).strip()
+    if grain_size in UNKNOWN_GRAIN_SIZES:
+        return None, None, 'unknown'
+    if grain_size == 'Whole Object':
+        return None, None, 'whole object'
+    sizes, category = [], 'sized'
+    for part in re.split(r'[_,\-]', grain_size.strip('()')):
+        part = part.strip().strip('\'"')
+        if part == '':
+            continue
+        if part == 'Whole Object':
+            category = 'whole object'
+        elif part in UNKNOWN_GRAIN_SIZES:
+            category = 'unknown'
+        else:
+            try:
+                sizes.append(float(part))
+            except ValueError:
+                return None, None, ''
+    if len(sizes) == 0:
+        return None, None, category if category != 'sized' else ''
+    return min(sizes), max(sizes), category
+
+
+def parse_grain_sizes(apps, schema_editor):
+    Sample = apps.get_model('visor', 'Sample')
+    database = schema_editor.connection.alias
+    samples = list(
+        Sample.objects.using(database).only('id', 'grain_size')
+    )
+    unparseable = {}
+    for sample in samples:
+        (
+            sample.grain_size_min,
+            sample.grain_size_max,
+            sample.grain_size_category,
+        ) = parse_grain_size(sample.grain_size)
+        if sample.grain_size_category == '':
+            unparseable.setdefault(sample.grain_size, []).append(sample.id)
+    Sample.objects.using(database).bulk_update(
+        samples,
+        ['grain_size_min', 'grain_size_max', 'grain_size_category'],
+        batch_size=500,
+    )
+    for grain_size, ids in unparseable.items():
+        print(
+            f"couldn't parse grain size {grain_size!r} of {len(ids)} "
+            f"sample(s), e.g. pk {ids[0]}; they won't match size searches"
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('visor', '0010_sample_fulltext_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='sample',
+            name='grain_size_category',
+            field=models.CharField(blank=True, choices=[('sized', 'Sized'), ('whole object', 'Whole Object'), ('unknown', 'Unknown'), ('', 'Unparseable')], db_index=True, max_length=20, verbose_name='Grain Size Category'),
+        ),
+        migrations.AddField(
+            model_name='sample',
+            name='grain_size_max',
+            field=models.FloatField(blank=True, db_index=True, null=True, verbose_name='Maximum Grain Size'),
+        ),
+        migrations.AddField(
+            model_name='sample',
+            name='grain_size_min',
+            field=models.FloatField(blank=True, db_index=True, null=True, verbose_name='Minimum Grain Size'),
+        ),
+        migrations.RunPython(parse_grain_sizes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 19:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('visor', '0011_sample_grain_size_range'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='simulatedspectrum',
+            name='date_simulated',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+    ]
@@ -1,15 +1,16 @@
 import warnings
 from ast import literal_eval
 from functools import cached_property
-from io import StringIO
 from itertools import accumulate, repeat
 import json
 from operator import add
 import os
+import re
+from typing import Optional
 
 from django import forms
 from django.conf import settings
-from django.db import models, IntegrityError
+from django.db import models, IntegrityError, router, transaction
 from marslab.compat.xcam import DERIVED_CAM_DICT
 import numpy as np
 import pandas as pd
@@ -20,7 +21,11 @@ from toolz.curried import valfilter
 from toolz import valmap
 
 from visor.dj_utils import model_values
-from visor.spectral import simulate_spectrum
+import visor.compiled
+from visor.packing import (
+    pack_array, pack_reflectance, reflectance_array, unpack_array
+)
+from visor.spectral import filterset_hash
 
 
 class DupeCheckWarning(UserWarning):
@@ -28,6 +33,43 @@ class DupeCheckWarning(UserWarning):
     pass
 
 
+# grain_size values meaning "we don't know"
+UNKNOWN_GRAIN_SIZES = ("Unknown", "Unspecified Particulate", "")
+
+
+def parse_grain_size(
+    grain_size: str,
+) -> tuple[Optional[float], Optional[float], str]:
+    """
+    parse a Sample's grain_size string -- a single size in microns, a range
+    like "(10_100)" or "100-250", "Whole Object", or one of
+    UNKNOWN_GRAIN_SIZES -- into (minimum size, maximum size, category).
+    category is "" for strings we can't make sense of.
+    """
+    grain_size = "" if grain_size is None else str(grain_size).strip()
+    if grain_size in UNKNOWN_GRAIN_SIZES:
+        return None, None, "unknown"
+    if grain_size == "Whole Object":
+        return None, None, "whole object"
+    sizes, category = [], "sized"
+    for part in re.split(r"[_,\-]", grain_size.strip("()")):
+        part = part.strip().strip("'\"")
+        if part == "":
+            continue
+        if part == "Whole Object":
+            category = "whole object"
+        elif part in UNKNOWN_GRAIN_SIZES:
+            category = "unknown"
+        else:
+            try:
+                sizes.append(float(part))
+            except ValueError:
+                return None, None, ""
+    if len(sizes) == 0:
+        return None, None, category if category != "sized" else ""
+    return min(sizes), max(sizes), category
+
+
 class FilterSet(models.Model):
     """
     model representing a set of filters/bandpasses/etc. from a real-world
@@ -74,6 +116,30 @@ class FilterSet(models.Model):
     # perfectly-calibrated spectral response across all bins?
     resample_only = models.BooleanField(default=False, db_index=True)
 
+    # hash of the fields above that affect simulation. used to key compiled
+    # filtersets (see visor.compiled); recomputed on every save.
+    content_hash = models.CharField(
+        max_length=64, blank=True, editable=False, db_index=True
+    )
+
+    def save(self, *args, **kwargs):
+        if self.pk is not None:
+            # simulated spectra are keyed by short name; follow renames
+            previous = FilterSet.objects.filter(pk=self.pk).values_list(
+                "short_name", flat=True
+            ).first()
+            if previous not in (None, self.short_name):
+                SimulatedSpectrum.objects.filter(filterset=previous).update(
+                    filterset=self.short_name
+                )
+        self.content_hash = filterset_hash(
+            self.filters,
+            self.wavelengths,
+            self.filter_wavelengths,
+            self.resample_only,
+        )
+        super(FilterSet, self).save(*args, **kwargs)
+
     def __str__(self):
         return self.name
 
@@ -202,6 +268,25 @@ class Sample(models.Model):
     grain_size = models.CharField(
         "Grain Size", blank=True, max_length=40, db_index=True
     )
+    # parsed from grain_size by Sample.save(); see parse_grain_size()
+    grain_size_min = models.FloatField(
+        "Minimum Grain Size", blank=True, null=True, db_index=True
+    )
+    grain_size_max = models.FloatField(
+        "Maximum Grain Size", blank=True, null=True, db_index=True
+    )
+    grain_size_category = models.CharField(
+        "Grain Size Category",
+        blank=True,
+        max_length=20,
+        db_index=True,
+        choices=[
+            ("sized", "Sized"),
+            ("whole object", "Whole Object"),
+            ("unknown", "Unknown"),
+            ("", "Unparseable"),
+        ],
+    )
     image = models.CharField(
         "Path to Image", blank=True, null=True, max_length=100, db_index=True
     )
@@ -235,6 +320,12 @@ class Sample(models.Model):
     reflectance = models.TextField(
         "Reflectance", default="[0,0]", db_index=True
     )
+    # the same array in the binary format defined in visor.packing. this is
+    # what data_array reads; rows written before it existed are converted by
+    # the pack_reflectance management command.
+    reflectance_packed = models.BinaryField(
+        "Packed Reflectance", blank=True, null=True
+    )
     resolution = models.CharField(
         "Resolution", blank=True, max_length=40, db_index=True
     )
@@ -253,10 +344,6 @@ class Sample(models.Model):
     sample_type = models.ManyToManyField(
         SampleType, verbose_name="Sample Type",
     )
-    # dictionary of pandas dataframes stored as json string
-    simulated_spectra = models.TextField(
-        "Simulated Spectra", default="{}", db_index=True
-    )
     view_geom = models.CharField(
         "Viewing Geometry", blank=True, max_length=40, db_index=True
     )
@@ -265,11 +352,14 @@ class Sample(models.Model):
         "image",
         "id",
         "reflectance",
+        "reflectance_packed",
         "filename",
         "import_notes",
         "flagged",
-        "simulated_spectra",
-        "released"
+        "released",
+        "grain_size_min",
+        "grain_size_max",
+        "grain_size_category",
     )
     # defined groups of fields we can and cannot use for various sorts of
     # operations.
@@ -280,6 +370,16 @@ class Sample(models.Model):
     numeric_fields = ["min_wavelength", "max_wavelength"]
     m2m_managers = ["library"]
     searchable_fields = phrase_fields + choice_fields + numeric_fields
+    # fields included in brief JSON representations, e.g. in result tables
+    brief_fields = (
+        "id",
+        "sample_id",
+        "sample_name",
+        "origin",
+        "sample_type",
+        "grain_size",
+        "view_geom"
+    )
 
     # private attributes used during creation process
     _warnings = []
@@ -297,6 +397,7 @@ class Sample(models.Model):
             self._warnings += literal_eval(self.import_notes)
         # TODO: do I really like this IDL-esque list of procedures?
         self._regularize_metadata_strings()
+        self._parse_grain_size()
         self._transform_reflectance_to_numpy_array()
         self._check_for_numeracy()
         self._check_for_absurd_values()
@@ -312,13 +413,25 @@ class Sample(models.Model):
         at the end, it inserts the Sample into the database.
         """
         self._handle_duplicate_sample_ids()
+        (
+            self.grain_size_min,
+            self.grain_size_max,
+            self.grain_size_category,
+        ) = parse_grain_size(self.grain_size)
+        if self.reflectance_packed is None:
+            self.reflectance_packed = pack_reflectance(self.data_array)
         if self.image:
             self._clean_image_field()
         convolve = kwargs.pop("convolve", True)
         if convolve:
-            self._create_simulated_spectra()
+            simulations = self._create_simulated_spectra()
         self._warn_and_raise()
-        super(Sample, self).save(*args, **kwargs)
+        with transaction.atomic(using=router.db_for_write(Sample)):
+            super(Sample, self).save(*args, **kwargs)
+            if convolve:
+                for simulation in simulations:
+                    simulation.sample = self
+                SimulatedSpectrum.upsert(simulations)
 
     def as_dict(self):
         self_dict = {}
@@ -339,15 +452,44 @@ class Sample(models.Model):
         return "Wavelength,Response\n" + "\n".join(
             [
                 f"{wavelength},{response}"
-                for wavelength, response in literal_eval(self.reflectance)
+                for wavelength, response in self.data_array.tolist()
             ]
         )
 
-    def sim_csv_blocks(self):
-        sims = dict(json.loads(self.simulated_spectra))
+    def simulated_frames(self, filtersets=None) -> dict[str, pd.DataFrame]:
+        """
+        simulated spectra as DataFrames formatted like the output of
+        spectral.simulate_spectrum(), keyed by filterset short name. pass an
+        iterable of short names as filtersets to load only those.
+        """
+        if "simulations" in getattr(self, "_prefetched_objects_cache", {}):
+            simulations = self.simulations.all()
+        elif filtersets is not None:
+            simulations = self.simulations.filter(filterset__in=filtersets)
+        else:
+            simulations = self.simulations.all()
+        compiled = {
+            c.short_name: c for c in visor.compiled.compiled_filtersets()
+        }
         frames = {}
-        for instrument in sims.keys():
-            frame = pd.read_json(StringIO(sims[instrument]))
+        for simulation in simulations:
+            if filtersets is not None and simulation.filterset not in filtersets:
+                continue
+            if (filterset := compiled.get(simulation.filterset)) is None:
+                continue
+            responses = simulation.response_array
+            # stale simulation of a since-modified filterset; skip it until
+            # it is resimulated
+            if len(responses) != len(filterset.names):
+                continue
+            frames[simulation.filterset] = filterset.simulation_frame(
+                responses
+            )
+        return frames
+
+    def sim_csv_blocks(self, filtersets=None):
+        frames = {}
+        for instrument, frame in self.simulated_frames(filtersets).items():
             frame.index = frame['filter']
             output = {}
             for filt in frame.index:
@@ -379,24 +521,18 @@ class Sample(models.Model):
     #  live on the model? I don't like it, in any case.
     def as_json(self, brief=False):
         json_dict = {}
-        brief_fields = (
-            "id",
-            "sample_id",
-            "sample_name",
-            "origin",
-            "sample_type",
-            "grain_size",
-            "view_geom"
-        )
         for field in self._meta.get_fields():
+            if field.name == "reflectance_packed":
+                continue
+            # reverse relations, i.e. simulations; handled below
+            if field.auto_created and not field.concrete:
+                continue
             if not getattr(self, field.name):
                 continue
-            if brief and (field.name not in brief_fields):
+            if brief and (field.name not in self.brief_fields):
                 continue
             if field.name == "reflectance":
-                json_dict |= {
-                    "reflectance": dict(literal_eval(self.reflectance))
-                }
+                json_dict |= {"reflectance": dict(self.data_array.tolist())}
             elif field.name == "date_added":
                 json_dict |= {"date_added": str(self.date_added)}
             elif isinstance(field, models.ForeignKey):
@@ -404,34 +540,35 @@ class Sample(models.Model):
             elif isinstance(field, models.ManyToManyField):
                 vals = [val.name for val in getattr(self, field.name).all()]
                 json_dict |= {field.name: vals}
-            elif field.name == "simulated_spectra":
-                sims = json.loads(self.simulated_spectra)
-                for filterset in sims:
-                    name = filterset
-                    # 'astype(float)'' is added because json will not
-                    # treat numpy.int64 as an int or float, unlike its
-                    # treatment of numpy.float64, which causes problems
-                    # for samples that have reflectance ranges that lie
-                    # totally outside of a filterset's range
-                    spectrum = dict(
-                        pd.read_json(StringIO(sims[filterset]))
-                        .drop(columns="filter")
-                        .values.astype(float)
-                    )
-                    json_dict |= {name: spectrum}
             else:
                 json_dict |= {field.name: getattr(self, field.name)}
             json_dict[
                 "wavelength_range"
             ] = f"{self.min_wavelength}-{self.max_wavelength}"
+        if brief:
+            return json_dict
+        for name, frame in self.simulated_frames().items():
+            # 'astype(float)' is added because json will not treat
+            # numpy.int64 as an int or float, which causes problems for
+            # filtersets with integer center wavelengths
+            json_dict |= {
+                name: dict(
+                    frame[["wavelength", "response"]]
+                    .to_numpy()
+                    .astype(float)
+                    .tolist()
+                )
+            }
         return json_dict
 
     @cached_property
     def data_array(self):
-        return np.array(json.loads(self.reflectance))
+        return reflectance_array(self.reflectance_packed, self.reflectance)
 
     def get_simulated_spectra(self):
-        return valmap(literal_eval, literal_eval(self.simulated_spectra))
+        return valmap(
+            lambda frame: frame.to_dict(), self.simulated_frames()
+        )
 
     def _raise_for_duplicates(self):
         matches = Sample.objects.filter(
@@ -487,13 +624,13 @@ class Sample(models.Model):
                 self._load_image()
         self._update_image_path(image_path)
 
-    def _create_simulated_spectra(self):
-        sims = {}
-        for filterset in FilterSet.objects.all():
-            sims[filterset.short_name] = simulate_spectrum(self, filterset)
-        for sim in sims:
-            sims[sim] = sims[sim].reset_index(drop=True).to_json()
-        self.simulated_spectra = json.dumps(sims)
+    def _create_simulated_spectra(self) -> list["SimulatedSpectrum"]:
+        return [
+            SimulatedSpectrum.from_responses(
+                compiled, compiled.simulate([self])[0]
+            )
+            for compiled in visor.compiled.compiled_filtersets()
+        ]
 
     def _update_image_path(self, image_path):
         if isinstance(self.image, PIL.Image.Image):
@@ -520,7 +657,9 @@ class Sample(models.Model):
         don't mess with arrays or pathnames or the primary key.
         """
         for field in self._meta.fields:
-            if field.name in ["reflectance", "image", "id"]:
+            if field.name in [
+                "reflectance", "reflectance_packed", "image", "id"
+            ]:
                 continue
             value = getattr(self, field.name)
             if value is None:
@@ -529,6 +668,18 @@ class Sample(models.Model):
                 value = str(value).strip().replace(",", "_")
                 setattr(self, field.name, value)
 
+    def _parse_grain_size(self):
+        (
+            self.grain_size_min,
+            self.grain_size_max,
+            self.grain_size_category,
+        ) = parse_grain_size(self.grain_size)
+        if self.grain_size_category == "":
+            self._warnings.append(
+                f"Grain size '{self.grain_size}' could not be interpreted; "
+                f"this sample won't match searches restricted by size."
+            )
+
     def _load_image(self):
         try:
             raster = Image.open(self.image)
@@ -593,6 +744,8 @@ class Sample(models.Model):
     def _bound_and_jsonify_reflectance(self):
         self.min_wavelength = round(self.reflectance[0][0])
         self.max_wavelength= round(self.reflectance[-1][0])
+        self.reflectance_packed = pack_reflectance(self.reflectance)
+        self.__dict__.pop("data_array", None)
         self.reflectance = json.dumps(self.reflectance.tolist())
 
     def _reshape_and_sort_reflectance(self):
@@ -624,3 +777,61 @@ class Sample(models.Model):
         ordering = ["sample_id"]
 
 
+class SimulatedSpectrum(models.Model):
+    """
+    simulated response of one Sample to one FilterSet, as produced by
+    visor.spectral.simulate_spectra(): a packed array of responses with
+    filters in wavelength order. filter names and centers come from the
+    compiled FilterSet (see visor.compiled).
+    """
+
+    sample = models.ForeignKey(
+        Sample, on_delete=models.CASCADE, related_name="simulations"
+    )
+    # FilterSets live in a different database, so this can't be a ForeignKey
+    filterset = models.CharField(
+        "FilterSet Short Name", max_length=45, db_index=True
+    )
+    # content_hash of the FilterSet at simulation time
+    filterset_hash = models.CharField(max_length=64, blank=True)
+    responses = models.BinaryField("Responses")
+    # set on every write, including upsert()'s updates, so that other
+    # processes can tell which simulations changed (see visor/neighbors.py)
+    date_simulated = models.DateTimeField(auto_now=True, db_index=True)
+
+    @classmethod
+    def from_responses(
+        cls, compiled: "visor.compiled.CompiledFilterSet", responses, **kwargs
+    ) -> "SimulatedSpectrum":
+        return cls(
+            filterset=compiled.short_name,
+            filterset_hash=compiled.content_hash,
+            responses=pack_array(np.asarray(responses, dtype=float)),
+            **kwargs
+        )
+
+    @staticmethod
+    def upsert(simulations, batch_size=None):
+        """insert simulations, replacing existing ones for the same pairs"""
+        return SimulatedSpectrum.objects.bulk_create(
+            simulations,
+            batch_size=batch_size,
+            update_conflicts=True,
+            unique_fields=["sample", "filterset"],
+            update_fields=["filterset_hash", "responses", "date_simulated"],
+        )
+
+    @property
+    def response_array(self) -> np.ndarray:
+        return unpack_array(self.responses)[:, 0]
+
+    def __str__(self):
+        return f"{self.filterset} simulation of sample {self.sample_id}"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["sample", "filterset"],
+                name="unique_sample_filterset_simulation",
+            )
+        ]
@@ -0,0 +1,370 @@
+"""
+nearest-neighbor search in instrument space: per-FilterSet KD-trees over
+Samples' simulated responses, used to find the lab spectra whose simulated
+response best matches an observed XCAM ROI spectrum.
+
+each process keeps one FilterSetIndex per filterset. an index holds a
+(samples x filters) matrix of simulated responses and lazily builds a
+scipy cKDTree for each (filters, normalization filter) combination it is
+queried with. changes are absorbed incrementally: changed or new samples
+go into a small pending buffer that is searched by brute force, and
+replaced or deleted rows are tombstoned, until enough have accumulated to
+make rebuilding the trees worthwhile.
+"""
+from threading import RLock
+import time
+from typing import Collection, Optional, Sequence
+
+from django.conf import settings
+from django.db.models import Count, Max, Q
+from marslab.compat.xcam import DERIVED_CAM_DICT
+import numpy as np
+from scipy.spatial import cKDTree
+
+from visor.compiled import CompiledFilterSet, compiled_filtersets
+from visor.constants import XCAM_FILTERSETS
+from visor.io.observational import (
+    make_xcam_reflectance_array, xcam_scale_pair
+)
+from visor.models import SimulatedSpectrum
+from visor.packing import unpack_array
+
+
+def _normalize(
+    matrix: np.ndarray, column: Optional[int]
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    divide each row by its value in column (if column is not None). returns
+    the normalized matrix and a mask of rows that could be normalized.
+    """
+    if column is None:
+        return matrix, np.isfinite(matrix).all(axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        normalized = matrix / matrix[:, [column]]
+    return normalized, np.isfinite(normalized).all(axis=1)
+
+
+class FilterSetIndex:
+    """nearest-neighbor index over one filterset's simulated responses"""
+
+    def __init__(self, compiled: CompiledFilterSet):
+        self.compiled = compiled
+        self.lock = RLock()
+        self.ids = np.empty(0, dtype=np.int64)
+        self.released = np.empty(0, dtype=bool)
+        self.matrix = np.empty((0, len(compiled.names)))
+        self.pending = {}
+        self.tombstones = set()
+        self.latest, self.simulated = None, None
+        self._trees = {}
+        self.rebuild()
+
+    @property
+    def key(self) -> tuple[int, str]:
+        return self.compiled.key
+
+    def _simulations(self):
+        # a blank hash means the simulation's filterset version is unknown
+        # (e.g. it was copied by migration 0009 before that recorded
+        # hashes); _rows() still drops any of the wrong width
+        return SimulatedSpectrum.objects.filter(
+            Q(filterset_hash=self.compiled.content_hash)
+            | Q(filterset_hash=""),
+            filterset=self.compiled.short_name,
+        )
+
+    def _rows(self, simulations) -> dict[int, tuple[bool, np.ndarray]]:
+        rows = {}
+        width = len(self.compiled.names)
+        for pk, released, responses in simulations.values_list(
+            "sample_id", "sample__released", "responses"
+        ):
+            responses = unpack_array(responses)[:, 0]
+            if len(responses) == width:
+                rows[pk] = (released, responses)
+        return rows
+
+    def rebuild(self):
+        """reload every simulation of this filterset from the database"""
+        with self.lock:
+            simulations = self._simulations()
+            state = simulations.aggregate(
+                latest=Max("sample__date_added"),
+                simulated=Max("date_simulated"),
+            )
+            self.latest, self.simulated = state["latest"], state["simulated"]
+            self._load(self._rows(simulations))
+            self.synced = time.monotonic()
+
+    def _load(self, rows: dict[int, tuple[bool, np.ndarray]]):
+        pks = sorted(rows)
+        self.ids = np.array(pks, dtype=np.int64)
+        self.released = np.array([rows[pk][0] for pk in pks], dtype=bool)
+        self.matrix = np.array(
+            [rows[pk][1] for pk in pks], dtype=np.float64
+        ).reshape(len(pks), len(self.compiled.names))
+        self.pending, self.tombstones, self._trees = {}, set(), {}
+
+    def compact(self):
+        """fold pending rows and tombstones into the matrix, in memory"""
+        with self.lock:
+            rows = {
+                pk: (released, responses)
+                for pk, released, responses in zip(
+                    self.ids.tolist(), self.released, self.matrix
+                )
+                if pk not in self.tombstones
+            }
+            self._load(rows | self.pending)
+
+    def __len__(self):
+        return len(self.ids) - len(self.tombstones) + len(self.pending)
+
+    def sync(self):
+        """
+        pick up changes made by this or any other process since the index
+        was last synced: samples saved since then (Sample.date_added is
+        auto_now), simulations rewritten since then without saving their
+        samples, e.g. by the resimulate command (date_simulated is auto_now
+        too), and deleted samples. throttled to once every
+        settings.VISOR_NEIGHBORS_SYNC_INTERVAL seconds.
+        """
+        interval = getattr(settings, "VISOR_NEIGHBORS_SYNC_INTERVAL", 2)
+        with self.lock:
+            if time.monotonic() - self.synced < interval:
+                return
+            simulations = self._simulations()
+            state = simulations.aggregate(
+                count=Count("id"),
+                latest=Max("sample__date_added"),
+                simulated=Max("date_simulated"),
+            )
+            self.synced = time.monotonic()
+            marks = (state["latest"], state["simulated"])
+            if marks != (self.latest, self.simulated):
+                if None in marks or None in (self.latest, self.simulated):
+                    return self.rebuild()
+                changed = Q()
+                if state["latest"] > self.latest:
+                    changed |= Q(sample__date_added__gt=self.latest)
+                if state["simulated"] > self.simulated:
+                    changed |= Q(date_simulated__gt=self.simulated)
+                if changed:
+                    self.update(self._rows(simulations.filter(changed)))
+                self.latest = max(state["latest"], self.latest)
+                self.simulated = max(state["simulated"], self.simulated)
+            if state["count"] != len(self):
+                live = set(simulations.values_list("sample_id", flat=True))
+                self.remove(
+                    set(self.ids.tolist()).union(self.pending) - live
+                )
+                if state["count"] != len(self):
+                    self.rebuild()
+
+    def update(self, rows: dict[int, tuple[bool, np.ndarray]]):
+        with self.lock:
+            indexed = set(self.ids.tolist())
+            for pk, row in rows.items():
+                if pk in indexed:
+                    self.tombstones.add(pk)
+                self.pending[pk] = row
+            self._maybe_compact()
+
+    def remove(self, pks: Collection[int]):
+        with self.lock:
+            indexed = set(self.ids.tolist())
+            for pk in pks:
+                self.pending.pop(pk, None)
+                if pk in indexed:
+                    self.tombstones.add(pk)
+            self._maybe_compact()
+
+    def _maybe_compact(self):
+        fraction = getattr(settings, "VISOR_NEIGHBORS_COMPACT_FRACTION", 0.05)
+        changed = len(self.pending) + len(self.tombstones)
+        if changed > max(64, fraction * len(self.ids)):
+            self.compact()
+
+    def _tree(
+        self, columns: tuple[int, ...], normalize_to: Optional[int]
+    ) -> tuple[Optional[cKDTree], np.ndarray]:
+        """tree over some columns, and the matrix rows it contains"""
+        key = (columns, normalize_to)
+        if key not in self._trees:
+            normalized, valid = _normalize(self.matrix, normalize_to)
+            rows = np.flatnonzero(valid)
+            points = normalized[rows][:, list(columns)]
+            tree = cKDTree(points) if len(rows) > 0 else None
+            self._trees[key] = (tree, rows)
+        return self._trees[key]
+
+    def query(
+        self,
+        vector: np.ndarray,
+        columns: Sequence[int],
+        k: int = 10,
+        normalize_to: Optional[int] = None,
+        released_only: bool = False,
+        candidates: Optional[Collection[int]] = None,
+    ) -> list[tuple[int, float]]:
+        """
+        the k samples nearest vector, which gives (already normalized, if
+        normalize_to is not None) responses for the filters at the given
+        column indices. returns (pk, RMS distance) pairs, nearest first.
+        """
+        columns = tuple(columns)
+        vector = np.asarray(vector, dtype=np.float64)
+        candidates = None if candidates is None else set(candidates)
+
+        def eligible(pk, released):
+            if pk in self.tombstones:
+                return False
+            if released_only and not released:
+                return False
+            return candidates is None or pk in candidates
+
+        with self.lock:
+            found = {}
+            tree, rows = self._tree(columns, normalize_to)
+            if tree is not None:
+                # ask for more neighbors until enough survive filtering
+                want = k + len(self.tombstones)
+                while True:
+                    want = min(want, len(rows))
+                    distances, hits = tree.query(vector, want)
+                    distances = np.atleast_1d(distances)
+                    hits = np.atleast_1d(hits)
+                    found = {}
+                    for distance, hit in zip(distances, hits):
+                        row = rows[hit]
+                        pk = int(self.ids[row])
+                        if eligible(pk, self.released[row]):
+                            found[pk] = float(distance)
+                    if len(found) >= k or want == len(rows):
+                        break
+                    want *= 4
+            if self.pending:
+                pks = list(self.pending)
+                matrix = np.array([self.pending[pk][1] for pk in pks])
+                normalized, valid = _normalize(matrix, normalize_to)
+                distances = np.sqrt(
+                    ((normalized[:, list(columns)] - vector) ** 2).sum(axis=1)
+                )
+                for pk, distance, ok in zip(pks, distances, valid):
+                    released = self.pending[pk][0]
+                    # pending rows are never tombstoned, only replaced
+                    if ok and (not released_only or released) and (
+                        candidates is None or pk in candidates
+                    ):
+                        found[pk] = float(distance)
+        ranked = sorted(found.items(), key=lambda item: item[1])[:k]
+        scale = np.sqrt(len(columns))
+        return [(pk, float(distance / scale)) for pk, distance in ranked]
+
+
+_INDEXES: dict[str, FilterSetIndex] = {}
+_INDEXES_LOCK = RLock()
+
+
+def filterset_index(short_name: str, sync: bool = True) -> FilterSetIndex:
+    """this process's index for a filterset, built or synced as needed"""
+    compiled = {c.short_name: c for c in compiled_filtersets()}
+    if short_name not in compiled:
+        raise KeyError(f"no filterset named {short_name}")
+    with _INDEXES_LOCK:
+        index = _INDEXES.get(short_name)
+        if index is None or index.key != compiled[short_name].key:
+            index = _INDEXES[short_name] = FilterSetIndex(
+                compiled[short_name]
+            )
+        elif sync is True:
+            index.sync()
+        return index
+
+
+def discard_sample(pk: int):
+    """drop a deleted sample from every index built in this process"""
+    with _INDEXES_LOCK:
+        for index in _INDEXES.values():
+            index.remove([pk])
+
+
+def match_columns(
+    centers: np.ndarray, wavelengths: np.ndarray, tolerance: float
+) -> dict[int, int]:
+    """
+    pair filterset filter centers with observed wavelengths, nearest first,
+    each at most once and no further apart than tolerance nm. returns
+    {center index: wavelength index}.
+    """
+    separation = np.abs(centers[:, None] - wavelengths[None, :])
+    pairs = {}
+    for flat in np.argsort(separation, axis=None):
+        column, point = np.unravel_index(flat, separation.shape)
+        if separation[column, point] > tolerance:
+            break
+        if column in pairs or point in pairs.values():
+            continue
+        pairs[int(column)] = int(point)
+    return pairs
+
+
+def match_roi(
+    instrument: str,
+    spectrum: dict,
+    filterset: Optional[str] = None,
+    k: int = 10,
+    normalize: bool = True,
+    released_only: bool = False,
+    candidates: Optional[Collection[int]] = None,
+) -> list[dict]:
+    """
+    find the samples whose simulated response best matches an XCAM ROI
+    spectrum, given as {filter name: mean value} in the format of a marslab
+    file row. the ROI is polished exactly as when it is ingested
+    (visor.io.observational.make_xcam_reflectance_array) and compared, at
+    the filters whose centers lie within settings.VISOR_ROI_TOLERANCE nm of
+    its band centers, to simulated responses for filterset (by default, the
+    instrument's own filterset). if normalize is True, both the ROI and the
+    simulated responses are scaled to 1 at the filter pair the ROI's eyes
+    were scaled to.
+
+    returns dicts with keys "id" and "distance" (RMS difference), nearest
+    first.
+    """
+    if filterset is None:
+        filterset = XCAM_FILTERSETS[instrument]
+    index = filterset_index(filterset)
+    reflectance = make_xcam_reflectance_array(instrument, spectrum)
+    tolerance = getattr(settings, "VISOR_ROI_TOLERANCE", 10)
+    pairs = match_columns(
+        index.compiled.centers, reflectance[:, 0], tolerance
+    )
+    if len(pairs) == 0:
+        raise ValueError(
+            f"none of this ROI's bands correspond to filters of {filterset}"
+        )
+    columns = sorted(pairs)
+    vector = reflectance[[pairs[column] for column in columns], 1]
+    normalize_to = None
+    if normalize is True:
+        pair = xcam_scale_pair(instrument, spectrum)
+        if pair is None:
+            raise ValueError("this ROI has no filter pair to normalize to")
+        virtuals = DERIVED_CAM_DICT[instrument]["virtual_filters"]
+        virtual = virtuals["_".join(pair)]
+        nearest = match_columns(
+            index.compiled.centers[columns], np.array([virtual]), tolerance
+        )
+        if len(nearest) == 0:
+            raise ValueError(
+                f"{filterset} has no filter near {virtual} nm to normalize to"
+            )
+        normalize_to = columns[next(iter(nearest))]
+        vector = vector / vector[columns.index(normalize_to)]
+    return [
+        {"id": pk, "distance": distance}
+        for pk, distance in index.query(
+            vector, columns, k, normalize_to, released_only, candidates
+        )
+    ]
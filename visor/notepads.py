@@ -0,0 +1,72 @@
+"""
+housekeeping for the notetaking.Notepad segments that hold per-session
+inventories (see visor/inventory.py): a background sweep, started by the
+first notepad inventory store in each process, that removes notepads idle
+for longer than settings.VISOR_NOTEPAD_TTL and evicts the least recently
+used ones while they total more than settings.VISOR_NOTEPAD_MAX_BYTES. the
+sweep_notepads management command runs the same sweep once, e.g. from
+cron, and reports usage. neither removes the memo notepad (see
+visor/memo.py), which every process shares for as long as it runs.
+"""
+import logging
+import threading
+from typing import Optional
+
+from django.conf import settings
+
+from notetaking.lifecycle import Segment, Sweeper
+from visor.memo import notepad_prefix
+
+logger = logging.getLogger("django")
+
+_sweeper: Optional[Sweeper] = None
+_sweeper_lock = threading.Lock()
+
+
+def max_bytes() -> Optional[int]:
+    return getattr(settings, "VISOR_NOTEPAD_MAX_BYTES", 256 * 1024 ** 2)
+
+
+def ttl() -> Optional[float]:
+    return getattr(settings, "VISOR_NOTEPAD_TTL", 24 * 60 * 60)
+
+
+def sweep_interval() -> Optional[float]:
+    return getattr(settings, "VISOR_NOTEPAD_SWEEP_INTERVAL", 300)
+
+
+def kept() -> tuple[str, ...]:
+    """prefixes of the notepads sweeps leave alone"""
+    prefix = notepad_prefix()
+    return () if prefix is None else (prefix,)
+
+
+def report(removed: list[Segment], usage: dict):
+    """log a sweep, warning if notepads are near their byte budget"""
+    if len(removed) > 0:
+        logger.info(
+            f"removed {len(removed)} notepads "
+            f"({sum(segment.bytes for segment in removed)} bytes)"
+        )
+    budget = max_bytes()
+    if budget is not None and usage["bytes"] > 0.9 * budget:
+        logger.warning(
+            f"notepads are using {usage['bytes']} of {budget} bytes"
+        )
+
+
+def ensure_sweeper():
+    """start this process's background sweep, if configured and not yet"""
+    global _sweeper
+    if _sweeper is not None or sweep_interval() is None:
+        return
+    with _sweeper_lock:
+        if _sweeper is None:
+            _sweeper = Sweeper(
+                sweep_interval(),
+                max_bytes(),
+                ttl(),
+                on_sweep=report,
+                keep=kept(),
+            )
+            _sweeper.start()
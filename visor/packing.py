@@ -0,0 +1,80 @@
+"""
+compact binary representation for numeric arrays stored in the database,
+primarily Sample reflectance. a packed array is a fixed-size header
+followed by the raw little-endian array buffer (optionally zlib-compressed),
+so uncompressed arrays decode zero-copy via np.frombuffer.
+"""
+import json
+import struct
+import zlib
+from typing import Optional, Union
+
+from django.conf import settings
+import numpy as np
+
+# magic, dtype character, compression flag, 2 pad bytes, rows, columns.
+# 16 bytes total, which keeps the data buffer 8-byte aligned.
+HEADER = struct.Struct("<4scB2xII")
+MAGIC = b"VSPK"
+DTYPES = {b"f": np.dtype("<f4"), b"d": np.dtype("<f8")}
+COMPRESSIONS = {"none": 0, "zlib": 1}
+
+
+def pack_array(
+    array: np.ndarray, dtype: str = "float64", compression: str = "none"
+) -> bytes:
+    """pack a 1- or 2-D numeric array into bytes."""
+    array = np.ascontiguousarray(array, dtype=np.dtype(dtype).newbyteorder("<"))
+    if array.ndim == 1:
+        array = array.reshape(-1, 1)
+    if array.ndim != 2:
+        raise ValueError("only 1- or 2-D arrays can be packed")
+    code = array.dtype.char.encode()
+    if code not in DTYPES:
+        raise ValueError(f"can't pack arrays of dtype {array.dtype}")
+    payload = array.tobytes()
+    if compression == "zlib":
+        payload = zlib.compress(payload)
+    elif compression != "none":
+        raise ValueError(f"unknown compression {compression}")
+    header = HEADER.pack(
+        MAGIC, code, COMPRESSIONS[compression], *array.shape
+    )
+    return header + payload
+
+
+def unpack_array(blob: Union[bytes, memoryview]) -> np.ndarray:
+    """
+    decode bytes produced by pack_array. uncompressed arrays are returned as
+    read-only views on blob's buffer; no copy is made.
+    """
+    view = memoryview(blob)
+    magic, code, compressed, rows, columns = HEADER.unpack_from(view)
+    if magic != MAGIC:
+        raise ValueError("not a packed array")
+    payload = view[HEADER.size:]
+    if compressed:
+        payload = zlib.decompress(payload)
+    return np.frombuffer(payload, dtype=DTYPES[code]).reshape(rows, columns)
+
+
+def pack_reflectance(reflectance: np.ndarray) -> bytes:
+    """pack a reflectance array using the deployment's storage settings."""
+    return pack_array(
+        reflectance,
+        getattr(settings, "VISOR_REFLECTANCE_DTYPE", "float64"),
+        getattr(settings, "VISOR_REFLECTANCE_COMPRESSION", "none"),
+    )
+
+
+def reflectance_array(
+    packed: Optional[Union[bytes, memoryview]], text: Optional[str] = None
+) -> np.ndarray:
+    """
+    the single decode path for Sample reflectance: use the packed
+    representation when present, falling back to the legacy JSON text for
+    rows that have not yet been migrated.
+    """
+    if packed is not None:
+        return unpack_array(packed)
+    return np.array(json.loads(text))
@@ -0,0 +1,214 @@
+"""
+keyset ("seek") pagination of search results. rather than counting and
+OFFSET-scanning the whole search for every page, pages are fetched by
+filtering on the sort columns: rows that sort after the last row of the
+previous page. the position of each page boundary found is remembered
+("bookmarks"), and so is the result count, both in the result cache (see
+visor/result_cache.py), so a page flip costs two small queries however
+deep into the results it is. a jump to a page with no bookmark seeks from
+the nearest bookmark before it, or backwards from the end of the results,
+whichever is closer.
+
+enabled by setting VISOR_PAGINATION = "keyset". keyset pagination only
+works on sorts by non-null columns of Sample or of models it has foreign
+keys to; other sorts (e.g. by sample type) use cached result id lists.
+"""
+from functools import reduce
+from operator import and_, or_
+from typing import Any, Callable, Optional, Sequence
+
+from django.conf import settings
+from django.core.paginator import Page, Paginator
+from django.db import models
+from django.db.models import Q
+
+from visor.models import Sample
+from visor.result_cache import cached_result_ids, result_cache, result_key
+from visor.search import paginate_results
+
+# a sort column: (field path, descending)
+Column = tuple[str, bool]
+# most bookmarks remembered per search and page size
+MAX_BOOKMARKS = 2000
+
+
+def _column_path(
+    model: type[models.Model], name: str
+) -> Optional[list[str]]:
+    """
+    resolve one order_by() field name to the concrete column(s) it sorts
+    by, or None if those are nullable or not reachable through foreign keys
+    """
+    try:
+        field = model._meta.get_field(name)
+    except models.FieldDoesNotExist:
+        return None
+    if field.many_to_many or field.one_to_many or field.null:
+        return None
+    if not field.is_relation:
+        return [field.name]
+    # like order_by(), sort by the related model's default ordering
+    related = field.related_model
+    paths = []
+    for related_name in related._meta.ordering or ["pk"]:
+        if related_name.startswith("-") or "__" in related_name:
+            return None
+        if related_name == "pk":
+            related_name = related._meta.pk.name
+        related_path = _column_path(related, related_name)
+        if related_path is None or len(related_path) != 1:
+            return None
+        paths.append(f"{field.name}__{related_path[0]}")
+    return paths
+
+
+def keyset_columns(
+    model: type[models.Model], sort_params: Sequence[str]
+) -> Optional[list[Column]]:
+    """
+    the columns a queryset of model ordered by sort_params can be seeked on,
+    ending with the pk as a tiebreaker, or None if the ordering isn't
+    suitable for keyset pagination
+    """
+    columns = []
+    for param in sort_params:
+        descending = param.startswith("-")
+        name = param.lstrip("-")
+        if name == "pk":
+            name = model._meta.pk.name
+        paths = _column_path(model, name)
+        if paths is None:
+            return None
+        columns += [(path, descending) for path in paths]
+    pk_name = model._meta.pk.name
+    if pk_name not in [path for path, _ in columns]:
+        columns.append((pk_name, False))
+    return columns
+
+
+def _ordering(columns: Sequence[Column], reverse: bool = False) -> list[str]:
+    return [
+        ("-" if descending != reverse else "") + path
+        for path, descending in columns
+    ]
+
+
+def seek(
+    queryset: models.QuerySet,
+    columns: Sequence[Column],
+    key: Sequence[Any],
+    reverse: bool = False,
+) -> models.QuerySet:
+    """rows of queryset that sort strictly after key (before, if reverse)"""
+    clauses = []
+    for i, (path, descending) in enumerate(columns):
+        lookup = "lt" if descending != reverse else "gt"
+        equal = [Q(**{p: v}) for (p, _), v in zip(columns[:i], key[:i])]
+        clauses.append(reduce(and_, equal, Q(**{f"{path}__{lookup}": key[i]})))
+    return queryset.filter(reduce(or_, clauses))
+
+
+class KeysetPaginator(Paginator):
+    """
+    Paginator over an ordered queryset that fetches pages by keyset. state
+    is a dict holding the result count and page bookmarks; it is updated as
+    pages are fetched, so that it can be cached between requests.
+    """
+
+    def __init__(
+        self,
+        object_list: models.QuerySet,
+        per_page: int,
+        columns: Sequence[Column],
+        state: dict,
+        **kwargs,
+    ):
+        super().__init__(
+            object_list.order_by(*_ordering(columns)), per_page, **kwargs
+        )
+        self.columns = list(columns)
+        self.state = state
+        self.bookmarks = state.setdefault("bookmarks", {}).setdefault(
+            self.per_page, {}
+        )
+
+    @property
+    def count(self) -> int:
+        if "count" not in self.state:
+            self.state["count"] = self.object_list.count()
+        return self.state["count"]
+
+    def _rows(self, queryset: models.QuerySet, start: int, stop: int):
+        paths = [path for path, _ in self.columns]
+        return list(queryset.values_list("id", *paths)[start:stop])
+
+    def page(self, number) -> Page:
+        number = self.validate_number(number)
+        bottom = (number - 1) * self.per_page
+        top = min(bottom + self.per_page, self.count)
+        # the nearest bookmark at or before this page (page 1 needs none)
+        start = max(
+            [page for page in self.bookmarks if page <= number], default=1
+        )
+        forward = (number - start) * self.per_page
+        if self.count - top < forward:
+            # closer to the end: seek backwards from it
+            queryset = self.object_list.order_by(
+                *_ordering(self.columns, reverse=True)
+            )
+            rows = self._rows(queryset, self.count - top, self.count - bottom)
+            rows.reverse()
+        else:
+            queryset = self.object_list
+            if start > 1:
+                queryset = seek(queryset, self.columns, self.bookmarks[start])
+            rows = self._rows(queryset, forward, forward + self.per_page)
+        if rows and len(self.bookmarks) < MAX_BOOKMARKS:
+            self.bookmarks[number + 1] = tuple(rows[-1][1:])
+        samples = Sample.objects.in_bulk([row[0] for row in rows])
+        return self._get_page(
+            [samples[row[0]] for row in rows if row[0] in samples],
+            number,
+            self,
+        )
+
+
+def paginate_search(
+    request,
+    cleaned_data: dict,
+    sort_params: Sequence[str],
+    released_only: bool,
+    search: Callable[[], models.QuerySet],
+):
+    """
+    paginate the results of a search, given a function that returns the
+    ordered, unevaluated search queryset. uses keyset pagination if
+    settings.VISOR_PAGINATION is "keyset" and the sort allows it, cached
+    result id lists otherwise. returns page choices, page ids, the page,
+    and the number of results.
+    """
+    columns = None
+    if getattr(settings, "VISOR_PAGINATION", "ids") == "keyset":
+        columns = keyset_columns(Sample, sort_params)
+    if columns is None:
+        ids = cached_result_ids(
+            cleaned_data,
+            sort_params,
+            released_only,
+            lambda: [v[0] for v in search().values_list("id")],
+        )
+        return *paginate_results(request, ids), len(ids)
+    cache = result_cache()
+    key = result_key(cleaned_data, sort_params, released_only) + "-keyset"
+    state = cache.get(key, {})
+    page_choices, page_ids, page_results = paginate_results(
+        request,
+        search(),
+        KeysetPaginator,
+        columns=columns,
+        state=state,
+    )
+    cache.set(
+        key, state, getattr(settings, "VISOR_RESULT_CACHE_TIMEOUT", 900)
+    )
+    return page_choices, page_ids, page_results, page_results.paginator.count
@@ -0,0 +1,176 @@
+"""
+cache of search results, so that page flips, page size changes and re-sorts
+of a search don't re-run it. a search's entry holds the pks it returned,
+keyed by the search form's cleaned data, whether unreleased samples were
+hidden, and the library version (see library_version()); each sort of it
+has another entry holding those pks in order. a sort with no entry yet is
+made by ordering the cached pks, not by re-running the search. entries
+live in the Django cache named by settings.VISOR_RESULT_CACHE, which
+handles eviction by age and size; on a miss, including a deeplink to a
+search no one has run lately, the search is simply run again.
+"""
+import hashlib
+import json
+import time
+from typing import Callable, Optional, Sequence
+
+from django.conf import settings
+from django.core.cache import caches, DEFAULT_CACHE_ALIAS
+from django.db import connections, models
+from django.db.models import Count, Max
+from django.db.models.expressions import RawSQL
+
+from visor.models import Sample
+
+VERSION_KEY = "visor-library-version"
+# values the search ignores, so that e.g. "Any" and a blank field share
+# one entry
+IGNORED_VALUES = (None, "Any", "", [])
+
+
+def result_cache():
+    alias = getattr(settings, "VISOR_RESULT_CACHE", DEFAULT_CACHE_ALIAS)
+    if alias not in settings.CACHES:
+        alias = DEFAULT_CACHE_ALIAS
+    return caches[alias]
+
+
+def bump_library_version():
+    """
+    invalidate every cached search. called on changes Sample.date_added
+    doesn't record, like renaming a Database or changing a Sample's types.
+    """
+    cache = result_cache()
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.set(VERSION_KEY, 1, None)
+
+
+# (time checked, Sample count and latest date_added), per process
+_LIBRARY_STATE: Optional[tuple[float, str]] = None
+
+
+def _library_state() -> str:
+    global _LIBRARY_STATE
+    now = time.monotonic()
+    max_age = getattr(settings, "VISOR_LIBRARY_STATE_TTL", 30)
+    if _LIBRARY_STATE is None or now - _LIBRARY_STATE[0] > max_age:
+        state = Sample.objects.aggregate(
+            count=Count("id"), latest=Max("date_added")
+        )
+        _LIBRARY_STATE = (now, f"{state['count']}:{state['latest']}")
+    return _LIBRARY_STATE[1]
+
+
+def library_version() -> str:
+    """
+    identifies the current state of the library: the version counter, plus
+    the number of Samples and the latest time one was saved, which catch
+    changes made without signals (e.g. by other processes' bulk writes).
+    the latter are queried at most every settings.VISOR_LIBRARY_STATE_TTL
+    seconds, so those changes can take that long to be noticed.
+    """
+    return f"{version_counter()}:{_library_state()}"
+
+
+def version_counter() -> int:
+    """the counter bump_library_version() increments"""
+    return result_cache().get(VERSION_KEY, 0)
+
+
+def normalized_query(cleaned_data: dict) -> dict:
+    """
+    the parts of a search form's cleaned data that affect its results, in a
+    canonical form: ignored values dropped, and multiple choices (which the
+    search treats as sets) sorted
+    """
+    query = {}
+    for field, value in cleaned_data.items():
+        if value in IGNORED_VALUES:
+            continue
+        if isinstance(value, (list, tuple)):
+            value = sorted(str(v) for v in value)
+        query[field] = value
+    return query
+
+
+def _digest(description: dict) -> str:
+    return hashlib.sha256(
+        json.dumps(description, sort_keys=True, default=str).encode()
+    ).hexdigest()
+
+
+def query_key(cleaned_data: dict, released_only: bool) -> str:
+    """key of the entry holding a search's pks, whatever their order"""
+    return "visor-results-" + _digest(
+        {
+            "query": normalized_query(cleaned_data),
+            "released_only": released_only,
+            "version": library_version(),
+        }
+    )
+
+
+def result_key(
+    cleaned_data: dict, sort_params: Sequence[str], released_only: bool
+) -> str:
+    """key of the entry holding a search's pks in one order"""
+    return (
+        query_key(cleaned_data, released_only)
+        + "-sort-"
+        + _digest({"sort": list(sort_params)})[:16]
+    )
+
+
+def filter_ids(
+    queryset: models.QuerySet, ids: Sequence[int]
+) -> models.QuerySet:
+    """
+    queryset restricted to ids. on SQLite, the ids are passed as one JSON
+    parameter, since a parameter per id can exceed its variable limit.
+    """
+    if connections[queryset.db].vendor == "sqlite":
+        return queryset.filter(
+            id__in=RawSQL(
+                "SELECT value FROM json_each(%s)", (json.dumps(list(ids)),)
+            )
+        )
+    return queryset.filter(id__in=ids)
+
+
+def cached_result_ids(
+    cleaned_data: dict,
+    sort_params: Sequence[str],
+    released_only: bool,
+    search: Callable[[], list[int]],
+) -> list[int]:
+    """
+    the pks of a search's results, ordered by sort_params: from the cache
+    if possible; otherwise by ordering the search's cached pks, if it has
+    been run in another order; otherwise from search(). caches them unless
+    there are more than settings.VISOR_RESULT_CACHE_MAX_IDS.
+    """
+    cache = result_cache()
+    timeout = getattr(settings, "VISOR_RESULT_CACHE_TIMEOUT", 900)
+    unordered_key = query_key(cleaned_data, released_only)
+    key = result_key(cleaned_data, sort_params, released_only)
+    ids: Optional[list[int]] = cache.get(key)
+    if ids is not None:
+        return ids
+    found: Optional[list[int]] = cache.get(unordered_key)
+    if found is not None:
+        ids = [
+            row[0]
+            for row in filter_ids(Sample.objects.all(), found)
+            .order_by(*sort_params)
+            .values_list("id")
+        ]
+        cache.set(key, ids, timeout)
+        return ids
+    ids = search()
+    if len(ids) <= getattr(settings, "VISOR_RESULT_CACHE_MAX_IDS", 250000):
+        cache.set_many(
+            {key: ids, unordered_key: sorted(set(ids))}, timeout
+        )
+    return ids
@@ -1,6 +1,4 @@
 import ast
-import warnings
-from collections import defaultdict
 from functools import reduce
 from itertools import chain
 from operator import or_
@@ -9,8 +7,8 @@ from django.core.paginator import Paginator
 from django.db import models
 from django.db.models import Q
 from dustgoggles.func import gmap
-from numpy import inf
 
+from visor import fulltext
 from visor.constants import WAVELENGTH_RANGES
 from visor.models import Sample, Library
 
@@ -21,22 +19,25 @@ def search_all_samples(entry: str) -> models.QuerySet:
     if len(query_set) == 0:
         return Sample.objects.all()
     result_set = Q()
+    # terms long enough for the full-text index (if we have one) go through
+    # it; see visor/fulltext.py
+    indexed = []
+    if fulltext.index_available():
+        indexed = [
+            query for query in query_set
+            if len(query) >= fulltext.MIN_TERM_LENGTH
+        ]
+        if indexed:
+            result_set &= Q(id__in=fulltext.matching_ids(indexed))
+    fields = fulltext.searched_fields(Sample, Sample.unprintable_fields)
     for query in query_set:
+        if query in indexed:
+            continue
         filter_list = Q()
-        queries = [
-            {field.name + "__icontains": query}
-            for field in Sample._meta.fields
-            if field.name not in list(Sample.unprintable_fields) + [
-                "origin",
-                "sample_type",
-                "min_wavelength",
-                "max_wavelength",
-                "date_added"
-            ]
-        ]
+        queries = [{field + "__icontains": query} for field in fields]
         queries += [
             {field + "__name__icontains": query}
-            for field in ["origin", "sample_type"]
+            for field in fulltext.RELATED_NAME_FIELDS
         ]
         for query_dict in queries:
             filter_list |= Q(**query_dict)
@@ -57,64 +58,26 @@ def wavelength_range_filter(form_results, wavelength_query):
     return form_results
 
 
-def make_grain_size_dicts(search_results):
-    values = search_results.values('grain_size', 'id')
-    nums, objs, unk = defaultdict(set), set(), set()
-    unknown = {'Unknown', 'Unspecified Particulate', ''}
-    for v in values:
-        # TODO: all this string manip should not be needed. db needs cleaning.
-        i, g = v['id'], v['grain_size'].replace("_", ",").replace("-", ",")
-        if "," in g and not g.startswith("("):
-            g = f"({g})"
-        if g.startswith("("):
-            tup = ast.literal_eval(g)
-            if quant := {g for g in tup if isinstance(g, float)}:
-                nums[i].update(quant)
-            if unknown.intersection(g):
-                unk.add(i)
-            elif "Whole Object" in g:
-                objs.add(i)
-        elif g in unknown:
-            unk.add(i)
-        elif g == "Whole Object":
-            objs.add(i)
-        elif g.replace('.', '').isnumeric():
-            nums[i].add(float(g))
-        else:
-            warnings.warn(f"invalid size string {g} for sample with pk {i}")
-    return nums, objs, unk
-
-def noneinf(x, ishigh=True):
-    if x is not None:
-        return x
-    if ishigh is True:
-        return inf
-    return -inf
-
-def match_num_ranges(nums, size_ranges):
-    matches, use_range = set(), []
-    size_ranges = [(noneinf(a, False), noneinf(b)) for a, b in size_ranges]
-    for i, g in nums.items():
-        for size_range in size_ranges:
-            try:
-                if (min(g) >= size_range[0]) and (max(g) <= size_range[1]):
-                    matches.add(i)
-                    break
-            except ValueError:
-                continue
-    return matches
-
-
 def size_filter(search_results, sizes):
-    matches = set()
-    nums, objs, unk = make_grain_size_dicts(search_results)
-    if size_ranges := [t for t in sizes if isinstance(t, tuple)]:
-        matches.update(match_num_ranges(nums, size_ranges))
+    """
+    restrict search_results to samples whose grain size range lies within
+    any of the (min, max) tuples in sizes (None meaning unbounded), and/or
+    whole objects ("Whole Object" in sizes) and/or samples of unknown grain
+    size (None in sizes)
+    """
+    clauses = []
+    for size_range in [t for t in sizes if isinstance(t, tuple)]:
+        clause = Q(grain_size_min__isnull=False)
+        if size_range[0] is not None:
+            clause &= Q(grain_size_min__gte=size_range[0])
+        if size_range[1] is not None:
+            clause &= Q(grain_size_max__lte=size_range[1])
+        clauses.append(clause)
     if "Whole Object" in sizes:
-        matches.update(objs)
+        clauses.append(Q(grain_size_category="whole object"))
     if None in sizes:
-        matches.update(unk)
-    return search_results.filter(id__in=matches)
+        clauses.append(Q(grain_size_category="unknown"))
+    return search_results.filter(reduce(or_, clauses, Q(pk__in=[])))
 
 
 def qual_field_filter(field, entry, search_results):
@@ -146,7 +109,9 @@ def qual_field_filter(field, entry, search_results):
     return search_results
 
 
-def paginate_results(request, search_results):
+def paginate_results(
+    request, search_results, paginator_class=Paginator, **paginator_kwargs
+):
     # Allow user to specify results per page
     if "update-page-size" in request.GET or "results-per-page" in request.GET:
         try:
@@ -157,7 +122,9 @@ def paginate_results(request, search_results):
     else:
         results_per_page = 15
     
-    paginator = Paginator(search_results, results_per_page)
+    paginator = paginator_class(
+        search_results, results_per_page, **paginator_kwargs
+    )
     if "jump-button" in request.GET:
         page_selected = max(1, int(request.GET.get("jump-to-page")))
         page_selected = min(paginator.num_pages, page_selected)
@@ -166,6 +133,12 @@ def paginate_results(request, search_results):
     else:
         page_selected = int(request.GET.get("page_selected", 1))
     page_results = paginator.page(page_selected)
+    if isinstance(search_results, list):
+        # a page of a list of pks: fetch just this page's Samples
+        samples = Sample.objects.in_bulk(list(page_results.object_list))
+        page_results.object_list = [
+            samples[pk] for pk in page_results.object_list if pk in samples
+        ]
     page_choices = range(
         max(1, page_selected - 6),
         min(page_selected + 6, paginator.num_pages+1), # Requested to display last partially full page
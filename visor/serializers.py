@@ -0,0 +1,203 @@
+"""
+bulk serialization of Samples for the browser. brief_dicts() builds the
+same dicts as Sample.as_json(brief=True) -- what visor_graph.js and the
+results and inventory tables consume -- for any number of Samples in two
+queries, rather than two or more per Sample. graph_dicts() adds what the
+graph view plots: reflectance, decimated for plotting, and simulated
+spectra, read straight from their packed binary columns. graph_buffer()
+packs the same data into a compact binary format for the graph page.
+"""
+from collections import defaultdict
+import json
+import struct
+from typing import Any, Collection, Iterable, Optional, Union
+
+from django.db import models
+import numpy as np
+
+from visor.compiled import compiled_filtersets
+from visor.models import Sample, SampleType, SimulatedSpectrum
+from visor.packing import reflectance_array, unpack_array
+from visor.spectral import decimate_spectrum
+
+try:
+    import orjson
+except ImportError:  # optional; the standard library encoder is fine
+    orjson = None
+
+# format version of graph_buffer() output
+BUFFER_VERSION = 1
+# as_json() adds keys in model field order, with wavelength_range right
+# after the first one
+BRIEF_FIELDS = tuple(
+    field.name
+    for field in Sample._meta.get_fields()
+    if field.name in Sample.brief_fields
+)
+
+
+def dumps(obj: Any) -> str:
+    """encode obj as JSON, with orjson if it's installed"""
+    if orjson is not None:
+        # reflectance and simulated spectra are keyed by float wavelength
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode()
+    return json.dumps(obj)
+
+
+def brief_dicts(
+    samples: Union[models.QuerySet, Iterable[int]]
+) -> list[dict]:
+    """
+    Sample.as_json(brief=True) for each of samples, a Sample queryset or
+    pks. the dicts are in the order of samples; pks of nonexistent Samples
+    are skipped.
+    """
+    if isinstance(samples, models.QuerySet):
+        pks = list(samples.values_list("id", flat=True))
+    else:
+        pks = list(samples)
+    queryset = Sample.objects.filter(id__in=pks)
+    rows = {
+        row["id"]: row
+        for row in queryset.values(
+            "id",
+            "sample_id",
+            "sample_name",
+            "grain_size",
+            "view_geom",
+            "min_wavelength",
+            "max_wavelength",
+            origin_name=models.F("origin__name"),
+        )
+    }
+    types = defaultdict(list)
+    through = Sample.sample_type.through.objects.using(queryset.db).filter(
+        sample_id__in=pks
+    )
+    # SampleType's default ordering, as sample_type.all() would give
+    for sample_id, name in through.order_by(
+        *[f"sampletype__{field}" for field in SampleType._meta.ordering]
+    ).values_list("sample_id", "sampletype__name"):
+        types[sample_id].append(name)
+    briefs = []
+    for pk in pks:
+        if pk not in rows:
+            continue
+        row = rows[pk]
+        values = row | {
+            "origin": row["origin_name"], "sample_type": types[pk]
+        }
+        brief = {}
+        for name in BRIEF_FIELDS:
+            # as_json() tests the Database and the sample_type manager for
+            # truth, not their names, so these are always included
+            related = name in ("origin", "sample_type")
+            if not related and not values[name]:
+                continue
+            brief[name] = values[name]
+            brief["wavelength_range"] = (
+                f"{row['min_wavelength']}-{row['max_wavelength']}"
+            )
+        briefs.append(brief)
+    return briefs
+
+
+def _graph_data(
+    samples: Union[models.QuerySet, Iterable[int]],
+    filtersets: Optional[Collection[str]],
+    points: Optional[int],
+) -> tuple[list[dict], dict[int, np.ndarray]]:
+    """
+    brief_dicts(samples) with simulated spectra added, and (wavelength,
+    reflectance) arrays by pk
+    """
+    briefs = brief_dicts(samples)
+    pks = [brief["id"] for brief in briefs]
+    reflectance = {}
+    for pk, packed, text in Sample.objects.filter(id__in=pks).values_list(
+        "id", "reflectance_packed", "reflectance"
+    ):
+        array = reflectance_array(packed, text)
+        if points is not None:
+            array = decimate_spectrum(array, points)
+        reflectance[pk] = array
+    compiled = {
+        c.short_name: c
+        for c in compiled_filtersets()
+        if filtersets is None or c.short_name in filtersets
+    }
+    simulated = defaultdict(dict)
+    simulations = SimulatedSpectrum.objects.filter(
+        sample_id__in=pks, filterset__in=list(compiled)
+    ).order_by("filterset")
+    for pk, short_name, responses in simulations.values_list(
+        "sample_id", "filterset", "responses"
+    ):
+        filterset = compiled[short_name]
+        responses = unpack_array(responses)[:, 0]
+        # stale simulation of a since-modified filterset; skipped, as in
+        # Sample.simulated_frames()
+        if len(responses) != len(filterset.names):
+            continue
+        simulated[pk][short_name] = dict(
+            zip(filterset.frame_wavelengths.tolist(), responses.tolist())
+        )
+    briefs = [
+        brief | simulated[brief["id"]]
+        for brief in briefs
+        if brief["id"] in reflectance
+    ]
+    return briefs, reflectance
+
+
+def graph_dicts(
+    samples: Union[models.QuerySet, Iterable[int]],
+    filtersets: Optional[Collection[str]] = None,
+    points: Optional[int] = None,
+) -> list[dict]:
+    """
+    brief_dicts(samples), plus each Sample's reflectance and its simulated
+    spectra for filtersets (default all), formatted as in Sample.as_json().
+    if points is not None, reflectance is decimated to about that many
+    points with visor.spectral.decimate_spectrum().
+    """
+    briefs, reflectance = _graph_data(samples, filtersets, points)
+    return [
+        brief | {"reflectance": dict(reflectance[brief["id"]].tolist())}
+        for brief in briefs
+    ]
+
+
+def graph_buffer(
+    samples: Union[models.QuerySet, Iterable[int]],
+    filtersets: Optional[Collection[str]] = None,
+    points: Optional[int] = None,
+) -> bytes:
+    """
+    the same data as graph_dicts(), packed for static_dev/js/spectra.js: a
+    little-endian uint32 giving the length of a UTF-8 JSON header, the
+    header, padded with spaces to a multiple of 4 bytes, and then each
+    Sample's wavelengths followed by its reflectance as little-endian
+    float32. the
+    header holds a format version, the graph_dicts() entries without
+    reflectance ("samples"), and the id, offset (in float32 values from
+    the start of the data) and length of each spectrum ("spectra").
+    """
+    briefs, reflectance = _graph_data(samples, filtersets, points)
+    spectra, offset = [], 0
+    for brief in briefs:
+        length = len(reflectance[brief["id"]])
+        spectra.append(
+            {"id": brief["id"], "offset": offset, "length": length}
+        )
+        offset += 2 * length
+    header = dumps(
+        {"version": BUFFER_VERSION, "samples": briefs, "spectra": spectra}
+    ).encode()
+    # JSON allows trailing whitespace, so pad with spaces
+    header += b" " * (-(len(header) + 4) % 4)
+    data = np.concatenate(
+        [reflectance[brief["id"]].T.ravel() for brief in briefs]
+        or [np.empty(0)]
+    ).astype("<f4")
+    return struct.pack("<I", len(header)) + header + data.tobytes()
@@ -0,0 +1,134 @@
+"""
+signal receivers that keep VISOR's derived, cached representations of the
+database in step with it. connected in visorConfig.ready().
+"""
+from django.db import router, transaction
+from django.db.models.signals import (
+    m2m_changed, post_delete, post_save, pre_delete
+)
+from django.dispatch import receiver
+
+from visor import compiled, cube, fulltext, neighbors, result_cache
+from visor.dj_utils import make_choice_list
+from visor.models import (
+    Database, FilterSet, Sample, SampleType, SimulatedSpectrum
+)
+
+
+@receiver(post_save, sender=FilterSet)
+@receiver(post_delete, sender=FilterSet)
+def invalidate_compiled_filterset(sender, instance, **kwargs):
+    compiled.invalidate(instance.pk)
+    # layouts are keyed by content hash, so this just frees stale ones
+    transaction.on_commit(
+        compiled.shared_filter_layout.invalidate,
+        using=router.db_for_write(sender),
+    )
+
+
+@receiver(post_delete, sender=FilterSet)
+def delete_simulations(sender, instance, **kwargs):
+    SimulatedSpectrum.objects.filter(filterset=instance.short_name).delete()
+
+
+@receiver(post_save, sender=Sample)
+def update_cube(sender, instance, **kwargs):
+    if cube.cube_exists():
+        transaction.on_commit(
+            lambda: cube.update_cube([instance]),
+            using=router.db_for_write(Sample),
+        )
+
+
+@receiver(post_delete, sender=Sample)
+def remove_from_cube(sender, instance, **kwargs):
+    if cube.cube_exists():
+        pk = instance.pk
+        transaction.on_commit(
+            lambda: cube.remove_from_cube([pk]),
+            using=router.db_for_write(Sample),
+        )
+
+
+@receiver(post_delete, sender=Sample)
+def discard_from_neighbor_indexes(sender, instance, **kwargs):
+    neighbors.discard_sample(instance.pk)
+
+
+def _on_spectra_commit(func):
+    transaction.on_commit(func, using=router.db_for_write(Sample))
+
+
+@receiver(post_save, sender=Sample)
+def index_sample(sender, instance, **kwargs):
+    pk = instance.pk
+    _on_spectra_commit(lambda: fulltext.index_samples([pk]))
+
+
+@receiver(post_delete, sender=Sample)
+def unindex_sample(sender, instance, **kwargs):
+    pk = instance.pk
+    _on_spectra_commit(lambda: fulltext.unindex_samples([pk]))
+
+
+@receiver(m2m_changed, sender=Sample.sample_type.through)
+def index_sample_types(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return
+    if reverse is False:
+        pks = [instance.pk]
+    elif pk_set is not None:
+        pks = list(pk_set)
+    else:
+        # a SampleType's samples were cleared; we don't know which they were
+        _on_spectra_commit(fulltext.rebuild_index)
+        return
+    _on_spectra_commit(lambda: fulltext.index_samples(pks))
+
+
+@receiver(post_save, sender=Database)
+@receiver(post_save, sender=SampleType)
+def index_related_samples(sender, instance, created, **kwargs):
+    # a new row can't be referred to by any Sample yet
+    if created:
+        return
+    if sender is Database:
+        samples = Sample.objects.filter(origin=instance)
+    else:
+        samples = Sample.objects.filter(sample_type=instance)
+    pks = list(samples.values_list("id", flat=True))
+    _on_spectra_commit(lambda: fulltext.index_samples(pks))
+
+
+@receiver(pre_delete, sender=SampleType)
+def index_orphaned_samples(sender, instance, **kwargs):
+    # deleting a SampleType removes its m2m rows without sending
+    # m2m_changed, so remember its samples and reindex them afterwards
+    pks = list(
+        Sample.objects.filter(sample_type=instance).values_list(
+            "id", flat=True
+        )
+    )
+    _on_spectra_commit(lambda: fulltext.index_samples(pks))
+
+
+@receiver(post_save, sender=Sample)
+@receiver(post_delete, sender=Sample)
+@receiver(post_save, sender=Database)
+@receiver(post_delete, sender=Database)
+@receiver(post_save, sender=SampleType)
+@receiver(post_delete, sender=SampleType)
+@receiver(m2m_changed, sender=Sample.sample_type.through)
+def invalidate_search_results(sender, **kwargs):
+    _on_spectra_commit(result_cache.bump_library_version)
+
+
+@receiver(post_save, sender=Database)
+@receiver(post_delete, sender=Database)
+@receiver(post_save, sender=SampleType)
+@receiver(post_delete, sender=SampleType)
+def invalidate_choice_lists(sender, **kwargs):
+    # after commit, so that no other process re-memoizes the old choices
+    transaction.on_commit(
+        make_choice_list.invalidate, using=router.db_for_write(sender)
+    )
@@ -0,0 +1,222 @@
+"""
+spectral similarity search against the spectral cube (see visor/cube.py).
+every metric is computed only over the wavelength range a library spectrum
+shares with the query spectrum. the masked sums all metrics need are
+matrix-vector products over chunks of the cube, so a search never touches
+the ORM except to choose candidates.
+"""
+from typing import Collection, Optional, Union, IO
+
+from django.conf import settings
+from django.db import models
+import numpy as np
+import pandas as pd
+
+from visor.cube import SpectralCube, get_cube, resample
+from visor.io._steps import (
+    flip_and_strip_whitespace, split_data_and_metadata
+)
+from visor.models import Sample
+
+# metric name: True if larger scores are better matches
+METRICS = {"angle": False, "euclidean": False, "correlation": True}
+
+
+def _masked_sums(
+    values: np.ndarray,
+    coverage: np.ndarray,
+    query: np.ndarray,
+    mask: np.ndarray,
+) -> dict[str, np.ndarray]:
+    """
+    sums over each row's overlap with the query, in float32 (single
+    precision BLAS is several times faster than double on these sizes).
+    values are 0 outside coverage, and query is 0 outside mask, so products
+    with the query (or the query mask) are already restricted to the
+    overlap.
+    """
+    mask = mask.astype(np.float32)
+    query = query.astype(np.float32)
+    from_values = values @ np.stack([mask, query], axis=1)
+    from_coverage = coverage.astype(np.float32) @ np.stack(
+        [mask, query, query * query], axis=1
+    )
+    return {
+        "n": from_coverage[:, 0],
+        "x": from_values[:, 0],
+        "xx": (values * values) @ mask,
+        "q": from_coverage[:, 1],
+        "qq": from_coverage[:, 2],
+        "xq": from_values[:, 1],
+    }
+
+
+def _exact_sums(
+    values: np.ndarray,
+    coverage: np.ndarray,
+    query: np.ndarray,
+    mask: np.ndarray,
+) -> dict[str, np.ndarray]:
+    """
+    double-precision version of _masked_sums for a handful of rows, also
+    giving the summed squared difference directly, which avoids the
+    cancellation in xx - 2xq + qq for near-identical spectra
+    """
+    overlap = (coverage & mask).astype(np.float64)
+    values = values.astype(np.float64) * overlap
+    queries = query * overlap
+    return {
+        "n": overlap.sum(axis=1),
+        "x": values.sum(axis=1),
+        "xx": (values * values).sum(axis=1),
+        "q": queries.sum(axis=1),
+        "qq": (queries * queries).sum(axis=1),
+        "xq": (values * queries).sum(axis=1),
+        "dd": ((values - queries) ** 2).sum(axis=1),
+    }
+
+
+def _score(sums: dict[str, np.ndarray], metric: str) -> np.ndarray:
+    n = np.maximum(sums["n"], 1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        if metric == "angle":
+            cosine = sums["xq"] / np.sqrt(sums["xx"] * sums["qq"])
+            return np.arccos(np.clip(cosine, -1, 1))
+        if metric == "euclidean":
+            # root-mean-square difference, so that spectra with different
+            # amounts of overlap are comparable
+            if "dd" in sums:
+                square = sums["dd"]
+            else:
+                square = sums["xx"] - 2 * sums["xq"] + sums["qq"]
+            return np.sqrt(np.maximum(square, 0) / n)
+        if metric == "correlation":
+            covariance = n * sums["xq"] - sums["x"] * sums["q"]
+            variance = (n * sums["xx"] - sums["x"] ** 2) * (
+                n * sums["qq"] - sums["q"] ** 2
+            )
+            return covariance / np.sqrt(variance)
+    raise ValueError(f"unknown metric {metric}")
+
+
+def _best(scores: np.ndarray, count: int, larger_is_better: bool):
+    """indices of the count best scores, best first"""
+    keys = -scores if larger_is_better else scores
+    if len(keys) > count:
+        top = np.argpartition(keys, count)[:count]
+        return top[np.argsort(keys[top])]
+    return np.argsort(keys)
+
+
+def query_spectrum(
+    query: Union[Sample, int, np.ndarray], cube: SpectralCube
+) -> tuple[np.ndarray, np.ndarray]:
+    """resample a Sample, Sample pk, or (wavelength, reflectance) array"""
+    if isinstance(query, (int, np.integer)):
+        query = Sample.objects.get(pk=query)
+    if isinstance(query, Sample):
+        query = query.data_array
+    query = np.asarray(query, dtype=np.float64)
+    query = query[np.argsort(query[:, 0])]
+    values, mask = resample(query, cube.grid)
+    return values.astype(np.float64), mask
+
+
+def similar_spectra(
+    query: Union[Sample, int, np.ndarray],
+    candidates: Optional[Union[models.QuerySet, Collection[int]]] = None,
+    metric: str = "angle",
+    k: int = 10,
+    released_only: bool = False,
+    min_overlap: Optional[float] = None,
+    chunk_size: int = 8192,
+) -> list[dict]:
+    """
+    find the k library spectra most similar to query. candidates may be a
+    Sample queryset (e.g. the output of perform_search_from_form) or
+    collection of pks; by default, every spectrum in the cube is a
+    candidate. if query is a Sample (or pk), it is excluded from the
+    results. min_overlap is the minimum shared wavelength range in nm
+    (default settings.VISOR_SIMILARITY_MIN_OVERLAP).
+
+    returns a list of dicts with keys "id", "score" and "overlap" (shared
+    range in nm), best match first.
+    """
+    if metric not in METRICS:
+        raise ValueError(
+            f"unknown metric {metric}; choose from {list(METRICS)}"
+        )
+    cube = get_cube()
+    exclude = None
+    if isinstance(query, Sample):
+        exclude = query.pk
+    elif isinstance(query, (int, np.integer)):
+        exclude = int(query)
+    values, mask = query_spectrum(query, cube)
+    if isinstance(candidates, models.QuerySet):
+        candidates = candidates.values_list("id", flat=True)
+    if candidates is None:
+        occupied = cube.ids != 0
+        if released_only is True:
+            occupied &= cube.released
+        rows = np.flatnonzero(occupied)
+    else:
+        # in cube order, so that chunks read the cube sequentially
+        rows = np.sort(cube.rows_for(candidates))
+        if released_only is True:
+            rows = rows[cube.released[rows]]
+    if exclude is not None and exclude in cube.index:
+        rows = rows[rows != cube.index[exclude]]
+    if min_overlap is None:
+        min_overlap = getattr(settings, "VISOR_SIMILARITY_MIN_OVERLAP", 50)
+    step = cube.grid[1] - cube.grid[0]
+    min_bins = max(int(np.ceil(min_overlap / step)) + 1, 2)
+    larger_is_better = METRICS[metric]
+    # screen every candidate in single precision, keeping a shortlist
+    # comfortably longer than k, then rescore the shortlist exactly
+    shortlist = k + max(k, 32)
+    best_rows = []
+    for chunk, chunk_values, chunk_coverage in cube.chunks(rows, chunk_size):
+        sums = _masked_sums(chunk_values, chunk_coverage, values, mask)
+        scores = _score(sums, metric)
+        keep = (sums["n"] >= min_bins) & np.isfinite(scores)
+        chunk, scores = chunk[keep], scores[keep]
+        best_rows.append(chunk[_best(scores, shortlist, larger_is_better)])
+    if len(best_rows) == 0:
+        return []
+    rows = np.sort(np.concatenate(best_rows))
+    sums = _exact_sums(cube.values[rows], cube.coverage[rows], values, mask)
+    scores = _score(sums, metric)
+    keep = (sums["n"] >= min_bins) & np.isfinite(scores)
+    rows, scores, overlap = rows[keep], scores[keep], sums["n"][keep]
+    order = _best(scores, k, larger_is_better)
+    return [
+        {
+            "id": int(cube.ids[row]),
+            "score": float(score),
+            "overlap": float((n - 1) * step),
+        }
+        for row, score, n in zip(rows[order], scores[order], overlap[order])
+    ]
+
+
+def read_spectrum_csv(csv_file: Union[str, IO]) -> np.ndarray:
+    """
+    read a (wavelength, reflectance) array from an uploaded CSV file: either
+    a VISOR-format sample CSV (metadata, then a 'Wavelength' separator row,
+    then data) or just two columns of numbers, with or without a header.
+    """
+    csv_in = pd.read_csv(csv_file, header=None, dtype=str)
+    csv_in = flip_and_strip_whitespace(csv_in)
+    if (csv_in[0] == "Wavelength").any():
+        data_frame, _, _, errors = split_data_and_metadata(
+            csv_in, getattr(csv_file, "name", str(csv_file)), [], []
+        )
+        if errors:
+            raise ValueError(" ".join(errors))
+    else:
+        data_frame = csv_in.apply(pd.to_numeric, errors="coerce")
+    array = data_frame.iloc[:, :2].astype(np.float64).dropna().to_numpy()
+    if len(array) < 2:
+        raise ValueError("couldn't find a spectrum in this file.")
+    return array[np.argsort(array[:, 0])]
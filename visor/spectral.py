@@ -1,6 +1,8 @@
 # utilities for interpreting and manipulating filter data
 
+import hashlib
 import json
+from typing import Optional, Sequence, Union
 
 import numpy as np
 import pandas as pd
@@ -57,7 +59,12 @@ def simulate_spectrum(
     # in the filterset's full responsivity curves.
     # treat these interpolated reflectance values as target radiance
     if filterset.resample_only is True:
-        filter_bins = np.array(filterset.filter_centers)[:, 1]
+        # note: the centers must be cast to float before sorting, or they
+        # sort lexicographically (np.array() of name/center pairs is a
+        # string array) and get paired with the wrong filters
+        filter_bins = np.array(
+            [center for _, center in filterset.filter_centers], dtype=float
+        )
         filter_bins.sort()
     else:
         filter_bins = filterset.wave_array
@@ -97,6 +104,134 @@ def simulate_spectrum(
     return simulated_spectrum
 
 
+def filterset_hash(
+    filters: Optional[str],
+    wavelengths: Optional[str],
+    filter_wavelengths: str,
+    resample_only: bool,
+) -> str:
+    """hash of the FilterSet fields that affect simulation results"""
+    content = json.dumps(
+        [filters, wavelengths, filter_wavelengths, bool(resample_only)]
+    )
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+def trapezoid_weights(bins: np.ndarray) -> np.ndarray:
+    """
+    weights w such that w @ y is the trapezoidal integral of y over bins,
+    i.e. equivalent to integrate.trapezoid(y, bins).
+    """
+    widths = np.diff(bins) / 2
+    weights = np.zeros(len(bins))
+    weights[:-1] += widths
+    weights[1:] += widths
+    return weights
+
+
+def decimate_spectrum(array: np.ndarray, points: int) -> np.ndarray:
+    """
+    reduce a wavelength-sorted (wavelength, reflectance) array to at most
+    about `points` rows for plotting: its first and last rows, and the rows
+    with the lowest and highest reflectance in each of (points - 2) / 2
+    runs of consecutive rows in between. unlike taking every nth row, this
+    keeps narrow absorption features and spikes.
+    """
+    if points < 4 or len(array) <= points:
+        return array
+    inner = array[1:-1, 1]
+    buckets = (points - 2) // 2
+    edges = np.linspace(0, len(inner), buckets + 1).astype(int)
+    bucket = np.repeat(np.arange(buckets), np.diff(edges))
+    # sorted by bucket, then by reflectance, each bucket's first row is its
+    # minimum and its last row its maximum
+    order = np.lexsort((inner, bucket))
+    lowest, highest = order[edges[:-1]] + 1, order[edges[1:] - 1] + 1
+    keep = np.concatenate([[0], lowest, highest, [len(array) - 1]])
+    return array[np.unique(keep)]
+
+
+def filter_layout(filterset: "visor.models.FilterSet") -> dict:
+    """
+    precompute everything simulate_spectra needs to know about a filterset:
+    filter names and centers in output (wavelength-sorted) order, the bins
+    to interpolate samples onto, and -- unless the filterset is
+    resample-only -- a contiguous (filters x bins) responsivity matrix,
+    along with a copy multiplied by trapezoid weights, so that convolving
+    every filter is one matmul.
+    """
+    # sorted exactly as simulate_spectrum sorts its output frame
+    centers = pd.DataFrame(
+        filterset.filter_centers, columns=["filter", "wavelength"],
+    ).sort_values(["wavelength"])
+    layout = {
+        "names": centers["filter"].tolist(),
+        "centers": centers["wavelength"].to_numpy(dtype=float),
+        "resample_only": filterset.resample_only,
+    }
+    if filterset.resample_only is True:
+        layout["bins"] = np.sort(layout["centers"])
+        layout["responsivity"], layout["weighted"] = None, None
+        return layout
+    layout["bins"] = np.asarray(filterset.wave_array, dtype=float)
+    layout["responsivity"] = np.ascontiguousarray(
+        np.vstack([filterset.filterbank[name] for name in layout["names"]]),
+        dtype=float
+    )
+    layout["weighted"] = (
+        layout["responsivity"] * trapezoid_weights(layout["bins"])
+    )
+    return layout
+
+
+def simulate_spectra(
+    samples: Sequence[Union["visor.models.Sample", np.ndarray]],
+    filterset: Union[
+        "visor.models.FilterSet", "visor.compiled.CompiledFilterSet", dict
+    ],
+    chunk_size: int = 2048,
+) -> np.ndarray:
+    """
+    batch version of simulate_spectrum. takes a sequence of Samples (or of
+    their (n, 2) wavelength/reflectance arrays) and a FilterSet (or a layout
+    produced from one by filter_layout, or a CompiledFilterSet), and
+    returns an (samples x filters) array of responses with filters in the
+    same order as the 'filter' column of simulate_spectrum's output.
+    values match simulate_spectrum's up to floating-point summation order,
+    including its rule that filters centered outside a sample's wavelength
+    range have 0 response.
+    """
+    if isinstance(filterset, dict):
+        layout = filterset
+    elif hasattr(filterset, "layout"):
+        layout = filterset.layout
+    else:
+        layout = filter_layout(filterset)
+    bins, centers = layout["bins"], layout["centers"]
+    responses = np.zeros((len(samples), len(centers)))
+    for start in range(0, len(samples), chunk_size):
+        chunk = samples[start:start + chunk_size]
+        radiance = np.empty((len(chunk), len(bins)))
+        in_range = np.empty((len(chunk), len(centers)), dtype=bool)
+        for ix, sample in enumerate(chunk):
+            data = getattr(sample, "data_array", sample)
+            # same as interpolate_spectrum(), without building an
+            # interp1d object per sample
+            radiance[ix] = np.interp(
+                bins, data[:, 0], data[:, 1], left=0, right=0
+            )
+            in_range[ix] = (
+                (centers >= data[:, 0].min()) & (centers <= data[:, 0].max())
+            )
+        if layout["resample_only"] is True:
+            responses[start:start + len(chunk)] = radiance
+            continue
+        convolved = radiance @ layout["weighted"].T
+        convolved[~in_range] = 0
+        responses[start:start + len(chunk)] = convolved
+    return responses
+
+
 # noinspection PyUnresolvedReferences
 def make_filterset(
     name: str,
@@ -1,3 +1,127 @@
-from django.test import TestCase
+from random import randint
 
-# Create your tests here.
+from django.test import RequestFactory, SimpleTestCase
+
+from notetaking.lifecycle import segments, sweep
+from notetaking.memo import Memoized
+from notetaking.memutilz import attach_block
+from notetaking.notepad import Notepad
+from visor.inventory import NotepadStore
+from visor.memo import notepad_prefix
+from visor.notepads import kept
+
+
+def _prefixes() -> set[str]:
+    return {segment.prefix for segment in segments()}
+
+
+class StaleNotepadTests(SimpleTestCase):
+    """writes through handles opened before their notepad was swept"""
+
+    def setUp(self):
+        self.prefix = f"visor_test_{randint(100000, 999999)}"
+        self.addCleanup(self._close)
+
+    def _close(self):
+        try:
+            Notepad(self.prefix).close()
+        except FileNotFoundError:
+            pass
+
+    def _swept(self) -> Notepad:
+        stale = Notepad.open(self.prefix, cleanup_on_exit=False)
+        stale["x"] = 1
+        # sweep this notepad and no one else's
+        removed = sweep(ttl=-1, keep=_prefixes() - {self.prefix})
+        self.assertEqual([s.prefix for s in removed], [self.prefix])
+        return stale
+
+    def test_write_after_sweep_and_reopen(self):
+        stale = self._swept()
+        fresh = Notepad.open(self.prefix, cleanup_on_exit=False)
+        fresh["y"] = 2
+        stale["z"] = 3
+        # the write went to the reopened notepad rather than the swept
+        # one's orphaned index, so closing it leaves nothing behind
+        self.assertEqual(sorted(fresh.index()), ["y", "z"])
+        self.assertEqual(fresh["z"], 3)
+        self.assertEqual(sorted(stale.index()), ["y", "z"])
+        fresh.close()
+        self.assertNotIn(self.prefix, _prefixes())
+        with self.assertRaises(FileNotFoundError):
+            attach_block(f"{self.prefix}_z")
+
+    def test_write_after_sweep(self):
+        stale = self._swept()
+        with self.assertRaises(FileNotFoundError):
+            stale["z"] = 3
+        self.assertNotIn(self.prefix, _prefixes())
+
+
+class MemoSweepTests(SimpleTestCase):
+    """the memo notepad and the notepad sweeper"""
+
+    def setUp(self):
+        self.prefix = f"visor_test_memo_{randint(100000, 999999)}"
+        self.addCleanup(self._close)
+        self.calls = 0
+
+    def _close(self):
+        try:
+            Notepad(self.prefix).close()
+        except FileNotFoundError:
+            pass
+
+    def _count(self, x):
+        self.calls += 1
+        return x
+
+    def test_sweeps_keep_memo_notepad(self):
+        with self.settings(VISOR_MEMO_NOTEPAD=self.prefix):
+            memoized = Memoized(self._count, notepad_prefix)
+            memoized(1)
+            others = _prefixes() - {self.prefix}
+            sweep(ttl=-1, keep=others.union(kept()))
+            self.assertIn(self.prefix, _prefixes())
+            self.assertEqual(memoized(1), 1)
+        self.assertEqual(self.calls, 1)
+
+    def test_memo_reopens_after_sweep(self):
+        memoized = Memoized(self._count, self.prefix)
+        memoized(1)
+        sweep(ttl=-1, keep=_prefixes() - {self.prefix})
+        self.assertEqual(memoized(1), 1)
+        self.assertEqual(memoized(1), 1)
+        self.assertEqual(self.calls, 2)
+        self.assertIn(self.prefix, _prefixes())
+
+
+class NotepadStoreSweepTests(SimpleTestCase):
+    """a session's inventory notepad swept away mid-request"""
+
+    def setUp(self):
+        request = RequestFactory().get("/")
+        request.session = {"identifier": f"visor_test_{randint(0, 999999)}"}
+        self.store = NotepadStore(request)
+        self.addCleanup(self._close)
+
+    def _close(self):
+        try:
+            Notepad(self.store.prefix).close()
+        except FileNotFoundError:
+            pass
+
+    def _sweep(self):
+        sweep(ttl=-1, keep=_prefixes() - {self.store.prefix})
+        self.assertNotIn(self.store.prefix, _prefixes())
+
+    def test_read_after_sweep(self):
+        self.store.write({"inventory": [1]})
+        self._sweep()
+        self.assertEqual(self.store.read(), {})
+
+    def test_write_after_sweep(self):
+        self.store.write({"inventory": [1]})
+        self._sweep()
+        self.store.write({"inventory": [2]})
+        self.assertEqual(self.store.read(), {"inventory": [2]})
@@ -7,8 +7,12 @@ urlpatterns = [
     path('search/', views.search, name='search'),
     path(r'admin/', include('massadmin.urls')),
     re_path(r'^graph/$', views.graph, name='graph'),
+    re_path(r'^graph_data/$', views.graph_data, name='graph_data'),
+    re_path(r'^graph_binary/$', views.graph_binary, name='graph_binary'),
     re_path(r'^results/$', views.results, name='results'),
     re_path(r'^results/jump$', views.results, name='results_jump'),
+    re_path(r'^similar/$', views.similar, name='similar'),
+    re_path(r'^roi_match/$', views.roi_match, name='roi_match'),
     re_path(r'^export/$', views.export, name='export'),
     re_path(r'^bulk_export/$', views.bulk_export, name='bulk_export'),
     re_path(r'^meta/$', views.meta, name='meta'),
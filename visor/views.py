@@ -1,25 +1,35 @@
-import sys
 from functools import reduce
-import json
 import logging
 from operator import or_
-from pathlib import Path
-import random
 from typing import TYPE_CHECKING
+from urllib.parse import urlencode
 
+from django.conf import settings
 from django.http import HttpResponse
 from django.shortcuts import render
 from django.views.decorators.cache import never_cache
+from django.views.decorators.gzip import gzip_page
+from django.views.decorators.http import condition
+from marslab.compat.xcam import DERIVED_CAM_DICT
 
-from notetaking.notepad import Notepad
+from visor import http_caching
+from visor.inventory import (
+    commit_inventory, inventory_json, parse_ids, set_inventory
+)
 from visor.io import handlers
 from visor.search import (
     search_all_samples,
-    paginate_results,
     perform_search_from_form,
 )
 from visor.forms import concealed_search_factory
 from visor.models import Database, Sample, FilterSet
+from visor.io.observational import read_xcam_roi_file
+from visor.neighbors import match_roi
+from visor.pagination import paginate_search
+from visor.serializers import (
+    BUFFER_VERSION, brief_dicts, dumps, graph_buffer, graph_dicts
+)
+from visor.similarity import METRICS, read_spectrum_csv, similar_spectra
 
 if TYPE_CHECKING:
     from django.core.handlers.wsgi import WSGIRequest
@@ -27,80 +37,18 @@ if TYPE_CHECKING:
 logger = logging.getLogger("django")
 
 
-def ip(request):
-    # forwarded ip from server layer -- this specific property may only
-    # be populated by nginx
-    forwarded_ip = request.META.get('HTTP_X_REAL_IP')
-    if forwarded_ip is not None:
-        return forwarded_ip
-    return request.META.get('REMOTE_ADDR')
-
-
-def session_id(request):
-    address = ip(request)
-    if request.session.get('identifier') is None:
-        request.session[
-            'identifier'
-        ] = f"{address}_{random.randint(1000000, 9999999)}"
-        logger.warning(
-            f"started session with identifier "
-            f"{request.session['identifier']}"
-        )
-    return request.session['identifier']
-
-
-def get_inventory_id_json(request) -> str:
-    # TODO: this is a hack and I don't like it. come up with a
-    #  better solution, maybe.
-    if sys.platform in ('win32', 'cygwin', 'darwin'):
-        inv = Path("local_user_inventory.json")
-        if inv.exists():
-            return inv.read_text()
-        else:
-            inv.write_text("[]")
-            return "[]"
-    try:
-        user_notes = Notepad(session_id(request))
-    except FileNotFoundError:
-        user_notes = Notepad.open(session_id(request))
-        user_notes['inventory'] = "[]"
-    return user_notes['inventory']
-
-
-def set_inventory_id_json(request) -> None:
-    inventory_ids = request.GET.get("inventory")
-    # TODO: this is a hack and I don't like it. come up with a
-    #  better solution.
-    if sys.platform in ('win32', 'cygwin', 'darwin'):
-        inv = Path("local_user_inventory.json")
-        if not inv.exists():
-            inv.touch()
-        inv.write_text(inventory_ids)
-        return
-    try:
-        user_notes = Notepad(session_id(request))
-    except FileNotFoundError:
-        user_notes = Notepad.open(session_id(request))
-    user_notes['inventory'] = inventory_ids
-
-
-def load_inventory(inventory_id_json: str) -> str:
-    inventory_id_list = json.loads(inventory_id_json)
-    inventory_samples = Sample.objects.filter(id__in=inventory_id_list)
-    return json.dumps(
-        [sample.as_json(brief=True) for sample in inventory_samples]
-    )
-
-
 @never_cache
 def inventory_check(request):
-    return HttpResponse(load_inventory(get_inventory_id_json(request)))
+    return HttpResponse(inventory_json(request))
 
 
 @never_cache
 def inventory(request: "WSGIRequest") -> HttpResponse:
-    set_inventory_id_json(request)
-    return HttpResponse(status=204)
+    try:
+        set_inventory(request, parse_ids(request.GET.get("inventory")))
+    except (TypeError, ValueError) as ex:
+        return HttpResponse(str(ex), status=400)
+    return commit_inventory(request, HttpResponse(status=204))
 
 
 @never_cache
@@ -111,7 +59,7 @@ def search(request: "WSGIRequest") -> HttpResponse:
     page_params = {
         "search_formset": concealed_search_factory(request),
         "sample_json": "[]",
-        "inventory_json": load_inventory(get_inventory_id_json(request))
+        "inventory_json": inventory_json(request)
     }
     response = render(request, "search.html", page_params)
     return response
@@ -130,7 +78,7 @@ def no_results(request: "WSGIRequest") -> HttpResponse:
             "search_results": None,
             "search_formset": None,
             "sample_json": "[]",
-            "inventory_json": load_inventory(get_inventory_id_json(request))
+            "inventory_json": inventory_json(request)
         }
     )
     return response
@@ -157,28 +105,27 @@ def results(request: "WSGIRequest") -> HttpResponse:
         return no_results(request)
 
     sort_params = request.GET.getlist("sort_params", ["sample_name"])
-    search_results = Sample.objects.only(*Sample.searchable_fields, "view_geom")
     # hide unreleased samples from non-superusers
-    if not request.user.is_superuser:
-        search_results = search_results.filter(released=True)
-    # TODO, maybe: have a cache somewhere of search result IDs? harder to
-    #  deeplink. but it could be used iff the sort button was pressed? could
-    #  it live in shared memory on the backend somewhere?
-    # sort results, if this view function got accessed via a sort button
-    search_results = search_results.order_by(*sort_params)
-    # actually perform the search
-    search_results = perform_search_from_form(search_form, search_results)
+    released_only = not request.user.is_superuser
+
+    def search():
+        search_results = Sample.objects.all()
+        if released_only:
+            search_results = search_results.filter(released=True)
+        # sort results, if this view function got accessed via a sort button
+        search_results = search_results.order_by(*sort_params)
+        # actually perform the search
+        return perform_search_from_form(search_form, search_results)
+
+    # page flips and re-sorts of a recent search come from the result cache
+    page_choices, page_ids, page_results, result_count = paginate_search(
+        request, search_form.cleaned_data, sort_params, released_only, search
+    )
     # Todo: when does this happen?
     selections = get_selections(request)
     selected_spectra = Sample.objects.filter(id__in=selections)
     selected_list = [v[0] for v in selected_spectra.values_list('id')]
-    search_results_id_list = [v[0] for v in search_results.values_list('id')]
-    page_choices, page_ids, page_results = paginate_results(
-        request, search_results
-    )
-    sample_json = json.dumps(
-        [sample.as_json(brief=True) for sample in page_results.object_list]
-    )
+    sample_json = dumps(brief_dicts(page_ids))
     response = render(
         request,
         "results.html",
@@ -189,14 +136,142 @@ def results(request: "WSGIRequest") -> HttpResponse:
             "page_choices": page_choices,
             "page_results": page_results,
             "sample_json": sample_json,
-            "inventory_json": load_inventory(get_inventory_id_json(request)),
-            "search_results": search_results_id_list,
+            "inventory_json": inventory_json(request),
+            "search_results": result_count,
             "sort_params": sort_params,
         }
     )
     return response
 
 
+@never_cache
+def similar(request: "WSGIRequest") -> HttpResponse:
+    """
+    JSON list of the library spectra most similar to a Sample (parameter
+    'sample', a pk) or to an uploaded CSV spectrum (POSTed file 'spectrum'),
+    optionally restricted by the same search form parameters results()
+    accepts. 'metric' is one of visor.similarity.METRICS; 'k' is the number
+    of matches to return.
+    """
+    params = request.POST if request.method == "POST" else request.GET
+    metric = params.get("metric", "angle")
+    if metric not in METRICS:
+        return HttpResponse(f"unknown metric {metric}", status=400)
+    try:
+        k = max(1, min(int(params.get("k", 10)), 500))
+    except ValueError:
+        return HttpResponse("k must be an integer", status=400)
+    if "spectrum" in request.FILES:
+        try:
+            query = read_spectrum_csv(request.FILES["spectrum"])
+        except ValueError as ex:
+            return HttpResponse(str(ex), status=400)
+    elif "sample" in params:
+        query = Sample.objects.filter(pk=params["sample"]).first()
+        if query is None or (
+            not query.released and not request.user.is_superuser
+        ):
+            return HttpResponse(status=404)
+    else:
+        return HttpResponse(status=204)
+    released_only = not request.user.is_superuser
+    # only touch the ORM for candidates if search criteria were given
+    candidates = None
+    search_formset = concealed_search_factory(request)(params)
+    if search_formset.is_valid() and len(search_formset.forms) == 1:
+        candidates = Sample.objects.all()
+        if released_only:
+            candidates = candidates.filter(released=True)
+        candidates = perform_search_from_form(
+            search_formset.forms[0], candidates
+        )
+    try:
+        matches = similar_spectra(
+            query, candidates, metric, k, released_only=released_only
+        )
+    except FileNotFoundError:
+        return HttpResponse(
+            "similarity search is not available", status=503
+        )
+    briefs = {
+        brief["id"]: brief
+        for brief in brief_dicts([match["id"] for match in matches])
+    }
+    return HttpResponse(
+        dumps(
+            {
+                "metric": metric,
+                "results": [
+                    briefs[match["id"]] | match
+                    for match in matches
+                    if match["id"] in briefs
+                ],
+            }
+        ),
+        content_type="application/json",
+    )
+
+
+@never_cache
+def roi_match(request: "WSGIRequest") -> HttpResponse:
+    """
+    JSON lists of the samples whose simulated instrument responses best
+    match XCAM ROI spectra: either every row of a POSTed marslab file
+    ('roi'), or one ROI given as parameters ('instrument', e.g. ZCAM, plus
+    one parameter per filter, e.g. L1=0.21). optional parameters are
+    'filterset' (default: the instrument's own), 'k', and 'normalize'
+    ("False" to compare responses without scaling them to the ROI's
+    scaling filter pair).
+    """
+    params = request.POST if request.method == "POST" else request.GET
+    try:
+        k = max(1, min(int(params.get("k", 10)), 500))
+        if "roi" in request.FILES:
+            instrument, rois = read_xcam_roi_file(request.FILES["roi"])
+        elif "instrument" in params:
+            instrument = params["instrument"]
+            spectrum = {
+                filt: float(params[filt])
+                for filt in DERIVED_CAM_DICT[instrument]["filters"]
+                if params.get(filt, "") != ""
+            }
+            rois = [({}, spectrum)]
+        else:
+            return HttpResponse(status=204)
+    except (KeyError, ValueError) as ex:
+        return HttpResponse(f"couldn't read ROI: {ex}", status=400)
+    matches = []
+    for metadata, spectrum in rois:
+        try:
+            found = match_roi(
+                instrument,
+                spectrum,
+                params.get("filterset"),
+                k,
+                normalize=params.get("normalize", "True") != "False",
+                released_only=not request.user.is_superuser,
+            )
+        except (KeyError, ValueError) as ex:
+            return HttpResponse(str(ex), status=400)
+        briefs = {
+            brief["id"]: brief
+            for brief in brief_dicts([match["id"] for match in found])
+        }
+        matches.append(
+            {
+                "roi": {
+                    key: str(value) for key, value in metadata.items()
+                },
+                "results": [
+                    briefs[match["id"]] | match
+                    for match in found
+                    if match["id"] in briefs
+                ],
+            }
+        )
+    return HttpResponse(dumps(matches), content_type="application/json")
+
+
 def get_selections(request):
     try:
         selection_key = next(
@@ -218,11 +293,23 @@ def graph(request, template="graph.html") -> HttpResponse:
 
     search_formset = concealed_search_factory(request)(request.GET)
     samples = Sample.objects.filter(id__in=selections)
-    # Don't try to graph more than 50 samples at a time
-    num_samples = samples.count()
-    if num_samples > 50:
-        return HttpResponse("Cannot graph more than 50 samples at once", status=400)
-    sample_json = json.dumps([sample.as_json() for sample in samples])
+    max_samples = getattr(settings, "VISOR_GRAPH_MAX_SAMPLES", 500)
+    if samples.count() > max_samples:
+        return HttpResponse(
+            f"Cannot graph more than {max_samples} samples at once",
+            status=400,
+        )
+    # spectra are fetched separately, in binary, once the page has loaded
+    sample_json = dumps(brief_dicts(samples))
+    pks = sorted(samples.values_list("id", flat=True))
+    points = getattr(settings, "VISOR_GRAPH_POINTS", 2000)
+    # versioned, so that browsers can cache the spectra until they change
+    version = http_caching.data_version(
+        _visible_samples(request, pks), None, (points, BUFFER_VERSION)
+    )
+    spectra_url = "/visor/graph_binary/?" + urlencode(
+        {"ids": ",".join(map(str, pks)), "points": points, "v": version}
+    )
     filtersets = [
         filterset.short_name
         for filterset in FilterSet.objects.all().order_by("display_order")
@@ -234,13 +321,118 @@ def graph(request, template="graph.html") -> HttpResponse:
             "selected_ids": selections,
             "graphResults": samples,
             "sample_json": sample_json,
-            "inventory_json": load_inventory(get_inventory_id_json(request)),
+            "spectra_url": spectra_url,
+            "inventory_json": inventory_json(request),
             "search_formset": search_formset,
             "filtersets": filtersets,
         }
     )
 
 
+def _graph_query(request: "WSGIRequest"):
+    """
+    the Samples, filtersets and point count requested of graph_data or
+    graph_binary, or an error response
+    """
+    ids = [
+        pk
+        for value in request.GET.getlist("ids")
+        for pk in value.split(",")
+        if pk.strip() != ""
+    ]
+    try:
+        ids = [int(pk) for pk in ids]
+        points = int(
+            request.GET.get(
+                "points", getattr(settings, "VISOR_GRAPH_POINTS", 2000)
+            )
+        )
+    except ValueError:
+        return HttpResponse("ids and points must be integers", status=400)
+    max_samples = getattr(settings, "VISOR_GRAPH_MAX_SAMPLES", 500)
+    if len(ids) > max_samples:
+        return HttpResponse(
+            f"Cannot graph more than {max_samples} samples at once",
+            status=400,
+        )
+    filtersets = request.GET.getlist("filterset") or None
+    return (
+        _visible_samples(request, ids),
+        filtersets,
+        points if points > 0 else None,
+    )
+
+
+def _visible_samples(request: "WSGIRequest", ids):
+    samples = Sample.objects.filter(id__in=ids)
+    # hide unreleased samples from non-superusers
+    if not request.user.is_superuser:
+        samples = samples.filter(released=True)
+    return samples
+
+
+def _graph_state(request: "WSGIRequest"):
+    """
+    _graph_query(request), and the version and last modification time of
+    the data it selects (or Nones, for an error response). computed once
+    per request, since the ETag, Last-Modified and the response all need
+    them.
+    """
+    if not hasattr(request, "_visor_graph_state"):
+        query = _graph_query(request)
+        if isinstance(query, HttpResponse):
+            version, latest = None, None
+        else:
+            samples, filtersets, points = query
+            version, latest = http_caching.data_state(
+                samples, filtersets, (points, BUFFER_VERSION)
+            )
+        request._visor_graph_state = (query, version, latest)
+    return request._visor_graph_state
+
+
+def _graph_version(request: "WSGIRequest", *args, **kwargs):
+    return _graph_state(request)[1]
+
+
+def _graph_last_modified(request: "WSGIRequest", *args, **kwargs):
+    return _graph_state(request)[2]
+
+
+@condition(_graph_version, _graph_last_modified)
+def graph_data(request: "WSGIRequest") -> HttpResponse:
+    """
+    JSON plot data for the Samples with pks given by the 'ids' parameter
+    (repeated, or comma-separated): each Sample's brief JSON, reflectance
+    decimated to about 'points' points (default
+    settings.VISOR_GRAPH_POINTS; 0 for full resolution), and its simulated
+    spectra for the 'filterset' parameters (default all).
+    """
+    query, version, _ = _graph_state(request)
+    if isinstance(query, HttpResponse):
+        return query
+    response = HttpResponse(
+        dumps(graph_dicts(*query)), content_type="application/json"
+    )
+    return http_caching.patch_data_cache_control(request, response, version)
+
+
+@gzip_page
+@condition(_graph_version, _graph_last_modified)
+def graph_binary(request: "WSGIRequest") -> HttpResponse:
+    """
+    the data graph_data returns, with reflectance as float32 arrays (see
+    visor.serializers.graph_buffer). takes the same parameters.
+    """
+    query, version, _ = _graph_state(request)
+    if isinstance(query, HttpResponse):
+        return query
+    response = HttpResponse(
+        graph_buffer(*query), content_type="application/octet-stream"
+    )
+    return http_caching.patch_data_cache_control(request, response, version)
+
+
 @never_cache
 def meta(request: "WSGIRequest") -> HttpResponse:
     if request.method == "GET":
@@ -251,9 +443,7 @@ def meta(request: "WSGIRequest") -> HttpResponse:
         search_formset = concealed_search_factory(request)(request.GET)
         samples = Sample.objects.filter(id__in=selections)
         dictionaries = [obj.as_dict() for obj in samples]
-        sample_json = json.dumps(
-            [sample.as_json(brief=True) for sample in samples]
-        )
+        sample_json = dumps(brief_dicts(samples))
         response = render(
             request,
             "meta.html",
@@ -262,7 +452,7 @@ def meta(request: "WSGIRequest") -> HttpResponse:
                 "metaResults": samples,
                 "reflectancedict": dictionaries,
                 "sample_json": sample_json,
-                "inventory_json": load_inventory(get_inventory_id_json(request)),
+                "inventory_json": inventory_json(request),
             }
         )
         return response
@@ -141,3 +141,94 @@ STATICFILES_DIRS = [os.path.join(BASE_DIR, "static_dev")]
 SAMPLE_IMAGE_PATH = os.path.join(
     BASE_DIR, "static_dev/sample_images"
 )
+
+# VISOR-specific options
+
+# storage format for packed Sample reflectance arrays (see visor/packing.py).
+# "float32" halves storage at the cost of precision; "zlib" compression
+# trades decode speed for size.
+VISOR_REFLECTANCE_DTYPE = "float64"
+VISOR_REFLECTANCE_COMPRESSION = "none"
+
+# memory-mapped spectral cube (see visor/cube.py and the build_cube
+# management command): location, and wavelength grid as (start, stop, step)
+# in nm
+VISOR_CUBE_PATH = os.path.join(BASE_DIR, "data", "cube")
+VISOR_CUBE_GRID = (300, 2600, 5)
+
+# minimum shared wavelength range, in nm, for a library spectrum to be
+# considered in similarity searches (see visor/similarity.py)
+VISOR_SIMILARITY_MIN_OVERLAP = 50
+
+# instrument-space ROI matching (see visor/neighbors.py): how far, in nm, a
+# filter center may be from an ROI band center and still be compared to it;
+# how often each process checks the database for changed simulations; and
+# the fraction of changed rows at which an index's KD-trees are rebuilt
+VISOR_ROI_TOLERANCE = 10
+VISOR_NEIGHBORS_SYNC_INTERVAL = 2
+VISOR_NEIGHBORS_COMPACT_FRACTION = 0.05
+
+# search result cache (see visor/result_cache.py): ordered result pks of
+# recent searches, so that page flips and re-sorts don't repeat them. the
+# cache's TIMEOUT and MAX_ENTRIES bound the entries' age and number;
+# searches with more than VISOR_RESULT_CACHE_MAX_IDS results aren't cached.
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    "search_results": {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        "LOCATION": os.path.join(BASE_DIR, "data", "result_cache"),
+        "TIMEOUT": 900,
+        "OPTIONS": {"MAX_ENTRIES": 500},
+    },
+}
+VISOR_RESULT_CACHE = "search_results"
+VISOR_RESULT_CACHE_TIMEOUT = 900
+VISOR_RESULT_CACHE_MAX_IDS = 250000
+# cached searches are keyed by the library's state, which counts Samples
+# and finds the latest date_added to catch changes made outside Django;
+# each process repeats that query at most every VISOR_LIBRARY_STATE_TTL
+# seconds
+VISOR_LIBRARY_STATE_TTL = 30
+
+# how search results are paginated (see visor/pagination.py): "ids" pages
+# through cached lists of result ids; "keyset" seeks on the sort columns
+# and caches only result counts and page boundaries, which suits very large
+# result sets
+VISOR_PAGINATION = "ids"
+
+# graph view (and graph_data endpoint): most samples graphed at once, and
+# the number of points each reflectance spectrum is decimated to for
+# plotting
+VISOR_GRAPH_MAX_SAMPLES = 500
+VISOR_GRAPH_POINTS = 2000
+
+# where each session's inventory is kept (see visor/inventory.py):
+# "notepad" (shared memory; visible only to processes on one host), "file"
+# (one local file; single-user installations only), "session" (the Django
+# session, stored per SESSION_ENGINE) or "cookie" (a signed cookie). use
+# "session" or "cookie" to serve from several hosts without sticky
+# sessions. None picks "file" on Windows and MacOS, "notepad" elsewhere.
+# inventories are limited to VISOR_INVENTORY_MAX_SAMPLES samples.
+VISOR_INVENTORY_BACKEND = None
+VISOR_INVENTORY_MAX_SAMPLES = 5000
+
+# lifetime of "notepad" inventory segments in shared memory (see
+# visor/notepads.py): each serving process sweeps every
+# VISOR_NOTEPAD_SWEEP_INTERVAL seconds (None to disable; the sweep_notepads
+# management command does the same once), removing notepads idle for more
+# than VISOR_NOTEPAD_TTL seconds, then the least recently used until the
+# rest total at most VISOR_NOTEPAD_MAX_BYTES
+VISOR_NOTEPAD_SWEEP_INTERVAL = 300
+VISOR_NOTEPAD_TTL = 24 * 60 * 60
+VISOR_NOTEPAD_MAX_BYTES = 256 * 1024 ** 2
+
+# notepad in which serving processes share memoized values like search form
+# choice lists and filterset layouts (see visor/memo.py), so that only the
+# first process to need one computes it. give each deployment on a host its
+# own name, or None to compute them in every process. entries are
+# recomputed after VISOR_MEMO_TIMEOUT seconds (None for never) even if no
+# signal invalidated them, to catch changes made outside Django.
+VISOR_MEMO_NOTEPAD = "visor_memo"
+VISOR_MEMO_TIMEOUT = 300